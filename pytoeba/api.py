@@ -1,7 +1,10 @@
 from django.conf.urls import url
 from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from .utils import work_as, stemmer
+from .logarchive import archived_logs, has_archive
 from .models import Sentence, Log, Correction, Tag, SentenceTag, PytoebaUser, Comment, Message
 from .search_indexes import SentenceIndex,TagIndex, CommentIndex, WallIndex, UserIndex, MessageIndex
 
@@ -13,12 +16,13 @@ from tastypie import http
 from tastypie.api import Api
 from tastypie.utils.mime import determine_format, build_content_type
 from tastypie import fields
-from tastypie.exceptions import InvalidFilterError, InvalidSortError
+from tastypie.exceptions import BadRequest, InvalidFilterError, InvalidSortError
 
 from haystack.query import SearchQuerySet, AutoQuery, SQ
 
 from types import MethodType
 from collections import defaultdict
+from datetime import datetime, time
 import inspect
 
 
@@ -269,7 +273,7 @@ class SentenceResource(PyapiResource):
                 'add', 'bulk_add', 'edit', 'delete', 'bulk_delete', 'lock',
                 'unlock', 'adopt', 'release', 'link', 'unlink', 'translate',
                 'correct', 'accept_correction', 'reject_correction', 'add_tag',
-                'delete_tag'
+                'delete_tag', 'bulk_link_pairs', 'bulk_unlink_pairs'
                 ],
             'funcs': {
                 'bulk_add': {
@@ -282,6 +286,56 @@ class SentenceResource(PyapiResource):
         }
 
 
+# lookups the log API can check archived logs against
+DATE_PARTS = ('year', 'month', 'day', 'hour', 'minute')
+
+ARCHIVE_LOOKUPS = {
+    'exact': lambda value, arg: value == arg,
+    'in': lambda value, arg: value in arg,
+    'lt': lambda value, arg: value < arg,
+    'lte': lambda value, arg: value <= arg,
+    'gt': lambda value, arg: value > arg,
+    'gte': lambda value, arg: value >= arg,
+}
+
+
+def _archive_value(field, value):
+    if field != 'done_on':
+        return value
+    done_on = parse_datetime(value)
+    if done_on is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('%s is not a date or datetime.' % value)
+        done_on = datetime.combine(day, time())
+    if timezone.is_naive(done_on):
+        done_on = timezone.make_aware(done_on, timezone.get_current_timezone())
+    return done_on
+
+
+def _archive_lookup(field, lookup, value):
+    """
+    (field, lookup, python value) for a filter of a request, to be checked
+    against archived logs.
+    """
+    if lookup in DATE_PARTS:
+        return field, lookup, int(value)
+    if lookup in ('in', 'range'):
+        value = [_archive_value(field, item) for item in value]
+        if lookup == 'range' and len(value) != 2:
+            raise ValueError('range takes two values.')
+        return field, lookup, value
+    return field, lookup, _archive_value(field, value)
+
+
+def _archive_match(value, lookup, arg):
+    if lookup in DATE_PARTS:
+        return getattr(timezone.localtime(value), lookup) == arg
+    if lookup == 'range':
+        return arg[0] <= value <= arg[1]
+    return ARCHIVE_LOOKUPS[lookup](value, arg)
+
+
 class LogResource(PyapiResource):
     sentence = fields.ForeignKey(SentenceResource, attribute='sentence')
     added_by = fields.ForeignKey('pytoeba.api.UserResource', attribute='added_by')
@@ -294,12 +348,73 @@ class LogResource(PyapiResource):
             'source_hash_id': FILTERS,
             'target_hash_id': FILTERS,
             'source_lang': FILTERS,
-            'target_land': FILTERS,
+            'target_lang': FILTERS,
             'type': FILTERS,
             'done_on': FILTERS_DATE
         }
         pyapi_funcs = {}
 
+    def obj_get_list(self, bundle, **kwargs):
+        """
+        With ?archived=1 lists the archived logs of the sentences filtered
+        on by source_hash_id or source_hash_id__in instead of live ones,
+        with the same filters applied, in id order.
+        """
+        filters = getattr(bundle.request, 'GET', {})
+        if filters.get('archived') not in ('1', 'true'):
+            return super(LogResource, self).obj_get_list(bundle, **kwargs)
+        if not has_archive():
+            raise BadRequest('There is no log archive.')
+        if 'order_by' in filters:
+            raise BadRequest('Archived logs only come in id order.')
+
+        filters = filters.copy()
+        filters.update(kwargs)
+        lookups = []
+        for expr, value in filters.iteritems():
+            bits = expr.split('__')
+            field = bits[0]
+            lookup = bits[1] if len(bits) > 1 else 'exact'
+            if field not in self._meta.filtering:
+                continue
+            if len(bits) > 2 or lookup not in self._meta.filtering[field]:
+                raise BadRequest('%s is not an allowed filter.' % expr)
+            value = self.filter_value_to_python(
+                value, field, filters, expr, lookup
+                )
+            try:
+                lookups.append(_archive_lookup(field, lookup, value))
+            except (TypeError, ValueError), e:
+                raise BadRequest('Invalid value for %s: %s' % (expr, e))
+
+        for field, lookup, value in lookups:
+            if field == 'source_hash_id' and lookup in ('exact', 'in'):
+                hash_ids = set(value) if lookup == 'in' else set([value])
+                break
+        else:
+            raise BadRequest(
+                'Archived logs are listed by source_hash_id or '
+                'source_hash_id__in.'
+                )
+
+        since = until = None
+        for field, lookup, value in lookups:
+            if field == 'done_on' and lookup in ('gt', 'gte', 'range'):
+                since = value[0] if lookup == 'range' else value
+            elif field == 'done_on' and lookup == 'lt':
+                until = value
+        refs = Sentence.objects.resolve(hash_ids)
+        logs = archived_logs(
+            [ref.id for ref in refs.itervalues()], since=since, until=until
+            )
+        return [
+            log for log in logs
+            if all(
+                _archive_match(getattr(log, field), lookup, value)
+                for field, lookup, value in lookups
+                )
+            ]
+
 
 class CorrectionResource(PyapiResource):
     sentence = fields.ForeignKey(SentenceResource, attribute='sentence')
@@ -0,0 +1,249 @@
+"""
+Streams rows straight into a table for large imports. On postgres the
+rows go through COPY FROM STDIN, as CSV or in the binary format, without
+ever being rendered into INSERT statements. Everywhere else they are
+inserted with executemany on a single prepared INSERT per batch.
+
+Rows are either model instances, whose fields are prepared the same way
+save() would, or plain tuples of values in the order of the loaded
+fields, which are handed to the database as they are.
+"""
+
+from django.db import connections, transaction
+from django.db.models import Model
+from django.db.models.fields import AutoField
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import date, datetime, time
+from decimal import Decimal
+from itertools import islice
+import struct
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def load_fields(model, fields=None):
+    """
+    The fields of model a load writes, every concrete field but the auto
+    pk by default, or the ones named in fields, by name or attname.
+    """
+    if fields is None:
+        return [f for f in model._meta.fields if not isinstance(f, AutoField)]
+
+    by_name = {}
+    for field in model._meta.fields:
+        by_name[field.name] = by_name[field.attname] = field
+    return [by_name[name] for name in fields]
+
+
+def prepared_rows(rows, fields, connection):
+    for row in rows:
+        if isinstance(row, Model):
+            row = tuple(
+                f.get_db_prep_save(f.pre_save(row, True), connection)
+                for f in fields
+                )
+        yield row
+
+
+class RowStream(object):
+    """
+    Read only file over an iterator of encoded rows, enough for
+    cursor.copy_expert() to pull the data through without it ever being
+    in memory all at once.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def csv_value(value):
+    # unquoted empty fields are NULL in postgres' CSV, quoted ones are ''
+    if value is None:
+        return b''
+    if isinstance(value, bool):
+        return b't' if value else b'f'
+    if isinstance(value, (int, long, float, Decimal)):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return b'"' + str(value).replace(b'"', b'""') + b'"'
+
+
+def csv_rows(rows):
+    for row in rows:
+        yield b','.join(csv_value(value) for value in row) + b'\n'
+
+
+PG_EPOCH = datetime(2000, 1, 1)
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_TRAILER = struct.pack('>h', -1)
+
+
+def _to_int4(value):
+    return struct.pack('>i', value)
+
+
+def _to_int8(value):
+    return struct.pack('>q', value)
+
+
+def _to_bool(value):
+    return b'\x01' if value else b'\x00'
+
+
+def _to_text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _to_timestamp(value):
+    # prepared_rows() hands over get_db_prep_save() values, which django
+    # turns into text for dates and datetimes
+    if isinstance(value, basestring):
+        value = parse_datetime(value)
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    delta = value - PG_EPOCH
+    return struct.pack(
+        '>q', (delta.days * 86400 + delta.seconds) * 1000000 +
+        delta.microseconds
+        )
+
+
+def _to_date(value):
+    if isinstance(value, basestring):
+        value = parse_date(value)
+    return struct.pack('>i', (value - PG_EPOCH.date()).days)
+
+
+BINARY_ENCODERS = {
+    'AutoField': _to_int4,
+    'IntegerField': _to_int4,
+    'PositiveIntegerField': _to_int4,
+    'BigIntegerField': _to_int8,
+    'BooleanField': _to_bool,
+    'NullBooleanField': _to_bool,
+    'CharField': _to_text,
+    'TextField': _to_text,
+    'SlugField': _to_text,
+    'EmailField': _to_text,
+    'FileField': _to_text,
+    'DateTimeField': _to_timestamp,
+    'DateField': _to_date,
+}
+
+
+def binary_encoders(fields):
+    encoders = []
+    for field in fields:
+        if field.rel is not None:
+            field = field.rel.get_related_field()
+        internal_type = field.get_internal_type()
+        if internal_type not in BINARY_ENCODERS:
+            raise ValueError(
+                'No binary COPY encoding for %s, use the csv format.' %
+                internal_type
+                )
+        encoders.append(BINARY_ENCODERS[internal_type])
+    return encoders
+
+
+def binary_rows(rows, fields):
+    encoders = binary_encoders(fields)
+    count = struct.pack('>h', len(encoders))
+    null = struct.pack('>i', -1)
+
+    yield BINARY_HEADER
+    for row in rows:
+        parts = [count]
+        for encode, value in zip(encoders, row):
+            if value is None:
+                parts.append(null)
+            else:
+                data = encode(value)
+                parts.append(struct.pack('>i', len(data)))
+                parts.append(data)
+        yield b''.join(parts)
+    yield BINARY_TRAILER
+
+
+def copy_rows(connection, table, columns, fields, rows, format='csv'):
+    # older psycopg2 versions don't report a rowcount for COPY
+    loaded = [0]
+
+    def counted(rows):
+        for row in rows:
+            loaded[0] += 1
+            yield row
+
+    rows = counted(rows)
+    if format == 'binary':
+        stream = RowStream(binary_rows(rows, fields))
+        options = 'BINARY'
+    else:
+        stream = RowStream(csv_rows(rows))
+        options = 'CSV'
+
+    sql = 'COPY %s (%s) FROM STDIN WITH %s' % (
+        table, ', '.join(columns), options
+        )
+    connection.cursor().cursor.copy_expert(sql, stream)
+    return loaded[0]
+
+
+def insert_rows(connection, table, columns, rows, batch_size=None):
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns))
+        )
+    cursor = connection.cursor()
+    rows = iter(rows)
+    loaded = 0
+    while True:
+        batch = list(islice(rows, batch_size or DEFAULT_BATCH_SIZE))
+        if not batch:
+            break
+        cursor.executemany(sql, batch)
+        loaded += len(batch)
+    return loaded
+
+
+def bulk_load(model, rows, fields=None, using='default', format='csv',
+              batch_size=None):
+    """
+    Loads rows, an iterable of model instances or tuples, into the table
+    of model in one transaction and returns how many were loaded. Nothing
+    goes through save() or signals and instances don't get their pks set.
+    format picks between 'csv' and 'binary' for postgres' COPY,
+    batch_size is the number of rows per executemany() elsewhere.
+    """
+    connection = connections[using]
+    fields = load_fields(model, fields)
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    columns = [qn(f.column) for f in fields]
+    rows = prepared_rows(rows, fields, connection)
+
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            return copy_rows(connection, table, columns, fields, rows, format)
+        return insert_rows(connection, table, columns, rows, batch_size)
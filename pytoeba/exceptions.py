@@ -27,3 +27,33 @@ class NotEditableError(PytoebaError):
     is_editable attribute/field being set to false.
     """
     pass
+
+
+class DuplicateSentenceError(PytoebaError):
+    """
+    Raised when sentences that are added already exist, or are given
+    more than once, with the same text and language. The offending
+    (text, lang) pairs are in the duplicates attribute.
+    """
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        super(DuplicateSentenceError, self).__init__(
+            'Duplicate sentences: %s' % ', '.join(
+                '%s (%s)' % (text, lang) for text, lang in duplicates
+                )
+            )
+
+
+class NearDuplicateError(PytoebaError):
+    """
+    Raised when sentences that are added are within
+    PYTOEBA_NEAR_DUPLICATE_DISTANCE bits of the simhash of existing
+    ones, or of earlier ones added with them. The duplicates attribute
+    maps each rejected text to the sentences, and texts of the same
+    batch, it is too close to.
+    """
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        super(NearDuplicateError, self).__init__(
+            'Near duplicate sentences: %s' % ', '.join(duplicates)
+            )
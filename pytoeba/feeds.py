@@ -0,0 +1,173 @@
+"""
+Activity feeds per user and per language, kept as ring buffers of the
+last PYTOEBA_FEED_SIZE log ids in the FeedEntry table. A page of a feed
+is one indexed range read on (feed, position) and one pk lookup of its
+logs, however big the Log table is.
+
+Logs are fanned out by update_feeds(), which follows the Log table by id
+the same way graph snapshots are updated, so logs written in bulk or
+straight in the database get into the feeds too. Run a single instance
+of the update_feeds command to keep them current.
+
+Ids are handed out before commit, so a log can show up after ones with
+higher ids. The cursor never moves past a log done less than
+PYTOEBA_FEED_LAG seconds ago, which has to be longer than the longest
+transaction writing logs, or a log committed that late is never fanned
+out.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.loading import get_model
+
+from .utils import bulk_upsert, now
+from collections import OrderedDict
+from datetime import timedelta
+
+
+# Feed row holding the id of the last log fanned out
+LOG_CURSOR = 'log'
+
+
+def get_feed_size():
+    return getattr(settings, 'PYTOEBA_FEED_SIZE', 1000)
+
+
+def get_feed_lag():
+    return getattr(settings, 'PYTOEBA_FEED_LAG', 10)
+
+
+def user_feed_key(user_id):
+    return 'user:%s' % user_id
+
+
+def lang_feed_key(lang):
+    return 'lang:%s' % lang
+
+
+def _fan_out(rows, heads, size):
+    """
+    FeedEntries for rows of (log id, user id, lang, done_on), appended to
+    feeds whose positions are in heads, which is updated in place. Only
+    the last size logs of a feed can survive so earlier ones are skipped.
+    """
+    feeds = OrderedDict()
+    for log_id, user_id, lang, done_on in rows:
+        keys = [user_feed_key(user_id)]
+        if lang:
+            keys.append(lang_feed_key(lang))
+        for key in keys:
+            feeds.setdefault(key, []).append((log_id, done_on))
+
+    FeedEntry = get_model('pytoeba', 'FeedEntry')
+    entries = []
+    for key, logs in feeds.iteritems():
+        position = heads.get(key, 0) + max(len(logs) - size, 0)
+        for log_id, done_on in logs[-size:]:
+            position += 1
+            entries.append(
+                FeedEntry(
+                    feed=key, slot=position % size, position=position,
+                    log_id=log_id, done_on=done_on
+                    )
+                )
+        heads[key] = position
+    return entries
+
+
+def update_feeds(batch_size=1000, lag=None, using='default'):
+    """
+    Appends the logs written since the last run to the feeds of the user
+    who did them and of the language of their sentence, a batch at a
+    time, stopping at the first log done less than lag seconds ago.
+    Returns the number of logs fanned out.
+    """
+    Log = get_model('pytoeba', 'Log')
+    Feed = get_model('pytoeba', 'Feed')
+    size = get_feed_size()
+    lag = get_feed_lag() if lag is None else lag
+    feeds = Feed.objects.using(using)
+    cursor, _ = feeds.get_or_create(key=LOG_CURSOR)
+    done = 0
+
+    while True:
+        horizon = now() - timedelta(seconds=lag)
+        rows = list(
+            Log.objects.using(using).filter(id__gt=cursor.position)
+               .order_by('id')
+               .values_list(
+                   'id', 'done_by', 'source_lang', 'sentence__lang', 'done_on'
+                   )[:batch_size]
+            )
+        fetched = len(rows)
+        # logs with lower ids may still be uncommitted behind recent ones
+        ready = 0
+        while ready < fetched and rows[ready][4] < horizon:
+            ready += 1
+        if not ready:
+            break
+        # logs like sad don't carry a source_lang, their sentence does
+        rows = [
+            (log_id, user_id, source_lang or lang, done_on)
+            for log_id, user_id, source_lang, lang, done_on in rows[:ready]
+            ]
+
+        with transaction.atomic(using=using):
+            keys = set(user_feed_key(row[1]) for row in rows)
+            keys.update(lang_feed_key(row[2]) for row in rows if row[2])
+            heads = dict(
+                feeds.filter(key__in=keys).values_list('key', 'position')
+                )
+            entries = _fan_out(rows, heads, size)
+            bulk_upsert(entries, case_field=['feed', 'slot'], using=using)
+
+            cursor.position = rows[-1][0]
+            heads[LOG_CURSOR] = cursor.position
+            bulk_upsert(
+                [Feed(key=key, position=position)
+                 for key, position in heads.iteritems()],
+                case_field='key', using=using
+                )
+        done += len(rows)
+        if ready < fetched:
+            break
+    return done
+
+
+def rebuild_feeds(batch_size=1000, lag=None, using='default'):
+    """
+    Empties every feed and fans out the whole Log table again, to
+    backfill them or after changing PYTOEBA_FEED_SIZE.
+    """
+    Feed = get_model('pytoeba', 'Feed')
+    FeedEntry = get_model('pytoeba', 'FeedEntry')
+    with transaction.atomic(using=using):
+        FeedEntry.objects.using(using).all().delete()
+        Feed.objects.using(using).all().delete()
+    return update_feeds(batch_size, lag, using)
+
+
+def get_feed(key, page=1, per_page=20, using='default'):
+    """
+    A page of a feed as Log instances, newest first. Logs archived or
+    gone since they were fanned out are left out.
+    """
+    Log = get_model('pytoeba', 'Log')
+    FeedEntry = get_model('pytoeba', 'FeedEntry')
+    start = (page - 1) * per_page
+    ids = list(
+        FeedEntry.objects.using(using).filter(feed=key)
+                 .order_by('-position')
+                 .values_list('log_id', flat=True)[start:start + per_page]
+        )
+    logs = Log.objects.using(using).in_bulk(ids)
+    return [logs[log_id] for log_id in ids if log_id in logs]
+
+
+def user_feed(user, page=1, per_page=20, using='default'):
+    user_id = getattr(user, 'pk', user)
+    return get_feed(user_feed_key(user_id), page, per_page, using)
+
+
+def lang_feed(lang, page=1, per_page=20, using='default'):
+    return get_feed(lang_feed_key(lang), page, per_page, using)
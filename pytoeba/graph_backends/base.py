@@ -1,10 +1,18 @@
 
 
+from django.conf import settings
+
+
 class BaseGraphBackend(object):
 
     def __init__(self, links=[], **kwargs):
         self.init_kwargs = kwargs
         self.links = links
+        # pairs further apart than this are neither computed nor stored,
+        # None means no limit
+        self.max_level = kwargs.get(
+            'max_level', getattr(settings, 'PYTOEBA_MAX_LINK_LEVEL', None)
+            )
         self.lib_init()
         self.graph_init()
         self.populate_graph()
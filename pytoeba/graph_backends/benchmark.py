@@ -0,0 +1,216 @@
+"""
+Synthetic clusters and a timing harness for comparing graph backends.
+Every case runs in a fresh process so the peak RSS it reports belongs to
+that case alone. See the benchmark_graph_backends command.
+"""
+
+from multiprocessing import Pool
+from importlib import import_module
+from random import Random
+import resource
+import time
+
+
+BACKENDS = {
+    'networkx': 'pytoeba.graph_backends.networkx_backend.NetworkxBackend',
+    'scipy_sparse': 'pytoeba.graph_backends.scipy_backend.SciPySparseBackend',
+    'scipy_dense': 'pytoeba.graph_backends.scipy_backend.SciPyDenseBackend',
+    'csgraph': 'pytoeba.graph_backends.csgraph_backend.CSGraphBackend',
+    'incremental':
+        'pytoeba.graph_backends.incremental_backend.IncrementalBackend',
+}
+
+SHAPES = ['power_law', 'star', 'chain', 'clique']
+
+SIZES = [10, 100, 1000, 10000, 50000]
+
+FIELDS = [
+    'backend', 'shape', 'nodes', 'edges', 'pairs', 'populate', 'add_edge',
+    'remove_edge', 'recompute', 'created', 'updated', 'deleted',
+    'start_rss_kb', 'peak_rss_kb', 'status'
+    ]
+
+
+def power_law_edges(size, rand, attach=2):
+    """
+    Barabasi-Albert preferential attachment, degrees end up following a
+    power law like they do in the real translation graph.
+    """
+    edges = set()
+    seeds = min(attach, size)
+    # every node is in here once per edge it has, seeds once to start with,
+    # so picking from it picks proportionally to degree
+    degrees = range(1, seeds + 1)
+    for node in xrange(seeds + 1, size + 1):
+        chosen = set()
+        while len(chosen) < seeds:
+            chosen.add(rand.choice(degrees))
+        for target in chosen:
+            edges.add((target, node))
+            degrees.extend((target, node))
+    return edges
+
+
+def star_edges(size, rand):
+    return set((1, node) for node in xrange(2, size + 1))
+
+
+def chain_edges(size, rand):
+    return set((node, node + 1) for node in xrange(1, size))
+
+
+def clique_edges(size, rand):
+    return set(
+        (node1, node2)
+        for node1 in xrange(1, size + 1)
+        for node2 in xrange(node1 + 1, size + 1)
+        )
+
+
+SHAPE_EDGES = {
+    'power_law': power_law_edges,
+    'star': star_edges,
+    'chain': chain_edges,
+    'clique': clique_edges,
+}
+
+
+def estimate_pairs(shape, size, max_level=None):
+    """
+    Upper bound on the Link rows a cluster stores, used to skip cases
+    before spending any time or memory on them.
+    """
+    pairs = size * (size - 1)
+    if max_level is None:
+        return pairs
+    if shape == 'chain':
+        return min(pairs, 2 * size * max_level)
+    if shape == 'star' and max_level == 1:
+        return 2 * (size - 1)
+    return pairs
+
+
+def _load_backend(path):
+    module, cls = path.rsplit('.', 1)
+    return getattr(import_module(module), cls)
+
+
+def _peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(backend, shape, size, edits=10, max_level=None, seed=0):
+    """
+    Times one backend on one synthetic cluster. The stored links are the
+    full closure of the cluster, then edits edges are added and as many
+    removed, both ways like real links, before the links are recomputed.
+    """
+    from pytoeba.utils import LinkTuple, closure_levels
+
+    result = dict((field, None) for field in FIELDS)
+    result.update(
+        backend=backend, shape=shape, nodes=size, start_rss_kb=_peak_rss()
+        )
+    rand = Random(seed)
+
+    try:
+        backend_class = _load_backend(BACKENDS.get(backend, backend))
+    except ImportError, e:
+        result['status'] = 'unavailable: %s' % e
+        return result
+
+    edges = SHAPE_EDGES[shape](size, rand)
+    rows = closure_levels(xrange(1, size + 1), edges, max_level)
+    links = [
+        LinkTuple(rows[i], rows[i + 1], rows[i + 2], i // 3 + 1)
+        for i in xrange(0, len(rows), 3)
+        ]
+    result.update(edges=len(edges), pairs=len(links))
+    del rows
+
+    nodes = range(1, size + 1)
+    added = set()
+    while len(added) < min(edits, size * (size - 1) // 2 - len(edges)):
+        node1, node2 = sorted(rand.sample(nodes, 2))
+        if (node1, node2) not in edges:
+            added.add((node1, node2))
+    removed = rand.sample(sorted(edges), min(edits, len(edges)))
+
+    try:
+        start = time.time()
+        graph = backend_class(links, max_level=max_level)
+        result['populate'] = time.time() - start
+
+        start = time.time()
+        for node1, node2 in added:
+            graph.add_edge(node1, node2)
+            graph.add_edge(node2, node1)
+        result['add_edge'] = time.time() - start
+
+        start = time.time()
+        for node1, node2 in removed:
+            graph.remove_edge(node1, node2)
+            graph.remove_edge(node2, node1)
+        result['remove_edge'] = time.time() - start
+
+        start = time.time()
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        result['recompute'] = time.time() - start
+    except Exception, e:
+        result['status'] = 'error: %s: %s' % (e.__class__.__name__, e)
+        result['peak_rss_kb'] = _peak_rss()
+        return result
+
+    for key in ('created', 'updated', 'deleted'):
+        result[key] = len(recomputed[key])
+    result['peak_rss_kb'] = _peak_rss()
+    result['status'] = 'ok'
+    return result
+
+
+def _run_case(kwargs):
+    return run_case(**kwargs)
+
+
+def run_benchmarks(backends, shapes, sizes, edits=10, max_level=None,
+                   max_pairs=5000000, seed=0):
+    """
+    Yields one result dict per backend, shape and size. Cases whose
+    closure would be bigger than max_pairs are reported as skipped
+    without being run.
+    """
+    for shape in shapes:
+        for size in sizes:
+            pairs = estimate_pairs(shape, size, max_level)
+            for backend in backends:
+                case = {
+                    'backend': backend, 'shape': shape, 'size': size,
+                    'edits': edits, 'max_level': max_level, 'seed': seed
+                }
+                if pairs > max_pairs:
+                    yield _failed_case(case, 'skipped: ~%d pairs' % pairs)
+                    continue
+
+                # a fresh process per case, otherwise ru_maxrss would carry
+                # the peak of every case run before it
+                pool = Pool(1)
+                try:
+                    yield pool.apply(_run_case, (case,))
+                except Exception, e:
+                    yield _failed_case(
+                        case, 'error: %s: %s' % (e.__class__.__name__, e)
+                        )
+                finally:
+                    pool.close()
+                    pool.join()
+
+
+def _failed_case(case, status):
+    result = dict((field, None) for field in FIELDS)
+    result.update(
+        backend=case['backend'], shape=case['shape'], nodes=case['size'],
+        status=status
+        )
+    return result
@@ -0,0 +1,158 @@
+from django.db.models.loading import get_model
+from .base import BaseGraphBackend
+from itertools import chain
+import numpy as np
+
+
+class CSGraphBackend(BaseGraphBackend):
+    """
+    Backend built only on numpy and scipy.sparse.csgraph. Edges are kept in
+    a set so edits stay cheap and the sparse matrix is only built when the
+    distances are needed. The levels stored on the given links serve as
+    the old distances, the diff against the new ones is done on whole
+    arrays rather than per link. With a max_level the searches stop at it
+    and anything further away comes back as unreachable.
+    """
+
+    def get_graph_lib(self):
+        from scipy.sparse import csgraph
+        return csgraph
+
+    def get_graph(self):
+        return set()
+
+    def add_node(self, node, **kwargs):
+        self.extra_nodes.add(node)
+
+    def remove_node(self, node):
+        self.graph = set(edge for edge in self.graph if node not in edge)
+        self.extra_nodes.discard(node)
+
+    def add_edge(self, node1, node2, **kwargs):
+        self.graph.add((node1, node2))
+
+    def remove_edge(self, node1, node2):
+        self.graph.discard((node1, node2))
+
+    def _link_array(self, links):
+        # np.array() on a list of tuples goes through the sequence protocol
+        # for every row which is painfully slow, fromiter on a flat stream
+        # is an order of magnitude faster
+        if not (links and isinstance(links[0], tuple)):
+            links = [(l.side1_id, l.side2_id, l.level, l.id) for l in links]
+        link_array = np.fromiter(
+            chain.from_iterable(links), dtype=np.int64, count=4 * len(links)
+            )
+        return link_array.reshape(-1, 4)
+
+    def populate_graph(self, links=[]):
+        if links:
+            self.links = links
+        else:
+            links = self.links
+
+        self.graph = self.get_graph()
+        self.extra_nodes = set()
+        self.link_array = self._link_array(links)
+
+        direct = self.link_array[self.link_array[:, 2] == 1]
+        self.graph.update(zip(direct[:, 0].tolist(), direct[:, 1].tolist()))
+
+    def _build_matrix(self):
+        from scipy.sparse import csr_matrix
+
+        edges = np.array(list(self.graph), dtype=np.int64).reshape(-1, 2)
+        extra = np.array(list(self.extra_nodes), dtype=np.int64)
+        link_count = len(self.link_array)
+
+        # one pass maps every sentence id we know of to a matrix index,
+        # inverse comes back in the same order the ids were concatenated
+        self.nodes_array, inverse = np.unique(
+            np.concatenate((
+                self.link_array[:, 0], self.link_array[:, 1], edges.ravel(),
+                extra
+                )),
+            return_inverse=True
+            )
+        self.link_side1 = inverse[:link_count]
+        self.link_side2 = inverse[link_count:2 * link_count]
+        edges = inverse[2 * link_count:2 * link_count + edges.size]
+        edges = edges.reshape(-1, 2)
+
+        size = len(self.nodes_array)
+        return csr_matrix(
+            (np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])),
+            shape=(size, size)
+            )
+
+    def get_all_distances(self):
+        if self.max_level is not None:
+            return self.lib.dijkstra(
+                self._build_matrix(), directed=True, unweighted=True,
+                limit=self.max_level
+                )
+        return self.lib.shortest_path(
+            self._build_matrix(), directed=True, unweighted=True
+            )
+
+    def _links_from_arrays(self, side1, side2, levels, ids=None):
+        Link = get_model('pytoeba', 'Link')
+        # tolist() hands back python ints, numpy scalars make db adapters
+        # choke
+        side1 = self.nodes_array[side1].tolist()
+        side2 = self.nodes_array[side2].tolist()
+        levels = levels.astype(np.int64).tolist()
+
+        if ids is None:
+            return [
+                Link(side1_id=s1, side2_id=s2, level=level)
+                for s1, s2, level in zip(side1, side2, levels)
+                ]
+
+        return [
+            Link(side1_id=s1, side2_id=s2, level=level, id=link_id)
+            for s1, s2, level, link_id in zip(side1, side2, levels, ids.tolist())
+            ]
+
+    def get_recomputed_links(self, created=False, updated=False, deleted=False):
+        distances = self.get_all_distances()
+        side1, side2 = self.link_side1, self.link_side2
+        stored_levels = self.link_array[:, 2]
+        link_ids = self.link_array[:, 3]
+
+        new_levels = distances[side1, side2]
+        gone = np.isinf(new_levels)
+        changed = ~gone & (new_levels != stored_levels)
+
+        stored = np.zeros(distances.shape, dtype=bool)
+        stored[side1, side2] = True
+        np.fill_diagonal(stored, True)
+        new = np.isfinite(distances) & ~stored
+        new_side1, new_side2 = np.nonzero(new)
+
+        return_dict = {}
+        all_ = not (created or updated or deleted)
+
+        if created or all_:
+            return_dict['created'] = self._links_from_arrays(
+                new_side1, new_side2, distances[new_side1, new_side2]
+                )
+
+        if updated or all_:
+            return_dict['updated'] = self._links_from_arrays(
+                side1[changed], side2[changed], new_levels[changed],
+                link_ids[changed]
+                )
+
+        if deleted or all_:
+            return_dict['deleted'] = self._links_from_arrays(
+                side1[gone], side2[gone], stored_levels[gone], link_ids[gone]
+                )
+
+        if all_:
+            return_dict = {
+                'all': return_dict['created'] + return_dict['updated'] +
+                       return_dict['deleted']
+            }
+
+        return return_dict
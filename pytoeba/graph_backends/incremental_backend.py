@@ -0,0 +1,214 @@
+from django.db.models.loading import get_model
+from .base import BaseGraphBackend
+from collections import defaultdict, deque
+
+
+class IncrementalBackend(BaseGraphBackend):
+    """
+    Pure python backend that never runs an all pairs computation. The
+    levels stored on the Link rows it is handed are taken as the current
+    distances and each add_edge/remove_edge only revisits the pairs it can
+    possibly change. This means it has to be given every Link row of the
+    components being edited, not just the direct links. With a max_level
+    only the rows up to it are needed, which is all that gets stored.
+    """
+
+    def get_graph_lib(self):
+        return None
+
+    def get_graph(self):
+        return defaultdict(set)
+
+    def add_node(self, node, **kwargs):
+        self.graph[node]
+
+    def remove_node(self, node):
+        for node2 in list(self.graph[node]):
+            self.remove_edge(node, node2)
+        for node1 in list(self.pred[node]):
+            self.remove_edge(node1, node)
+        del self.graph[node]
+
+    def populate_graph(self, links=[]):
+        if links:
+            self.links = links
+        else:
+            links = self.links
+
+        self.graph = self.get_graph()
+        self.pred = defaultdict(set)
+        self.distances = defaultdict(dict)
+        self.reverse_distances = defaultdict(dict)
+        # original level of every pair touched so far, None if it had no row
+        self.dirty = {}
+
+        max_level = self.max_level
+        for link in links:
+            node1, node2 = link.side1_id, link.side2_id
+            if max_level is not None and link.level > max_level:
+                # left over from a higher max_level, diffs as deleted
+                self.dirty[(node1, node2)] = link.level
+                continue
+            self.distances[node1][node2] = link.level
+            self.reverse_distances[node2][node1] = link.level
+            if link.level == 1:
+                self.graph[node1].add(node2)
+                self.pred[node2].add(node1)
+
+    def _touch(self, node1, node2):
+        if (node1, node2) not in self.dirty:
+            self.dirty[(node1, node2)] = self.distances[node1].get(node2)
+
+    def _set_level(self, node1, node2, level):
+        self._touch(node1, node2)
+        self.distances[node1][node2] = level
+        self.reverse_distances[node2][node1] = level
+
+    def _unset_level(self, node1, node2):
+        self._touch(node1, node2)
+        del self.distances[node1][node2]
+        del self.reverse_distances[node2][node1]
+
+    def add_edge(self, node1, node2, **kwargs):
+        """
+        Only pairs (x, y) where x reaches node1 and node2 reaches y can get
+        closer, and only through x -> node1 -> node2 -> y. Sources that
+        already reach node2 at least as fast as through the new edge are
+        skipped entirely since nothing behind node2 can improve for them.
+        Under a max_level both halves of a new path have to be shorter than
+        it, so the truncated rows hold everything needed.
+        """
+        if node2 in self.graph[node1]:
+            return
+
+        self.graph[node1].add(node2)
+        self.pred[node2].add(node1)
+
+        max_level = self.max_level
+        if max_level is None:
+            max_level = float('inf')
+
+        sources = dict(self.reverse_distances[node1])
+        sources[node1] = 0
+        targets = dict(self.distances[node2])
+        targets[node2] = 0
+
+        for source, to_node1 in sources.iteritems():
+            through = to_node1 + 1
+            row = self.distances[source]
+            if through > max_level or source == node2 or \
+                    row.get(node2, through + 1) <= through:
+                continue
+
+            for target, from_node2 in targets.iteritems():
+                if target == source:
+                    continue
+                level = through + from_node2
+                if level <= max_level and row.get(target, level + 1) > level:
+                    self._set_level(source, target, level)
+
+    def remove_edge(self, node1, node2):
+        """
+        A source can only lose or lengthen paths if the removed edge was on
+        one of its shortest paths to node2, which is exactly when its level
+        to node2 is its level to node1 plus one. Only those rows are
+        recomputed with a BFS, everything else is left as it was.
+        """
+        if node2 not in self.graph[node1]:
+            return
+
+        self.graph[node1].discard(node2)
+        self.pred[node2].discard(node1)
+
+        sources = dict(self.reverse_distances[node1])
+        sources[node1] = 0
+
+        for source, to_node1 in sources.iteritems():
+            if self.distances[source].get(node2) == to_node1 + 1:
+                self._rebuild_row(source)
+
+    def _bfs(self, source):
+        max_level = self.max_level
+        levels = {source: 0}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            level = levels[node] + 1
+            if max_level is not None and level > max_level:
+                break
+            for next_node in self.graph[node]:
+                if next_node not in levels:
+                    levels[next_node] = level
+                    queue.append(next_node)
+
+        del levels[source]
+        return levels
+
+    def _rebuild_row(self, source):
+        levels = self._bfs(source)
+        row = self.distances[source]
+
+        for target in [t for t in row if t not in levels]:
+            self._unset_level(source, target)
+
+        for target, level in levels.iteritems():
+            if row.get(target) != level:
+                self._set_level(source, target, level)
+
+    def get_all_distances(self):
+        return self.distances
+
+    def _diff_links(self):
+        Link = get_model('pytoeba', 'Link')
+        created, updated, deleted = [], [], []
+
+        changed = dict(
+            (pair, original) for pair, original in self.dirty.iteritems()
+            if self.distances[pair[0]].get(pair[1]) != original
+            )
+        link_ids = dict(
+            ((link.side1_id, link.side2_id), link.id) for link in self.links
+            if (link.side1_id, link.side2_id) in changed
+            )
+
+        for (node1, node2), original in changed.iteritems():
+            level = self.distances[node1].get(node2)
+
+            if original is None:
+                created.append(
+                    Link(side1_id=node1, side2_id=node2, level=level)
+                    )
+            elif level is None:
+                deleted.append(
+                    Link(
+                        side1_id=node1, side2_id=node2, level=original,
+                        id=link_ids[(node1, node2)]
+                        )
+                    )
+            else:
+                updated.append(
+                    Link(
+                        side1_id=node1, side2_id=node2, level=level,
+                        id=link_ids[(node1, node2)]
+                        )
+                    )
+
+        return created, updated, deleted
+
+    def get_recomputed_links(self, created=False, updated=False, deleted=False):
+        created_links, updated_links, deleted_links = self._diff_links()
+
+        return_dict = {}
+        if created:
+            return_dict['created'] = created_links
+
+        if updated:
+            return_dict['updated'] = updated_links
+
+        if deleted:
+            return_dict['deleted'] = deleted_links
+
+        if not return_dict:
+            return_dict['all'] = created_links + updated_links + deleted_links
+
+        return return_dict
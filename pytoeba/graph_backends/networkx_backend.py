@@ -35,18 +35,26 @@ class NetworkxBackend(BaseGraphBackend):
             self.add_node(node)
 
         self.links_dict = NestedDict()
+        # the stored levels are the old distances, rows past max_level
+        # left over from a higher setting then simply diff as deleted
+        self.stored_distances = set()
         for link in links:
             if link.level == 1:
                 self.add_edge(link.side1_id, link.side2_id)
             self.links_dict[link.side1_id][link.side2_id]['id'] = link.id
-
-        self.original_distances = self.get_all_distances()
+            self.stored_distances.add(
+                (link.side1_id, link.side2_id, link.level, link.id)
+                )
 
     def get_all_paths(self):
-        return self.lib.all_pairs_shortest_path(self.graph)
+        return self.lib.all_pairs_shortest_path(
+            self.graph, cutoff=self.max_level
+            )
 
     def get_all_distances(self):
-        return self.lib.all_pairs_shortest_path_length(self.graph)
+        return self.lib.all_pairs_shortest_path_length(
+            self.graph, cutoff=self.max_level
+            )
 
     def _tuplize_distances(self, distances):
         tuples = set()
@@ -79,32 +87,35 @@ class NetworkxBackend(BaseGraphBackend):
         return links
 
     def get_recomputed_links(self, created=False, updated=False, deleted=False):
-        old_distances, _ = self._tuplize_distances(self.original_distances)
+        old_distances = self.stored_distances
 
         new_distances, created_distances = self._tuplize_distances(self.get_all_distances())
+        # a pair whose level changed is an update, only pairs that are gone
+        # altogether are deletes
+        new_pairs = set((d[0], d[1]) for d in new_distances)
+        updated_distances = new_distances - old_distances
+        deleted_distances = [
+            d for d in old_distances if (d[0], d[1]) not in new_pairs
+            ]
 
         return_dict = {}
         if created:
             return_dict['created'] = self._links_from_tuples(created_distances, link_id=False)
 
         if updated:
-            updated_distances = new_distances - old_distances
             return_dict['updated'] = self._links_from_tuples(updated_distances)
 
         if deleted:
-            deleted_distances = old_distances - new_distances
             return_dict['deleted'] = self._links_from_tuples(deleted_distances)
 
         if not return_dict:
             created_links = self._links_from_tuples(created_distances, link_id=False)
-            updated_distances = new_distances - old_distances
             updated_links = self._links_from_tuples(updated_distances)
-            deleted_distances = old_distances - new_distances
             deleted_links = self._links_from_tuples(deleted_distances)
             all_ = []
             all_.extend(created_links)
             all_.extend(updated_links)
             all_.extend(deleted_links)
-            return_dict['all'] = self._links_from_tuples(all_)
+            return_dict['all'] = all_
 
         return return_dict
@@ -84,7 +84,12 @@ class SciPySparseBackend(BaseGraphBackend):
         self.original_distances = self.get_all_distances()
 
     def get_all_distances(self):
-        return self.graph.findAllDistances()
+        distances = self.graph.findAllDistances()
+        # apgl has no depth limit, pairs past max_level are dropped after
+        # the fact so at least they never get stored
+        if self.max_level is not None:
+            distances[distances > self.max_level] = np.inf
+        return distances
 
     def _links_from_indices(self, indices):
         Link = get_model('pytoeba', 'Link')
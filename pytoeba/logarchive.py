@@ -0,0 +1,177 @@
+"""
+Moves old Log rows out of the database into gzipped NDJSON segment files,
+one log per line, and reads them back.
+
+Segments are written once, next to each other in PYTOEBA_LOG_ARCHIVE,
+and never touched again. Every archive_logs() run adds new ones. The
+LogArchive table keeps one row per sentence and segment, so the archived
+logs of a few sentences are found without opening every segment.
+
+A segment is published by renaming it into place before its index rows
+are written and its logs deleted, all of that in one transaction. If a
+run dies in between, the next one archives the same logs again and the
+reader drops the duplicates by id.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.loading import get_model
+from django.utils.dateparse import parse_datetime
+
+from .utils import QUERY_CHUNK_SIZE, bulk_create, chunks
+import gzip
+import json
+import os
+import tempfile
+
+
+LOG_FIELDS = [
+    'id', 'sentence_id', 'type', 'done_by_id', 'done_on', 'change_set',
+    'target_id', 'source_hash_id', 'target_hash_id', 'source_lang',
+    'target_lang'
+    ]
+
+DEFAULT_SEGMENT_SIZE = 100000
+
+
+def get_archive_path(path=None):
+    path = path or getattr(settings, 'PYTOEBA_LOG_ARCHIVE', None)
+    if not path:
+        raise ValueError('No log archive, set PYTOEBA_LOG_ARCHIVE.')
+    return path
+
+
+def has_archive():
+    return bool(getattr(settings, 'PYTOEBA_LOG_ARCHIVE', None))
+
+
+def _log_rows(before, using, chunk_size):
+    Log = get_model('pytoeba', 'Log')
+    logs = Log.objects.using(using).filter(done_on__lt=before).order_by('id')
+    last_id = 0
+    while True:
+        rows = list(
+            logs.filter(id__gt=last_id).values_list(*LOG_FIELDS)[:chunk_size]
+            )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for row in rows:
+            yield row
+
+
+def _write_segment(path, rows):
+    """
+    Writes rows into a new segment and returns its name, the ids of the
+    logs in it and, per sentence, the span of its logs.
+    """
+    spans = {}
+    ids = []
+    handle, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=path)
+    with os.fdopen(handle, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as segment:
+            for row in rows:
+                log = dict(zip(LOG_FIELDS, row))
+                done_on = log['done_on']
+                first, last = spans.get(log['sentence_id'], (done_on, done_on))
+                spans[log['sentence_id']] = (
+                    min(first, done_on), max(last, done_on)
+                    )
+                ids.append(log['id'])
+
+                log['done_on'] = done_on.isoformat()
+                segment.write(json.dumps(log) + '\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    if not ids:
+        os.remove(tmp_path)
+        return None, ids, spans
+
+    name = 'logs-%d-%d.ndjson.gz' % (ids[0], ids[-1])
+    os.rename(tmp_path, os.path.join(path, name))
+    return name, ids, spans
+
+
+def archive_logs(before, path=None, using='default',
+                 segment_size=DEFAULT_SEGMENT_SIZE, chunk_size=None):
+    """
+    Moves every log done before the given datetime into segments of at
+    most segment_size logs. Returns how many logs were archived.
+    """
+    Log = get_model('pytoeba', 'Log')
+    LogArchive = get_model('pytoeba', 'LogArchive')
+    path = get_archive_path(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    rows = _log_rows(before, using, chunk_size or QUERY_CHUNK_SIZE)
+    archived = 0
+    while True:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= segment_size:
+                break
+        name, ids, spans = _write_segment(path, batch)
+        if name is None:
+            break
+
+        with transaction.atomic(using=using):
+            bulk_create([
+                LogArchive(
+                    sentence_id=sentence_id, segment=name,
+                    first_done_on=first, last_done_on=last
+                    )
+                for sentence_id, (first, last) in spans.iteritems()
+                ], using=using)
+            # only what made it into the segment, logs committed late
+            # inside its id range are left for the next run
+            for chunk in chunks(ids, QUERY_CHUNK_SIZE):
+                Log.objects.using(using).filter(id__in=chunk).delete()
+
+        archived += len(batch)
+        if len(batch) < segment_size:
+            break
+    return archived
+
+
+def _read_segment(path, name):
+    Log = get_model('pytoeba', 'Log')
+    with gzip.open(os.path.join(path, name), 'rb') as segment:
+        for line in segment:
+            log = json.loads(line)
+            log['done_on'] = parse_datetime(log['done_on'])
+            yield Log(**log)
+
+
+def archived_logs(sentence_ids=None, since=None, until=None, path=None,
+                  using='default'):
+    """
+    Unsaved Log instances for the archived logs of the given sentence ids,
+    or of every sentence, done between since and until, in id order.
+    """
+    LogArchive = get_model('pytoeba', 'LogArchive')
+    path = get_archive_path(path)
+    index = LogArchive.objects.using(using)
+    if sentence_ids is not None:
+        sentence_ids = set(sentence_ids)
+        index = index.filter(sentence_id__in=sentence_ids)
+    if since is not None:
+        index = index.filter(last_done_on__gte=since)
+    if until is not None:
+        index = index.filter(first_done_on__lt=until)
+    segments = set(index.values_list('segment', flat=True))
+
+    logs = {}
+    for name in segments:
+        for log in _read_segment(path, name):
+            if sentence_ids is not None and \
+               log.sentence_id not in sentence_ids:
+                continue
+            if since is not None and log.done_on < since:
+                continue
+            if until is not None and log.done_on >= until:
+                continue
+            logs[log.id] = log
+    return [logs[log_id] for log_id in sorted(logs)]
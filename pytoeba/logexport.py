@@ -0,0 +1,130 @@
+"""
+Streams Log rows out as NDJSON or CSV, optionally gzipped, for mirrors
+syncing the activity. Rows come in (done_on, id) order and are paged
+through with a keyset on that pair, so every page costs the same however
+deep into the table it is. A mirror resumes from the done_on and id of
+the last row it got.
+"""
+
+from django.db.models import Q
+from django.db.models.loading import get_model
+
+from .logarchive import LOG_FIELDS
+from cStringIO import StringIO
+import csv
+import gzip
+import json
+
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def log_rows(after=None, after_id=None, limit=None, chunk_size=None,
+             using='default'):
+    """
+    Iterates over the logs done after the (after, after_id) cursor as
+    tuples of LOG_FIELDS, at most limit of them. Without after_id every
+    log done at after is skipped too, after_id without after is refused.
+    """
+    if after is None and after_id:
+        raise ValueError(
+            'after_id is only a cursor together with after, the datetime '
+            'of the same log.'
+            )
+    if limit is not None and limit < 0:
+        raise ValueError('limit must not be negative.')
+    return _log_rows(after, after_id, limit, chunk_size, using)
+
+
+def _log_rows(after, after_id, limit, chunk_size, using):
+    Log = get_model('pytoeba', 'Log')
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    logs = Log.objects.using(using).order_by('done_on', 'id')
+    done = 0
+
+    while limit is None or done < limit:
+        page = logs
+        if after is not None and after_id is None:
+            page = page.filter(done_on__gt=after)
+        elif after is not None:
+            page = page.filter(
+                Q(done_on__gt=after) | Q(done_on=after, id__gt=after_id)
+                )
+        size = chunk_size if limit is None else min(chunk_size, limit - done)
+        rows = list(page.values_list(*LOG_FIELDS)[:size])
+        for row in rows:
+            yield row
+        done += len(rows)
+        if len(rows) < size:
+            break
+        after = rows[-1][LOG_FIELDS.index('done_on')]
+        after_id = rows[-1][0]
+
+
+def _row_dict(row):
+    log = dict(zip(LOG_FIELDS, row))
+    log['done_on'] = log['done_on'].isoformat()
+    return log
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(_row_dict(row)) + '\n'
+
+
+def csv_lines(rows):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(LOG_FIELDS)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        log = _row_dict(row)
+        writer.writerow([
+            '' if log[name] is None else unicode(log[name]).encode('utf-8')
+            for name in LOG_FIELDS
+            ])
+        yield buf.getvalue()
+
+
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+
+def gzip_chunks(chunks, lines_per_chunk=1000):
+    """
+    Compresses an iterator of strings on the fly, yielding compressed
+    data every lines_per_chunk of them.
+    """
+    buf = StringIO()
+    compressor = gzip.GzipFile(fileobj=buf, mode='wb')
+    for i, chunk in enumerate(chunks, 1):
+        compressor.write(chunk)
+        if i % lines_per_chunk == 0:
+            compressor.flush()
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    compressor.close()
+    yield buf.getvalue()
+
+
+def export_logs(format='ndjson', compress=False, **kwargs):
+    """
+    The encoded, and with compress gzipped, chunks of an export and the
+    content type they have. The other arguments go to log_rows().
+    """
+    if format not in FORMATS:
+        raise ValueError(
+            'Unknown format %s, use one of: %s' % (
+                format, ', '.join(sorted(FORMATS))
+                )
+            )
+    encode, content_type = FORMATS[format]
+    chunks = encode(log_rows(**kwargs))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return chunks, content_type
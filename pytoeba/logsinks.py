@@ -0,0 +1,214 @@
+"""
+Sinks every Log written through Log.objects.log() goes to. The one used
+is named by PYTOEBA_LOG_SINK, SyncLogSink by default.
+
+SyncLogSink saves every log as it comes. BufferedLogSink holds the logs
+written inside buffered_logs() blocks, or views wrapped in buffer_logs(),
+back and inserts them all at once right before their transaction
+commits. ThreadedLogSink hands them to a writer thread through a bounded
+queue.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from contextlib import contextmanager
+from functools import wraps
+from threading import local, Lock, Thread
+from Queue import Queue, Empty
+from .utils import import_path, bulk_create
+import atexit
+import logging
+
+
+logger = logging.getLogger('pytoeba')
+
+
+class SyncLogSink(object):
+
+    def write(self, logs, using='default'):
+        if len(logs) == 1:
+            logs[0].save(using=using)
+        else:
+            bulk_create(logs, using=using)
+
+    def start(self):
+        pass
+
+    def stop(self, flush=True):
+        pass
+
+    def flush(self):
+        pass
+
+
+class BufferedLogSink(SyncLogSink):
+    """
+    Buffers per thread between start() and stop(), logs written outside
+    of that are saved right away. Buffered logs get no pk and their
+    done_on is the time of the flush.
+    """
+
+    def __init__(self):
+        self.state = local()
+
+    def _buffers(self):
+        if not hasattr(self.state, 'buffers'):
+            self.state.buffers = []
+        return self.state.buffers
+
+    def write(self, logs, using='default'):
+        buffers = self._buffers()
+        if not buffers:
+            return super(BufferedLogSink, self).write(logs, using)
+        buffers[-1].extend((log, using) for log in logs)
+
+    def start(self):
+        self._buffers().append([])
+
+    def stop(self, flush=True):
+        buffers = self._buffers()
+        if not buffers:
+            return
+        buffered = buffers.pop()
+        if not flush:
+            return
+        # nested blocks end up in the outermost one
+        if buffers:
+            buffers[-1].extend(buffered)
+            return
+
+        by_db = {}
+        for log, using in buffered:
+            by_db.setdefault(using, []).append(log)
+        for using, logs in by_db.iteritems():
+            bulk_create(logs, using=using)
+
+
+class ThreadedLogSink(SyncLogSink):
+    """
+    Queues logs for a writer thread that inserts whatever has piled up,
+    up to PYTOEBA_LOG_BATCH_SIZE at a time. write() blocks once
+    PYTOEBA_LOG_QUEUE_SIZE logs are waiting. The logs are written outside
+    of the caller's transaction, so they land even if it rolls back and
+    fail if the sentence they are about isn't committed yet. A failed
+    batch is retried a log at a time, the queue is flushed at exit.
+    """
+
+    def __init__(self):
+        self.queue = Queue(getattr(settings, 'PYTOEBA_LOG_QUEUE_SIZE', 10000))
+        self.batch_size = getattr(settings, 'PYTOEBA_LOG_BATCH_SIZE', 500)
+        self.thread = None
+        self.lock = Lock()
+
+    def write(self, logs, using='default'):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                if self.thread is None:
+                    # the thread is a daemon, wait for it to empty the
+                    # queue before the process goes away
+                    atexit.register(self.flush)
+                self.thread = Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        for log in logs:
+            self.queue.put((log, using))
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            by_db = {}
+            for log, using in batch:
+                by_db.setdefault(using, []).append(log)
+            for using, logs in by_db.iteritems():
+                try:
+                    bulk_create(logs, using=using)
+                except Exception:
+                    # the batch mixes logs of unrelated callers, retry them
+                    # one by one so only the bad ones are lost
+                    for log in logs:
+                        try:
+                            bulk_create([log], using=using)
+                        except Exception:
+                            logger.exception(
+                                'Dropped %s log of sentence %s',
+                                log.type, log.sentence_id
+                                )
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self):
+        """
+        Waits until every queued log has been written.
+        """
+        self.queue.join()
+
+
+_log_sink = None
+
+
+def get_log_sink():
+    global _log_sink
+    if _log_sink is None:
+        _log_sink = import_path(
+            getattr(
+                settings, 'PYTOEBA_LOG_SINK', 'pytoeba.logsinks.SyncLogSink'
+                )
+            )()
+    return _log_sink
+
+
+@contextmanager
+def buffered_logs(using='default'):
+    """
+    Runs the block in a transaction and, with the buffered sink, writes
+    the logs of the block in one insert right before it commits.
+    """
+    sink = get_log_sink()
+    with transaction.atomic(using=using):
+        sink.start()
+        try:
+            yield
+        except:
+            sink.stop(flush=False)
+            raise
+        sink.stop()
+
+
+def buffer_logs(view, using='default'):
+    """
+    Runs the view in a transaction with its logs buffered, the same way
+    buffered_logs() does. The logs of a view that raises or returns an
+    error response are dropped.
+    """
+    @wraps(view)
+    def buffered_view(request, *args, **kwargs):
+        sink = get_log_sink()
+        with transaction.atomic(using=using):
+            sink.start()
+            try:
+                response = view(request, *args, **kwargs)
+            except:
+                sink.stop(flush=False)
+                raise
+            sink.stop(flush=response.status_code < 400)
+        return response
+    return buffered_view
+
+
+class BufferedLogMiddleware(object):
+    """
+    Runs every view through buffer_logs(). It calls the view itself, so
+    it has to come last in MIDDLEWARE_CLASSES, and what the view raises
+    skips the process_exception of other middleware. Decorate the views
+    with buffer_logs instead where that matters.
+    """
+
+    def process_view(self, request, view, args, kwargs):
+        return buffer_logs(view)(request, *args, **kwargs)
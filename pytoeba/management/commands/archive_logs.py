@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from optparse import make_option
+from pytoeba.logarchive import archive_logs, DEFAULT_SEGMENT_SIZE
+from datetime import datetime, timedelta
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves logs older than a cutoff out of the database into gzipped '
+        'segment files under PYTOEBA_LOG_ARCHIVE.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days', action='store', dest='days', type='int', default=None,
+            help='Archive logs older than this many days.'
+            ),
+        make_option(
+            '--before', action='store', dest='before', default=None,
+            help='Archive logs done before this date, as YYYY-MM-DD.'
+            ),
+        make_option(
+            '--path', action='store', dest='path', default=None,
+            help='Archive directory, defaults to PYTOEBA_LOG_ARCHIVE.'
+            ),
+        make_option(
+            '--segment-size', action='store', dest='segment_size',
+            type='int', default=DEFAULT_SEGMENT_SIZE,
+            help='Number of logs per segment file.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database holding the logs.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options['before']:
+            day = parse_date(options['before'])
+            if day is None:
+                raise CommandError('--before takes a date as YYYY-MM-DD.')
+            before = datetime(day.year, day.month, day.day)
+            if settings.USE_TZ:
+                before = timezone.make_aware(
+                    before, timezone.get_current_timezone()
+                    )
+        elif options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        else:
+            raise CommandError('Pass --days or --before.')
+
+        try:
+            archived = archive_logs(
+                before, path=options['path'], using=options['database'],
+                segment_size=options['segment_size']
+                )
+        except ValueError, e:
+            raise CommandError(str(e))
+        self.stdout.write('Archived %d logs' % archived)
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from pytoeba.graph_backends.benchmark import (
+    BACKENDS, SHAPES, SIZES, FIELDS, run_benchmarks
+    )
+import csv
+import json
+
+
+def _list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        'Times every graph backend on synthetic clusters of various shapes '
+        'and sizes and reports the results as JSON or CSV.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--backends', action='store', dest='backends',
+            default=','.join(sorted(BACKENDS)),
+            help='Comma separated backend names or import paths.'
+            ),
+        make_option(
+            '--shapes', action='store', dest='shapes',
+            default=','.join(SHAPES),
+            help='Comma separated cluster shapes out of: %s.' % ', '.join(SHAPES)
+            ),
+        make_option(
+            '--sizes', action='store', dest='sizes',
+            default=','.join(str(size) for size in SIZES),
+            help='Comma separated cluster sizes in sentences.'
+            ),
+        make_option(
+            '--edits', action='store', dest='edits', type='int', default=10,
+            help='Number of links added and removed per case.'
+            ),
+        make_option(
+            '--max-level', action='store', dest='max_level', type='int',
+            default=None, help='Link level cap passed to the backends.'
+            ),
+        make_option(
+            '--max-pairs', action='store', dest='max_pairs', type='int',
+            default=5000000,
+            help='Skip cases whose link closure would be bigger than this.'
+            ),
+        make_option(
+            '--seed', action='store', dest='seed', type='int', default=0,
+            help='Seed for the random cluster shapes and edits.'
+            ),
+        make_option(
+            '--format', action='store', dest='format', default='json',
+            help='Report format, json or csv.'
+            ),
+        make_option(
+            '--output', action='store', dest='output', default=None,
+            help='File to write the report to instead of stdout.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        shapes = _list(options['shapes'])
+        unknown = set(shapes) - set(SHAPES)
+        if unknown:
+            raise CommandError('Unknown shapes: %s' % ', '.join(unknown))
+        if options['format'] not in ('json', 'csv'):
+            raise CommandError('Format must be json or csv.')
+
+        results = run_benchmarks(
+            _list(options['backends']), shapes, _list(options['sizes'], int),
+            edits=options['edits'], max_level=options['max_level'],
+            max_pairs=options['max_pairs'], seed=options['seed']
+            )
+
+        output = self.stdout
+        if options['output']:
+            output = open(options['output'], 'w')
+
+        try:
+            if options['format'] == 'json':
+                output.write(json.dumps(list(results), indent=2) + '\n')
+            else:
+                writer = csv.DictWriter(output, FIELDS)
+                writer.writeheader()
+                for result in results:
+                    writer.writerow(result)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from optparse import make_option
+from pytoeba.logexport import export_logs, DEFAULT_CHUNK_SIZE
+import sys
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams the logs done after a (done_on, id) cursor as NDJSON or '
+        'CSV, optionally gzipped, in constant memory.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--after', action='store', dest='after', default=None,
+            help='done_on of the last log already exported, ISO formatted.'
+            ),
+        make_option(
+            '--after-id', action='store', dest='after_id', type='int',
+            default=None,
+            help='id of the last log already exported, needs --after.'
+            ),
+        make_option(
+            '--format', action='store', dest='format', default='ndjson',
+            help='ndjson or csv.'
+            ),
+        make_option(
+            '--gzip', action='store_true', dest='gzip', default=False,
+            help='Compress the output with gzip.'
+            ),
+        make_option(
+            '--limit', action='store', dest='limit', type='int', default=None,
+            help='Export at most this many logs.'
+            ),
+        make_option(
+            '--output', action='store', dest='output', default=None,
+            help='File to write to, stdout by default.'
+            ),
+        make_option(
+            '--chunk-size', action='store', dest='chunk_size', type='int',
+            default=DEFAULT_CHUNK_SIZE, help='Number of logs read per query.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database holding the logs.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        after = options['after']
+        if after is not None:
+            after = parse_datetime(after)
+            if after is None:
+                raise CommandError('--after takes an ISO formatted datetime.')
+
+        try:
+            chunks, _ = export_logs(
+                options['format'], compress=options['gzip'], after=after,
+                after_id=options['after_id'], limit=options['limit'],
+                chunk_size=options['chunk_size'], using=options['database']
+                )
+        except ValueError, e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            output = open(options['output'], 'wb')
+        else:
+            output = sys.stdout
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
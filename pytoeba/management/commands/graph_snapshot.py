@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from pytoeba.snapshot import export_snapshot, update_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes the memory mapped snapshot of the direct links used for '
+        'translation lookups. By default only the links changed since the '
+        'last snapshot are replayed from the logs.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--path', action='store', dest='path', default=None,
+            help='Snapshot directory, defaults to PYTOEBA_GRAPH_SNAPSHOT.'
+            ),
+        make_option(
+            '--full', action='store_true', dest='full', default=False,
+            help='Export every link again instead of replaying the logs.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database to read the links from.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(
+            settings, 'PYTOEBA_GRAPH_SNAPSHOT', None
+            )
+        if not path:
+            raise CommandError(
+                'Pass --path or set PYTOEBA_GRAPH_SNAPSHOT.'
+                )
+
+        if options['full']:
+            snapshot = export_snapshot(path, options['database'])
+        else:
+            snapshot = update_snapshot(path, options['database'])
+        self.stdout.write('Snapshot at %s' % snapshot)
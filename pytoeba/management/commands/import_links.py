@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.loading import get_model
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+from itertools import imap
+from collections import defaultdict
+from pytoeba.utils import UnionFind, closure_levels, set_cluster
+
+
+def _component_closure(args):
+    nodes, edges, max_level = args
+    return nodes, closure_levels(nodes, edges, max_level)
+
+
+class Command(BaseCommand):
+    args = '<links_file>'
+    help = (
+        'Imports a tatoeba links file (sentence_id<TAB>translation_id per '
+        'line) and stores the full link closure with levels. Components are '
+        'computed in parallel and the Link rows are written in chunks.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--max-level', action='store', dest='max_level', type='int',
+            default=None,
+            help='Do not store links further apart than this. Defaults to '
+                 'the PYTOEBA_MAX_LINK_LEVEL setting.'
+            ),
+        make_option(
+            '--processes', action='store', dest='processes', type='int',
+            default=cpu_count(),
+            help='Number of worker processes computing the closure.'
+            ),
+        make_option(
+            '--chunk-size', action='store', dest='chunk_size', type='int',
+            default=10000,
+            help='Number of Link rows inserted per batch when the database '
+                 'has no COPY.'
+            ),
+        make_option(
+            '--replace', action='store_true', dest='replace', default=False,
+            help='Delete all existing links before importing.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database to import the links into.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Expected exactly one links file.')
+
+        max_level = options['max_level']
+        if max_level is None:
+            max_level = getattr(settings, 'PYTOEBA_MAX_LINK_LEVEL', None)
+
+        Sentence = get_model('pytoeba', 'Sentence')
+        Link = get_model('pytoeba', 'Link')
+        using = options['database']
+        sentences = Sentence.objects.using(using)
+        links = Link.objects.using(using)
+
+        if links.exists() and not options['replace']:
+            raise CommandError(
+                'There are links already, use --replace to overwrite them.'
+                )
+
+        # forking only after the db has been touched is fine, the workers
+        # never use the inherited connection
+        pool = None
+        if options['processes'] > 1:
+            pool = Pool(options['processes'])
+
+        try:
+            ids = dict(
+                sentences.filter(sent_id__isnull=False)
+                         .values_list('sent_id', 'id').iterator()
+                )
+            edges, skipped = self.read_edges(args[0], ids)
+
+            components = UnionFind()
+            for node1, node2 in edges:
+                components.union(node1, node2)
+            component_edges = defaultdict(list)
+            for edge in edges:
+                component_edges[components.find(edge[0])].append(edge)
+
+            # biggest components first so they don't end up last on one worker
+            tasks = sorted(
+                ((group, component_edges[components.find(group[0])], max_level)
+                 for group in components.groups()),
+                key=lambda task: len(task[0]), reverse=True
+                )
+
+            if pool:
+                results = pool.imap_unordered(_component_closure, tasks)
+            else:
+                results = imap(_component_closure, tasks)
+
+            clusters = []
+
+            def link_rows():
+                for nodes, rows in results:
+                    clusters.append(nodes)
+                    for i in xrange(0, len(rows), 3):
+                        yield rows[i], rows[i + 1], rows[i + 2]
+
+            with transaction.atomic(using=using):
+                if options['replace']:
+                    links.all().delete()
+                    sentences.filter(cluster_id__isnull=False)\
+                             .update(cluster_id=None)
+
+                # streamed through COPY on postgres, so the closure is never
+                # held in memory in full
+                created = Link.objects.db_manager(using).bulk_load(
+                    link_rows(), fields=['side1_id', 'side2_id', 'level'],
+                    batch_size=options['chunk_size']
+                    )
+                for nodes in clusters:
+                    set_cluster(sentences, nodes, min(nodes))
+        finally:
+            # everything was read from the pool unless the import failed,
+            # in which case the workers shouldn't outlive it
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        self.stdout.write(
+            'Imported %d links in %d clusters, skipped %d lines.' % (
+                created, len(tasks), skipped
+                )
+            )
+
+    def read_edges(self, path, ids):
+        edges = set()
+        skipped = 0
+        with open(path) as links_file:
+            for line in links_file:
+                try:
+                    sent_id1, sent_id2 = line.split()[:2]
+                    node1 = ids[int(sent_id1)]
+                    node2 = ids[int(sent_id2)]
+                except (ValueError, KeyError):
+                    skipped += 1
+                    continue
+
+                if node1 != node2:
+                    edges.add((min(node1, node2), max(node1, node2)))
+
+        return edges, skipped
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from multiprocessing import Pool
+from optparse import make_option
+from pytoeba.utils import drain_graph_queue
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the link levels of every cluster queued while '
+        'PYTOEBA_DEFERRED_LINKS is on, each cluster once per batch. Run a '
+        'single instance of it.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--processes', action='store', dest='processes', type='int',
+            default=1, help='Number of worker processes reconciling clusters.'
+            ),
+        make_option(
+            '--batch-size', action='store', dest='batch_size', type='int',
+            default=1000, help='Queue entries taken per batch.'
+            ),
+        make_option(
+            '--loop', action='store_true', dest='loop', default=False,
+            help='Keep polling the queue instead of exiting once it is empty.'
+            ),
+        make_option(
+            '--sleep', action='store', dest='sleep', type='float', default=1.0,
+            help='Seconds to wait between polls of an empty queue.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database the queue lives in.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['processes'] > 1:
+            # the workers open their own connections, an inherited one
+            # would be shared with this process
+            for connection in connections.all():
+                connection.close()
+            pool = Pool(options['processes'])
+
+        total_entries = total_clusters = 0
+        try:
+            while True:
+                entries, clusters = drain_graph_queue(
+                    options['batch_size'], pool, options['database']
+                    )
+                total_entries += entries
+                total_clusters += clusters
+                if not entries:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['sleep'])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.stdout.write(
+            'Processed %d queued sentences in %d cluster recomputes.' % (
+                total_entries, total_clusters
+                )
+            )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from optparse import make_option
+from pytoeba.utils import rebuild_clusters
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the translation cluster of every sentence from the '
+        'direct links.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database to rebuild the clusters on.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            count = rebuild_clusters(using=using)
+        self.stdout.write('Rebuilt %d clusters.' % count)
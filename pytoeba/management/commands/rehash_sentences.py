@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models.loading import get_model
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+from pytoeba.utils import (
+    sim_hash_many, sim_hash_blocks, truncate_sim_hash, bulk_update,
+    SIM_BLOCK_FIELDS
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes sim_hash and the simhash blocks of every sentence from '
+        'its text, hashing in parallel and writing only the rows that '
+        'changed.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers', action='store', dest='workers', type='int',
+            default=cpu_count(), help='Number of hashing processes.'
+            ),
+        make_option(
+            '--chunk-size', action='store', dest='chunk_size', type='int',
+            default=10000, help='Number of sentences read per chunk.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database holding the sentences.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        Sentence = get_model('pytoeba', 'Sentence')
+        using = options['database']
+        sentences = Sentence.objects.using(using)
+        fields = ['sim_hash'] + SIM_BLOCK_FIELDS
+
+        pool = None
+        if options['workers'] > 1:
+            # the workers never touch the db, but they shouldn't inherit a
+            # connection either
+            for connection in connections.all():
+                connection.close()
+            pool = Pool(options['workers'])
+
+        last_id = 0
+        total = changed = 0
+        try:
+            while True:
+                rows = list(
+                    sentences.filter(id__gt=last_id).order_by('id')
+                             .values_list('id', 'text', *fields)
+                             [:options['chunk_size']]
+                    )
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                total += len(rows)
+
+                values = sim_hash_many(
+                    [row[1] for row in rows], pool=pool
+                    )
+                updated = []
+                for row, value in zip(rows, values):
+                    new = [truncate_sim_hash(value)] + sim_hash_blocks(value)
+                    if list(row[2:]) != new:
+                        updated.append(
+                            Sentence(id=row[0], **dict(zip(fields, new)))
+                            )
+
+                with transaction.atomic(using=using):
+                    bulk_update(
+                        updated, update_fields=fields, using=using,
+                        strategy='values'
+                        )
+                changed += len(updated)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.stdout.write(
+            'Rehashed %d sentences, %d changed.' % (total, changed)
+            )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from pytoeba.feeds import update_feeds, rebuild_feeds
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Fans the logs written since the last run out into the per user '
+        'and per language activity feeds. Run a single instance of it.'
+        )
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--rebuild', action='store_true', dest='rebuild', default=False,
+            help='Empty the feeds and backfill them from every log first.'
+            ),
+        make_option(
+            '--batch-size', action='store', dest='batch_size', type='int',
+            default=1000, help='Number of logs fanned out per batch.'
+            ),
+        make_option(
+            '--lag', action='store', dest='lag', type='float', default=None,
+            help='Leave logs younger than this many seconds for a later '
+                 'run, defaults to PYTOEBA_FEED_LAG.'
+            ),
+        make_option(
+            '--loop', action='store_true', dest='loop', default=False,
+            help='Keep following the logs instead of exiting once done.'
+            ),
+        make_option(
+            '--sleep', action='store', dest='sleep', type='float', default=1.0,
+            help='Seconds to wait between polls when there are no new logs.'
+            ),
+        make_option(
+            '--database', action='store', dest='database', default='default',
+            help='Database holding the logs and feeds.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        using = options['database']
+        total = 0
+        if options['rebuild']:
+            total = rebuild_feeds(batch_size, options['lag'], using)
+
+        while True:
+            done = update_feeds(batch_size, options['lag'], using)
+            total += done
+            if not done:
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+
+        self.stdout.write('Fanned out %d logs.' % total)
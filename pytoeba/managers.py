@@ -1,10 +1,28 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Model
 from django.db.models.manager import Manager
 from django.db.models.query import QuerySet
 from django.db.models.loading import get_model
 from django.contrib.auth.models import UserManager
 from django.contrib.auth import authenticate
 
-from .utils import get_user, now, bulk_update, bulk_create, bulk_delete
+from .utils import (
+    get_user, now, bulk_update, bulk_create, bulk_delete,
+    QUERY_CHUNK_SIZE, sentence_presave, values_in, sim_hash,
+    sim_hash_blocks, join_sim_hash_blocks, hamming_distance,
+    SIM_HASH_BLOCKS, SIM_BLOCK_FIELDS, SentenceRef, get_hash_id_cache,
+    Revision
+    )
+from .bulkload import bulk_load
+from .logsinks import get_log_sink
+from .logarchive import archived_logs, has_archive
+from .exceptions import DuplicateSentenceError, NearDuplicateError
+from collections import defaultdict, OrderedDict
+
+
+def _changes_refs(values):
+    return 'lang' in values or 'is_deleted' in values
 
 
 class SentenceQuerySet(QuerySet):
@@ -66,140 +84,182 @@ class SentenceQuerySet(QuerySet):
         """
         return self.all().filter(has_correction=True)
 
-    def delete(self):
+    def _change(self, log_type, values, log_fields={}, chunk_size=None,
+                progress=None, pushdown=None):
         """
-        Bulk deletes all sentences in the queryset. Uses the
-        same implementation as the delete sentence instance
-        method.
+        Applies values to the queryset and logs it as log_type, either in
+        chunks or, with pushdown or PYTOEBA_PUSHDOWN_UPDATES, in the
+        database alone.
+        """
+        if pushdown is None:
+            pushdown = getattr(settings, 'PYTOEBA_PUSHDOWN_UPDATES', False)
+        if pushdown:
+            done = self._change_pushed_down(log_type, values, log_fields)
+            if progress is not None:
+                progress(done)
+            return done
+        return self._change_in_chunks(
+            log_type, values, log_fields, chunk_size, progress
+            )
+
+    def _change_pushed_down(self, log_type, values, log_fields={}):
+        """
+        Writes the logs with one INSERT ... SELECT from the sentences of
+        the queryset, then changes them with one UPDATE. Nothing is
+        loaded into python. The logs go first since the update can take
+        rows out of the queryset, and they carry the values from before
+        it.
         """
         user = get_user()
-        sents = list(self.all())
-        logs = []
         Log = get_model('pytoeba', 'Log')
-
-        for sent in sents:
-            sent.is_deleted = True
-            logs.append(
-                Log(
-                    sentence=sent, type='srd', done_by=user,
-                    source_hash_id=sent.hash_id, source_lang=sent.lang
-                    )
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        log_meta = Log._meta
+        sent_table = qn(self.model._meta.db_table)
+
+        constants = [
+            ('type', log_type), ('done_by', user.pk),
+            ('done_on', log_meta.get_field('done_on').pre_save(Log(), True))
+            ]
+        constants.extend(sorted(log_fields.items()))
+        columns = ['sentence', 'source_hash_id', 'source_lang']
+        columns.extend(name for name, _ in constants)
+        columns = [qn(log_meta.get_field(name).column) for name in columns]
+        params = [
+            log_meta.get_field(name).get_db_prep_save(value, connection)
+            for name, value in constants
+            ]
+
+        ids_sql, ids_params = self.all().values('id').query.sql_with_params()
+        sql = (
+            'INSERT INTO %s (%s) SELECT s.%s, s.%s, s.%s, %s FROM %s s '
+            'WHERE s.%s IN (%s)' % (
+                qn(log_meta.db_table), ', '.join(columns), qn('id'),
+                qn('hash_id'), qn('lang'), ', '.join(['%s'] * len(params)),
+                sent_table, qn('id'), ids_sql
                 )
+            )
 
-        bulk_update(sents, update_fields=['is_deleted'])
-        bulk_create(logs)
-
-    def lock(self):
+        with transaction.atomic(using=self.db):
+            cursor = connection.cursor()
+            cursor.execute(sql, params + list(ids_params))
+            done = cursor.rowcount
+            self.all().update(**values)
+        if _changes_refs(values):
+            # which hash_ids changed is never seen here
+            get_hash_id_cache().clear()
+        return done
+
+    def _change_in_chunks(self, log_type, values, log_fields={},
+                          chunk_size=None, progress=None):
         """
-        Bulk locks sentences in the queryset. Mirrors
-        sentence.lock
+        Applies values, a dict of field values, to every sentence in the
+        queryset and logs it as log_type. The sentences are walked in id
+        order a chunk at a time, fetching only the columns the logs need,
+        and each chunk's UPDATE and Log INSERT are committed together, so
+        memory stays the same however big the queryset. progress, if
+        given, is called with the number of sentences done after every
+        chunk. Returns that number.
         """
         user = get_user()
-        sents = list(self.all())
-        logs = []
         Log = get_model('pytoeba', 'Log')
-
-        for sent in sents:
-            sent.is_editable = False
-            logs.append(
-                Log(
-                    sentence=sent, type='sld', done_by=user,
-                    source_hash_id=sent.hash_id, source_lang=sent.lang
-                    )
+        chunk_size = chunk_size or QUERY_CHUNK_SIZE
+        sents = self.all().order_by('id')
+        done = 0
+        last_id = 0
+
+        while True:
+            rows = list(
+                sents.filter(id__gt=last_id)
+                     .values_list('id', 'hash_id', 'lang')[:chunk_size]
                 )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            logs = []
+            for sent_id, hash_id, lang in rows:
+                logs.append(
+                    Log(
+                        sentence_id=sent_id, type=log_type, done_by=user,
+                        source_hash_id=hash_id, source_lang=lang, **log_fields
+                        )
+                    )
 
-        bulk_update(sents, update_fields=['is_editable'])
-        bulk_create(logs)
+            with transaction.atomic(using=self.db):
+                self.model._base_manager.using(self.db)\
+                    .filter(id__in=[row[0] for row in rows]).update(**values)
+                bulk_create(logs, using=self.db)
+            if _changes_refs(values):
+                get_hash_id_cache().delete_many(row[1] for row in rows)
+
+            done += len(rows)
+            if progress is not None:
+                progress(done)
 
-    def unlock(self):
+        return done
+
+    def delete(self, chunk_size=None, progress=None, pushdown=None):
         """
-        Bulk unlocks sentences in the queryset. Mirrors
-        sentece.lock.
+        Bulk deletes all sentences in the queryset. Uses the
+        same implementation as the delete sentence instance
+        method.
         """
-        user = get_user()
-        sents = list(self.all())
-        logs = []
-        Log = get_model('pytoeba', 'Log')
+        return self._change(
+            'srd', {'is_deleted': True}, chunk_size=chunk_size,
+            progress=progress, pushdown=pushdown
+            )
 
-        for sent in sents:
-            sent.is_editable = True
-            logs.append(
-                Log(
-                    sentence=sent, type='sul', done_by=user,
-                    source_hash_id=sent.hash_id, source_lang=sent.lang
-                    )
-                )
+    def lock(self, chunk_size=None, progress=None, pushdown=None):
+        """
+        Bulk locks sentences in the queryset. Mirrors
+        sentence.lock
+        """
+        return self._change(
+            'sld', {'is_editable': False}, chunk_size=chunk_size,
+            progress=progress, pushdown=pushdown
+            )
 
-        bulk_update(sents, update_fields=['is_editable'])
-        bulk_create(logs)
+    def unlock(self, chunk_size=None, progress=None, pushdown=None):
+        """
+        Bulk unlocks sentences in the queryset. Mirrors
+        sentece.lock.
+        """
+        return self._change(
+            'sul', {'is_editable': True}, chunk_size=chunk_size,
+            progress=progress, pushdown=pushdown
+            )
 
-    def adopt(self):
+    def adopt(self, chunk_size=None, progress=None, pushdown=None):
         """
         Bulk adopts sentences in the queryset. Mirrors
         sentence.adopt.
         """
-        user = get_user()
-        sents = list(self.all())
-        logs = []
-        Log = get_model('pytoeba', 'Log')
-
-        for sent in sents:
-            sent.owner = user
-            logs.append(
-                Log(
-                    sentence=sent, type='soa', done_by=user,
-                    source_hash_id=sent.hash_id, source_lang=sent.lang
-                    )
-                )
-
-        bulk_update(sents, update_fields=['owner'])
-        bulk_create(logs)
+        return self._change(
+            'soa', {'owner': get_user()}, chunk_size=chunk_size,
+            progress=progress, pushdown=pushdown
+            )
 
-    def release(self):
+    def release(self, chunk_size=None, progress=None, pushdown=None):
         """
         Bulk releases ownership over sentences in the
         queryset. Mirrors sentence.release.
         """
-        user = get_user()
-        sents = list(self.all())
-        logs = []
-        Log = get_model('pytoeba', 'Log')
-
-        for sent in sents:
-            sent.owner = None
-            logs.append(
-                Log(
-                    sentence=sent, type='sor', done_by=user,
-                    source_hash_id=sent.hash_id, source_lang=sent.lang
-                    )
-                )
-
-        bulk_update(sents, update_fields=['owner'])
-        bulk_create(logs)
+        return self._change(
+            'sor', {'owner': None}, chunk_size=chunk_size, progress=progress,
+            pushdown=pushdown
+            )
 
-    def change_language(self, lang):
+    def change_language(self, lang, chunk_size=None, progress=None,
+                        pushdown=None):
         """
         Bulk changes the lang field on sentences in the
         queryset. Mirrors sentence.change_language.
         """
-        user = get_user()
-        sents = list(self.all())
-        logs = []
-        Log = get_model('pytoeba', 'Log')
-
-        for sent in sents:
-            old_lang = sent.lang
-            sent.lang = lang
-            logs.append(
-                Log(
-                    sentence=sent, type='slc', done_by=user,
-                    source_hash_id=sent.hash_id, source_lang=old_lang,
-                    target_lang=sent.lang
-                    )
-                )
-
-        bulk_update(sents, update_fields=['lang'])
-        bulk_create(logs)
+        return self._change(
+            'slc', {'lang': lang}, {'target_lang': lang},
+            chunk_size=chunk_size, progress=progress, pushdown=pushdown
+            )
 
     def link(self, sent):
         """
@@ -243,6 +303,7 @@ class SentenceQuerySet(QuerySet):
         for sent in sents:
             corr = Correction.objects.filter(sentence=sent)[0]
             sent.text = corr.text
+            sentence_presave(sent)
             logs.append(
                 Log(
                     sentence=sent, type='cfd', done_by=user, change_set=corr.text,
@@ -251,7 +312,10 @@ class SentenceQuerySet(QuerySet):
                     )
                 )
 
-        bulk_update(sents, update_fields=['text'])
+        bulk_update(
+            sents,
+            update_fields=['text', 'length', 'sim_hash'] + SIM_BLOCK_FIELDS
+            )
         bulk_create(logs)
 
     def add_tag(self, text):
@@ -350,11 +414,101 @@ class SentenceQuerySet(QuerySet):
         bulk_create(logs)
 
 
-class SentenceManager(Manager):
+class BulkLoadManager(Manager):
+
+    def bulk_load(self, rows, fields=None, format='csv', batch_size=None):
+        """
+        Streams rows, model instances or tuples of field values, into the
+        table, see pytoeba.bulkload.
+        """
+        using = self._db or router.db_for_write(self.model)
+        return bulk_load(
+            self.model, rows, fields, using=using, format=format,
+            batch_size=batch_size
+            )
+
+
+# logs whose change_set holds the whole text of the sentence after them
+TEXT_LOG_TYPES = ['sad', 'sed', 'cac', 'cfd']
+
+
+class LogManager(BulkLoadManager):
+
+    def log(self, **fields):
+        """
+        Creates a log and hands it to the configured log sink, see
+        pytoeba.logsinks. Depending on the sink it may not be saved yet
+        when this returns.
+        """
+        log = self.model(**fields)
+        using = self._db or router.db_for_write(self.model)
+        get_log_sink().write([log], using=using)
+        return log
+
+    def _text_logs(self, sentence_id, until=None):
+        logs = self.get_query_set().filter(
+            sentence=sentence_id, type__in=TEXT_LOG_TYPES
+            )
+        if until is not None:
+            logs = logs.filter(done_on__lte=until)
+        return logs
+
+    def revisions(self, sentence_id, until=None):
+        """
+        Every text a sentence had, oldest first, up to until if given.
+        Archived logs are included when PYTOEBA_LOG_ARCHIVE is set.
+        """
+        rows = list(
+            self._text_logs(sentence_id, until).order_by('done_on', 'id')
+                .values_list('id', 'type', 'change_set', 'done_by', 'done_on')
+            )
+        if has_archive():
+            live = set(row[0] for row in rows)
+            rows.extend(
+                (log.id, log.type, log.change_set, log.done_by_id, log.done_on)
+                for log in archived_logs([sentence_id], using=self.db)
+                if log.type in TEXT_LOG_TYPES and log.id not in live and
+                (until is None or log.done_on <= until)
+                )
+            rows.sort(key=lambda row: (row[4], row[0]))
+        return [Revision(number, *row) for number, row in enumerate(rows, 1)]
+
+    def text_at(self, sentence_id, when):
+        """
+        The text a sentence had at the given datetime, None if it didn't
+        exist yet.
+        """
+        texts = self._text_logs(sentence_id, when)\
+                    .order_by('-done_on', '-id')\
+                    .values_list('change_set', flat=True)[:1]
+        if texts:
+            return texts[0]
+        # archived logs are all older than the live ones
+        if has_archive():
+            revisions = self.revisions(sentence_id, until=when)
+            if revisions:
+                return revisions[-1].text
+        return None
+
+
+class SentenceManager(BulkLoadManager):
 
     def get_query_set(self):
         return SentenceQuerySet(self.model, using=self._db)
 
+    def bulk_load(self, rows, fields=None, format='csv', batch_size=None):
+        """
+        Sentence instances get their hash_id, owner, length and sim_hash
+        filled in like on save(), tuples have to carry them already.
+        """
+        rows = (
+            sentence_presave(row) if isinstance(row, Model) else row
+            for row in rows
+            )
+        return super(SentenceManager, self).bulk_load(
+            rows, fields, format, batch_size
+            )
+
     def all(self):
         return self.get_query_set().all()
 
@@ -379,39 +533,251 @@ class SentenceManager(Manager):
     def needs_correction(self):
         return self.get_query_set().needs_correction()
 
+    def _near_duplicates(self, values, max_distance, lang=None):
+        """
+        Maps every given simhash to {sentence id: distance} of the
+        sentences within max_distance bits of it. Every candidate shares
+        at least one whole block with the hash, so this is one indexed
+        lookup per block followed by a popcount.
+        """
+        if max_distance >= SIM_HASH_BLOCKS:
+            raise ValueError(
+                'Near duplicates can be looked up for up to %d bits.' %
+                (SIM_HASH_BLOCKS - 1)
+                )
+
+        sents = self.get_query_set().all()
+        if lang is not None:
+            sents = sents.filter(lang=lang)
+        blocks = dict((value, sim_hash_blocks(value)) for value in values)
+
+        candidates = {}
+        by_block = defaultdict(set)
+        for i, field in enumerate(SIM_BLOCK_FIELDS):
+            wanted = set(value_blocks[i] for value_blocks in blocks.values())
+            rows = values_in(sents, field, wanted, 'id', *SIM_BLOCK_FIELDS)
+            for row in rows:
+                candidates[row[0]] = join_sim_hash_blocks(row[1:])
+                by_block[(i, row[1 + i])].add(row[0])
+
+        found = {}
+        for value, value_blocks in blocks.iteritems():
+            found[value] = {}
+            for i, block in enumerate(value_blocks):
+                for sent_id in by_block[(i, block)]:
+                    distance = hamming_distance(value, candidates[sent_id])
+                    if distance <= max_distance:
+                        found[value][sent_id] = distance
+        return found
+
+    def near_duplicates(self, text_or_sentence, max_distance=3, lang=None):
+        """
+        Sentences whose simhash is within max_distance bits of the given
+        text's or sentence's, closest first, each with its distance in a
+        distance attribute. Deleted sentences and the given sentence
+        itself are left out.
+        """
+        exclude = None
+        text = text_or_sentence
+        if isinstance(text_or_sentence, Model):
+            exclude = text_or_sentence.id
+            text = text_or_sentence.text
+
+        value = sim_hash(text)
+        distances = self._near_duplicates([value], max_distance, lang)[value]
+        distances.pop(exclude, None)
+
+        sents = list(self.get_query_set().filter(id__in=distances.keys()))
+        for sent in sents:
+            sent.distance = distances[sent.id]
+        return sorted(sents, key=lambda sent: (sent.distance, sent.id))
+
+    def _check_near_duplicates(self, pairs):
+        max_distance = getattr(
+            settings, 'PYTOEBA_NEAR_DUPLICATE_DISTANCE', None
+            )
+        if max_distance is None:
+            return
+
+        by_lang = defaultdict(list)
+        for text, lang in pairs:
+            by_lang[None if lang == 'auto' else lang].append(text)
+
+        duplicates = {}
+        for lang, texts in by_lang.iteritems():
+            values = OrderedDict((text, sim_hash(text)) for text in texts)
+            found = self._near_duplicates(values.values(), max_distance, lang)
+            for text, value in values.iteritems():
+                if found[value]:
+                    duplicates[text] = list(
+                        self.get_query_set().filter(id__in=found[value].keys())
+                        )
+
+            # texts of the batch aren't in the database yet, each is also
+            # checked against the earlier ones sharing a block with it
+            by_block = defaultdict(list)
+            for text, value in values.iteritems():
+                close = set()
+                for i, block in enumerate(sim_hash_blocks(value)):
+                    for other, other_value in by_block[(i, block)]:
+                        distance = hamming_distance(value, other_value)
+                        if distance <= max_distance:
+                            close.add(other)
+                    by_block[(i, block)].append((text, value))
+                if close:
+                    duplicates.setdefault(text, []).extend(sorted(close))
+        if duplicates:
+            raise NearDuplicateError(duplicates)
+
     def add(self, text, lang='auto'):
+        """
+        Adds a sentence, rejecting it with NearDuplicateError if
+        PYTOEBA_NEAR_DUPLICATE_DISTANCE is set and it is that close to an
+        existing sentence in the same language.
+        """
+        self._check_near_duplicates([(text, lang)])
         user = get_user()
         sent = self.create(
             added_by=user, owner=user, text=text, lang=lang
             )
         Log = get_model('pytoeba', 'Log')
-        Log.objects.create(
+        Log.objects.log(
             sentence=sent, type='sad', done_by=user, change_set=text,
             target_id=sent.id, target_hash_id=sent.hash_id
             )
         return sent
 
     def bulk_add(self, sentences):
-        added_sents = []
-        
+        """
+        Adds sentences, given as texts or as dicts with a text and a lang,
+        with one INSERT for the sentences and one for their logs. Raises
+        DuplicateSentenceError, or NearDuplicateError like add(), without
+        adding anything if any of them already exists.
+        """
+        if not sentences:
+            return []
+
         if isinstance(sentences[0], dict):
-            for sent_info in sentences:
-                text = sent_info['text']
-                lang = sent_info['lang']
-                sent = self.add(text, lang)
-                added_sents.append(sent)
+            pairs = [(info['text'], info['lang']) for info in sentences]
         else:
-            for sentence in sentences:
-                sent = self.add(sentence)
-                added_sents.append(sent)
+            pairs = [(text, 'auto') for text in sentences]
+
+        duplicates = []
+        seen = set()
+        for pair in pairs:
+            if pair in seen:
+                duplicates.append(pair)
+            seen.add(pair)
+        duplicates.extend(
+            row for row in values_in(
+                self.get_query_set(), 'text', set(text for text, _ in pairs),
+                'text', 'lang'
+                )
+            if row in seen
+            )
+        if duplicates:
+            raise DuplicateSentenceError(duplicates)
+        self._check_near_duplicates(pairs)
+
+        user = get_user()
+        sents = [
+            sentence_presave(
+                self.model(added_by=user, owner=user, text=text, lang=lang)
+                )
+            for text, lang in pairs
+            ]
+
+        Log = get_model('pytoeba', 'Log')
+        with transaction.atomic():
+            bulk_create(sents)
+            # inserts don't hand back ids everywhere, the hash_ids are
+            # already known though
+            ids = dict(values_in(
+                self.get_query_set(), 'hash_id',
+                [sent.hash_id for sent in sents], 'hash_id', 'id'
+                ))
+            for sent in sents:
+                sent.id = ids[sent.hash_id]
+
+            bulk_create([
+                Log(
+                    sentence=sent, type='sad', done_by=user,
+                    change_set=sent.text, target_id=sent.id,
+                    target_hash_id=sent.hash_id
+                    )
+                for sent in sents
+                ])
+
+        return sents
+
+    def resolve(self, hashes):
+        """
+        Maps hash_ids to SentenceRefs of (id, lang, is_deleted) through the
+        hash_id cache, with one IN query for the ones it misses. Hash ids
+        with no sentence are left out.
+        """
+        hashes = set(hashes)
+        cache = get_hash_id_cache()
+        refs = cache.get_many(hashes)
+        missing = hashes - set(refs)
+        if missing:
+            found = dict(
+                (row[0], SentenceRef(*row[1:]))
+                for row in values_in(
+                    self.get_query_set(), 'hash_id', missing,
+                    'hash_id', 'id', 'lang', 'is_deleted'
+                    )
+                )
+            cache.set_many(found)
+            refs.update(found)
+        return refs
 
-        return added_sents
+    def _refs(self, hashes):
+        """
+        Unsaved sentences carrying just the id, hash_id, lang and
+        is_deleted of every hash_id, enough for linking and logging.
+        """
+        hashes = list(hashes)
+        refs = self.resolve(hashes)
+        missing = set(hashes) - set(refs)
+        if missing:
+            raise self.model.DoesNotExist(
+                'No sentences with hash ids: %s' % ', '.join(sorted(missing))
+                )
+        return [
+            self.model(
+                id=refs[hash_id].id, hash_id=hash_id, lang=refs[hash_id].lang,
+                is_deleted=refs[hash_id].is_deleted
+                )
+            for hash_id in hashes
+            ]
 
     def show(self, hash_id):
         return self.get(hash_id=hash_id)
 
+    def _resolve_one(self, hash_id):
+        ref = self.resolve([hash_id]).get(hash_id)
+        if ref is None:
+            raise self.model.DoesNotExist(
+                'No sentence with hash id: %s' % hash_id
+                )
+        return ref
+
+    def history(self, hash_id, until=None):
+        """
+        The revisions of the sentence with the given hash_id, see
+        Sentence.history().
+        """
+        Log = get_model('pytoeba', 'Log')
+        return Log.objects.revisions(self._resolve_one(hash_id).id, until)
+
+    def text_at(self, hash_id, when):
+        Log = get_model('pytoeba', 'Log')
+        return Log.objects.text_at(self._resolve_one(hash_id).id, when)
+
     def bulk_show(self, hashes):
-        return self.filter(hash_id__in=hashes)
+        ids = [ref.id for ref in self.resolve(hashes).itervalues()]
+        return self.filter(id__in=ids)
 
     def edit(self, hash_id, text):
         sent = self.show(hash_id)
@@ -441,25 +807,48 @@ class SentenceManager(Manager):
         sent.release()
 
     def link(self, source_id, target_id):
-        source = self.show(source_id)
-        target = self.show(target_id)
+        source, target = self._refs([source_id, target_id])
         source.link(target)
 
     def bulk_link(self, source_id, target_ids):
-        source = self.show(source_id)
-        targets = self.bulk_show(target_ids)
+        source = self._refs([source_id])[0]
+        targets = self._refs(set(target_ids))
         source.bulk_link(targets)
 
     def unlink(self, source_id, target_id):
-        source = self.show(source_id)
-        target = self.show(target_id)
+        source, target = self._refs([source_id, target_id])
         source.unlink(target)
 
     def bulk_unlink(self, source_id, target_ids):
-        source = self.show(source_id)
-        targets = self.bulk_show(target_ids)
+        source = self._refs([source_id])[0]
+        targets = self._refs(set(target_ids))
         source.bulk_unlink(targets)
 
+    def _show_pairs(self, pairs):
+        hashes = set()
+        for pair in pairs:
+            hashes.update(pair)
+
+        sents = dict((sent.hash_id, sent) for sent in self._refs(hashes))
+        return [(sents[source], sents[target]) for source, target in pairs]
+
+    def bulk_link_pairs(self, pairs):
+        """
+        Links every (source_id, target_id) pair of hash ids. Each
+        affected cluster is redrawn once no matter how many of the
+        pairs fall in it.
+        """
+        pairs = self._show_pairs(pairs)
+        self.model._link_or_unlink_pairs(get_user(), link_pairs=pairs)
+
+    def bulk_unlink_pairs(self, pairs):
+        """
+        Unlinks every (source_id, target_id) pair of hash ids. Mirrors
+        bulk_link_pairs.
+        """
+        pairs = self._show_pairs(pairs)
+        self.model._link_or_unlink_pairs(get_user(), unlink_pairs=pairs)
+
     def translate(self, sent_id, text, lang='auto'):
         sent = self.show(sent_id)
         sent.translate(text, lang)
@@ -527,7 +916,7 @@ class CorrectionManager(Manager):
             sentence=sent, text=text, added_by=user, reason=reason
             )
         Log = get_model('pytoeba', 'Log')
-        Log.objects.create(
+        Log.objects.log(
             sentence=sent, type='cad', done_by=user, change_set=corr.text,
             target_id=corr.hash_id
             )
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from pytoeba.utils import UnionFind, chunks, QUERY_CHUNK_SIZE
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Names every translation cluster after its lowest sentence id."
+        clusters = UnionFind()
+        direct_links = orm['pytoeba.Link'].objects.filter(level=1)\
+                                                  .values_list('side1_id', 'side2_id')
+        for node1, node2 in direct_links.iterator():
+            clusters.union(node1, node2)
+
+        sentences = orm['pytoeba.Sentence'].objects
+        for group in clusters.groups():
+            cluster_id = min(group)
+            for chunk in chunks(group, QUERY_CHUNK_SIZE):
+                sentences.filter(id__in=chunk).update(cluster_id=cluster_id)
+
+    def backwards(self, orm):
+        "Clusters are derived data, the schema migration drops the column."
+        orm['pytoeba.Sentence'].objects.update(cluster_id=None)
+
+    models = {
+        u'auth.group': {
+            'Meta': {'object_name': 'Group'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '80'}),
+            'permissions': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['auth.Permission']", 'symmetrical': 'False', 'blank': 'True'})
+        },
+        u'auth.permission': {
+            'Meta': {'ordering': "(u'content_type__app_label', u'content_type__model', u'codename')", 'unique_together': "((u'content_type', u'codename'),)", 'object_name': 'Permission'},
+            'codename': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'pytoeba.audio': {
+            'Meta': {'object_name': 'Audio'},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'audio_file': ('django.db.models.fields.files.FileField', [], {'max_length': '100'}),
+            'hash_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '32', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sentence': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Sentence']"})
+        },
+        u'pytoeba.comment': {
+            'Meta': {'object_name': 'Comment'},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'is_public': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'modified_on': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'sentence': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Sentence']"}),
+            'text': ('django.db.models.fields.TextField', [], {})
+        },
+        u'pytoeba.correction': {
+            'Meta': {'object_name': 'Correction'},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'hash_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '32', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'modified_on': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'reason': ('django.db.models.fields.CharField', [], {'max_length': '200', 'blank': 'True'}),
+            'sentence': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Sentence']"}),
+            'text': ('django.db.models.fields.CharField', [], {'max_length': '500'})
+        },
+        u'pytoeba.link': {
+            'Meta': {'unique_together': "(('side1', 'side2'),)", 'object_name': 'Link', 'index_together': "[['side1', 'side2'], ['side1', 'level'], ['side2', 'level'], ['side1', 'side2', 'level']]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'level': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'side1': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'side1_set'", 'to': u"orm['pytoeba.Sentence']"}),
+            'side2': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'side2_set'", 'to': u"orm['pytoeba.Sentence']"})
+        },
+        u'pytoeba.localizedtag': {
+            'Meta': {'unique_together': "(('tag', 'lang'),)", 'object_name': 'LocalizedTag', 'index_together': "[['tag', 'lang']]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'lang': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            'tag': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Tag']"}),
+            'text': ('django.db.models.fields.CharField', [], {'max_length': '100', 'db_index': 'True'})
+        },
+        u'pytoeba.log': {
+            'Meta': {'object_name': 'Log', 'index_together': "[['source_lang', 'target_lang']]"},
+            'change_set': ('django.db.models.fields.CharField', [], {'default': 'None', 'max_length': '500', 'null': 'True'}),
+            'done_by': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'log_doneby_set'", 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'done_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sentence': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Sentence']"}),
+            'source_hash_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'null': 'True', 'blank': 'True'}),
+            'source_lang': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '4', 'null': 'True', 'blank': 'True'}),
+            'target_hash_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'null': 'True', 'blank': 'True'}),
+            'target_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'target_lang': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '4', 'null': 'True', 'blank': 'True'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '3', 'db_index': 'True'})
+        },
+        u'pytoeba.message': {
+            'Meta': {'object_name': 'Message', 'index_together': "[['recipient', 'recipient_deleted_on'], ['sender', 'sender_deleted_on']]"},
+            'body': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'parent_msg': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'next_messages'", 'null': 'True', 'to': u"orm['pytoeba.Message']"}),
+            'read_on': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'recipient': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'received_messages'", 'null': 'True', 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'recipient_deleted_on': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'replied_on': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'sender': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'sent_messages'", 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'sender_deleted_on': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'sent_on': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '120'})
+        },
+        u'pytoeba.pytoebauser': {
+            'Meta': {'object_name': 'PytoebaUser'},
+            'about_html': ('django.db.models.fields.TextField', [], {}),
+            'about_markup': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '2'}),
+            'about_text': ('django.db.models.fields.TextField', [], {}),
+            'against_status_vote_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'birthday': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'country': ('django.db.models.fields.CharField', [], {'max_length': '2', 'null': 'True', 'blank': 'True'}),
+            'date_joined': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'blank': 'True'}),
+            'email_confirmation_key': ('django.db.models.fields.CharField', [], {'max_length': '40', 'blank': 'True'}),
+            'email_confirmation_key_created_on': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'email_unconfirmed': ('django.db.models.fields.EmailField', [], {'default': "'test@test.com'", 'max_length': '75', 'blank': 'True'}),
+            'first_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'groups': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Group']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_staff': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'is_superuser': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'last_login': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'last_name': ('django.db.models.fields.CharField', [], {'max_length': '30', 'blank': 'True'}),
+            'password': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'privacy': ('django.db.models.fields.CharField', [], {'default': "'o'", 'max_length': '1'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'u'", 'max_length': '1', 'db_index': 'True'}),
+            'user_permissions': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "u'user_set'", 'blank': 'True', 'to': u"orm['auth.Permission']"}),
+            'username': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '30'}),
+            'with_status_vote_count': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'pytoeba.sentence': {
+            'Meta': {'unique_together': "(('text', 'lang'),)", 'object_name': 'Sentence', 'index_together': "[['text', 'lang']]"},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'sent_addedby_set'", 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'cluster_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'has_correction': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'hash_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '32', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'is_deleted': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'is_editable': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'lang': ('django.db.models.fields.CharField', [], {'max_length': '4', 'db_index': 'True'}),
+            'length': ('django.db.models.fields.IntegerField', [], {'db_index': 'True'}),
+            'links': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['pytoeba.Sentence']", 'through': u"orm['pytoeba.Link']", 'symmetrical': 'False'}),
+            'modified_on': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'owner': ('django.db.models.fields.related.ForeignKey', [], {'default': 'None', 'related_name': "'sent_owner_set'", 'null': 'True', 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'sent_id': ('django.db.models.fields.IntegerField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'sim_hash': ('django.db.models.fields.BigIntegerField', [], {'db_index': 'True'}),
+            'text': ('django.db.models.fields.CharField', [], {'max_length': '500'})
+        },
+        u'pytoeba.sentencetag': {
+            'Meta': {'unique_together': "(('sentence', 'tag'),)", 'object_name': 'SentenceTag', 'index_together': "[['sentence', 'tag']]"},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sentence': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Sentence']"}),
+            'tag': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.Tag']"})
+        },
+        u'pytoeba.tag': {
+            'Meta': {'object_name': 'Tag'},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'hash_id': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '32', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'pytoeba.userlang': {
+            'Meta': {'unique_together': "(('user', 'lang'),)", 'object_name': 'UserLang', 'index_together': "[['user', 'lang']]"},
+            'against_vote_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_trusted': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'lang': ('django.db.models.fields.CharField', [], {'max_length': '4', 'db_index': 'True'}),
+            'proficiency': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'userlang_set'", 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'votes': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['pytoeba.UserVote']", 'symmetrical': 'False'}),
+            'with_vote_count': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'pytoeba.uservote': {
+            'Meta': {'unique_together': "(('user', 'type', 'target_id'),)", 'object_name': 'UserVote', 'index_together': "[['user', 'type', 'target_id']]"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_with': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'target_id': ('django.db.models.fields.IntegerField', [], {}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '2'}),
+            'user': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"})
+        },
+        u'pytoeba.wall': {
+            'Meta': {'object_name': 'Wall'},
+            'category': ('django.db.models.fields.CharField', [], {'max_length': '100', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'pytoeba.wallpost': {
+            'Meta': {'object_name': 'WallPost'},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'body_html': ('django.db.models.fields.TextField', [], {}),
+            'body_markup': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '2'}),
+            'body_text': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_public': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'}),
+            'modified_on': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'thread': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'thread_posts'", 'to': u"orm['pytoeba.WallThread']"}),
+            'wall': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'wall_posts'", 'to': u"orm['pytoeba.Wall']"})
+        },
+        u'pytoeba.wallthread': {
+            'Meta': {'object_name': 'WallThread'},
+            'added_by': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['pytoeba.PytoebaUser']"}),
+            'added_on': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sticky': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'subscribers': ('django.db.models.fields.related.ManyToManyField', [], {'symmetrical': 'False', 'related_name': "'subscriptions'", 'blank': 'True', 'to': u"orm['pytoeba.PytoebaUser']"}),
+            'wall': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'threads'", 'to': u"orm['pytoeba.Wall']"})
+        }
+    }
+
+    complete_apps = ['pytoeba']
+    symmetrical = True
\ No newline at end of file
@@ -3,7 +3,7 @@ All pytoeba models live here. Operations are done using custom managers
 so be extra careful with the ORM.
 """
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import login
@@ -17,11 +17,12 @@ from .choices import (
     )
 from .managers import (
     SentenceManager, CorrectionManager, TagManager, PytoebaUserManager,
-    MessageManager, CommentManager
+    MessageManager, CommentManager, BulkLoadManager, LogManager
     )
 from .utils import (
     get_audio_path, get_user, now, sentence_presave, correction_presave,
-    tag_presave, uuid4, classproperty, bulk_create, redraw_subgraph, bulk_create
+    tag_presave, uuid4, classproperty, bulk_create, redraw_subgraph, bulk_create,
+    defer_subgraph, SIM_BLOCK_FIELDS, get_hash_id_cache, text_diff
     )
 from .exceptions import NotEditableError
 
@@ -71,6 +72,26 @@ class Sentence(models.Model):
     length = models.IntegerField(
         db_index=True, editable=False, blank=False, null=False
         )
+    # names the translation cluster (sentences connected through links)
+    # after one of its members, null for sentences with no links. kept up
+    # to date by pytoeba.utils.redraw_subgraph
+    cluster_id = models.IntegerField(
+        db_index=True, editable=False, blank=True, null=True
+        )
+    # the full simhash in four 16 bit blocks for near duplicate lookups, see
+    # SentenceManager.near_duplicates
+    sim_block_0 = models.IntegerField(
+        db_index=True, editable=False, blank=True, null=True
+        )
+    sim_block_1 = models.IntegerField(
+        db_index=True, editable=False, blank=True, null=True
+        )
+    sim_block_2 = models.IntegerField(
+        db_index=True, editable=False, blank=True, null=True
+        )
+    sim_block_3 = models.IntegerField(
+        db_index=True, editable=False, blank=True, null=True
+        )
 
     objects = SentenceManager()
 
@@ -99,7 +120,8 @@ class Sentence(models.Model):
         if kwargs.has_key('update_fields'):
             kwargs['update_fields'] += ['modified_on']
             if 'text' in kwargs['update_fields']:
-                kwargs['update_fields'] += ['length', 'sim_hash']
+                kwargs['update_fields'] += ['length', 'sim_hash'] + \
+                    SIM_BLOCK_FIELDS
 
         super(Sentence, self).save(*args, **kwargs)
 
@@ -115,7 +137,7 @@ class Sentence(models.Model):
             raise NotEditableError
         self.text = text
         self.save(update_fields=['text'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='sed', done_by=user, change_set=text,
             source_hash_id=self.hash_id, source_lang=self.lang
             )
@@ -128,7 +150,8 @@ class Sentence(models.Model):
         user = get_user()
         self.is_deleted = True
         self.save(update_fields=['is_deleted'])
-        Log.objects.create(
+        get_hash_id_cache().delete_many([self.hash_id])
+        Log.objects.log(
             sentence=self, type='srd', done_by=user, source_hash_id=self.hash_id,
             source_lang=self.lang
             )
@@ -141,7 +164,7 @@ class Sentence(models.Model):
         user = get_user()
         self.is_editable = False
         self.save(update_fields=['is_editable'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='sld', done_by=user, source_hash_id=self.hash_id,
             source_lang=self.lang
             )
@@ -154,7 +177,7 @@ class Sentence(models.Model):
         user = get_user()
         self.is_editable = True
         self.save(update_fields=['is_editable'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='sul', done_by=user, source_hash_id=self.hash_id,
             source_lang=self.lang
             )
@@ -168,7 +191,7 @@ class Sentence(models.Model):
         user = get_user()
         self.owner = user
         self.save(update_fields=['owner'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='soa', done_by=user, source_hash_id=self.hash_id,
             source_lang=self.lang
             )
@@ -182,7 +205,7 @@ class Sentence(models.Model):
         user = get_user()
         self.owner = None
         self.save(update_fields=['owner'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='sor', done_by=user, source_hash_id=self.hash_id,
             source_lang=self.lang
             )
@@ -196,13 +219,14 @@ class Sentence(models.Model):
         old_lang = self.lang
         self.lang = lang
         self.save(update_fields=['lang'])
-        Log.objects.create(
+        get_hash_id_cache().delete_many([self.hash_id])
+        Log.objects.log(
             sentence=self, type='slc', done_by=user, source_hash_id=self.hash_id,
             source_lang=old_lang, target_lang=self.lang
             )
 
     @classmethod
-    def _tuplize_links_unlinks(cls, source, target, user, _type='link'):
+    def _tuplize_pairs(cls, pairs, user, _type='link'):
         link_tuples = []
         logs = []
         if _type == 'link':
@@ -212,29 +236,33 @@ class Sentence(models.Model):
         else:
             raise Exception("Operation not supported")
 
-        for sent1 in source:
-            for sent2 in target:
-                link_tuples.append((sent1.id, sent2.id))
-                link_tuples.append((sent2.id, sent1.id))
-                logs.append(
-                    Log(
-                        sentence=sent1, type=_type, done_by=user,
-                        source_hash_id=sent1.hash_id, source_lang=sent1.lang,
-                        target_id=sent2.id, target_hash_id=sent2.hash_id,
-                        target_lang=sent2.lang
-                        )
+        for sent1, sent2 in pairs:
+            link_tuples.append((sent1.id, sent2.id))
+            link_tuples.append((sent2.id, sent1.id))
+            logs.append(
+                Log(
+                    sentence=sent1, type=_type, done_by=user,
+                    source_hash_id=sent1.hash_id, source_lang=sent1.lang,
+                    target_id=sent2.id, target_hash_id=sent2.hash_id,
+                    target_lang=sent2.lang
                     )
-                logs.append(
-                    Log(
-                        sentence=sent2, type=_type, done_by=user,
-                        source_hash_id=sent2.hash_id, source_lang=sent2.lang,
-                        target_id=sent1.id, target_hash_id=sent1.hash_id,
-                        target_lang=sent1.lang
-                        )
+                )
+            logs.append(
+                Log(
+                    sentence=sent2, type=_type, done_by=user,
+                    source_hash_id=sent2.hash_id, source_lang=sent2.lang,
+                    target_id=sent1.id, target_hash_id=sent1.hash_id,
+                    target_lang=sent1.lang
                     )
+                )
 
         return link_tuples, logs
 
+    @classmethod
+    def _tuplize_links_unlinks(cls, source, target, user, _type='link'):
+        pairs = [(sent1, sent2) for sent1 in source for sent2 in target]
+        return cls._tuplize_pairs(pairs, user, _type)
+
     @classmethod
     def _link_or_unlink(
         cls, user, source_links=[], target_links=[], source_unlinks=[],
@@ -244,26 +272,49 @@ class Sentence(models.Model):
         Simple wrapper around pytoeba.utils.redraw_subgraph.
         Turns links into tuples and adds log entries.
         """
+        link_pairs = [(s1, s2) for s1 in source_links for s2 in target_links]
+        unlink_pairs = [
+            (s1, s2) for s1 in source_unlinks for s2 in target_unlinks
+            ]
+        cls._link_or_unlink_pairs(user, link_pairs, unlink_pairs)
 
-        links = []
-        unlinks = []
-        logs = []
-
-        if source_links:
-            links, link_logs = cls._tuplize_links_unlinks(
-                                    source_links, target_links, user
+    @classmethod
+    def _link_or_unlink_pairs(cls, user, link_pairs=[], unlink_pairs=[]):
+        """
+        Links and unlinks (sentence, sentence) pairs in one go. Repeated
+        pairs and pairs of a sentence with itself are dropped, the graph
+        of every affected cluster is redrawn once and the Link and Log
+        changes are written in one set of bulk statements. With
+        PYTOEBA_DEFERRED_LINKS on, the redraw is left to the graph queue.
+        """
+        link_pairs = cls._unique_pairs(link_pairs)
+        unlink_pairs = cls._unique_pairs(unlink_pairs)
+        links, link_logs = cls._tuplize_pairs(link_pairs, user)
+        unlinks, unlink_logs = cls._tuplize_pairs(
+                                    unlink_pairs, user, _type='unlink'
                                     )
 
-        if source_unlinks:
-            unlinks, unlink_logs = cls._tuplize_links_unlinks(
-                                        source_unlinks, target_unlinks, user,
-                                        _type='unlink'
-                                        )
-
-        redraw_subgraph(links=links, unlinks=unlinks)
-        logs.extend(link_logs)
-        logs.extend(unlink_logs)
-        bulk_create(logs)
+        logs = link_logs + unlink_logs
+        if not logs:
+            return
+
+        with transaction.atomic():
+            if getattr(settings, 'PYTOEBA_DEFERRED_LINKS', False):
+                defer_subgraph(links=links, unlinks=unlinks)
+            else:
+                redraw_subgraph(links=links, unlinks=unlinks)
+            bulk_create(logs)
+
+    @staticmethod
+    def _unique_pairs(pairs):
+        seen = set()
+        unique = []
+        for sent1, sent2 in pairs:
+            key = frozenset((sent1.id, sent2.id))
+            if sent1.id != sent2.id and key not in seen:
+                seen.add(key)
+                unique.append((sent1, sent2))
+        return unique
 
     def link(self, sent):
         """
@@ -294,6 +345,61 @@ class Sentence(models.Model):
         user = get_user()
         self._link_or_unlink(user, source_unlinks=[self], target_unlinks=sents)
 
+    def history(self, until=None):
+        """
+        Every text the sentence had, oldest first, as Revisions numbered
+        from 1. Only revisions up to until are listed if it is given.
+        """
+        return Log.objects.revisions(self.id, until)
+
+    def text_at(self, when):
+        """
+        The text of the sentence at the given datetime.
+        """
+        return Log.objects.text_at(self.id, when)
+
+    def diff(self, old, new=None):
+        """
+        Word level diff between two revision numbers, the latest revision
+        by default, see pytoeba.utils.text_diff.
+        """
+        revisions = self.history()
+        new = len(revisions) if new is None else new
+        for number in (old, new):
+            if not 1 <= number <= len(revisions):
+                raise ValueError(
+                    'Sentence %s has revisions 1 to %s, not %s.' % (
+                        self.id, len(revisions), number
+                        )
+                    )
+        return text_diff(revisions[old - 1].text, revisions[new - 1].text)
+
+    def get_cluster(self):
+        """
+        Returns a queryset of every sentence in the same translation
+        cluster as this one, this one included.
+        """
+        if self.cluster_id is None:
+            return Sentence.objects.filter(id=self.id)
+        return Sentence.objects.filter(cluster_id=self.cluster_id)
+
+    def get_translation_levels(self, max_level=None):
+        """
+        Maps the id of every sentence linked to this one, directly or
+        not, to its level. Served from the graph snapshot when one is
+        configured, see pytoeba.snapshot, and from Link rows otherwise.
+        """
+        # numpy is only needed by sites that use snapshots
+        from .snapshot import get_translation_graph
+        graph = get_translation_graph()
+        if graph is not None:
+            return graph.translations(self.id, max_level)
+
+        links = Link.objects.filter(side1=self)
+        if max_level is not None:
+            links = links.filter(level__lte=max_level)
+        return dict(links.values_list('side2_id', 'level'))
+
     def translate(self, text, lang='auto'):
         """
         Translates the current sentence by adding a new
@@ -327,7 +433,7 @@ class Sentence(models.Model):
         user = get_user()
         self.text = corr.text
         self.save(update_fields=['text'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='cac', done_by=user, change_set=self.text,
             source_hash_id=self.hash_id, source_lang=self.lang,
             target_id=corr.id, target_hash_id=corr.hash_id
@@ -358,7 +464,7 @@ class Sentence(models.Model):
         user = get_user()
         self.text = corr.text
         self.save(update_fields=['text'])
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='cfd', done_by=user, change_set=corr.text,
             source_hash_id=self.hash_id, source_lang=self.lang,
             target_id=corr.id, target_hash_id=corr.hash_id
@@ -402,7 +508,7 @@ class Sentence(models.Model):
         sentag = SentenceTag.objects.create(
             sentence=self, tag=tag, added_by=user
             )
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='tad', done_by=user,
             source_hash_id=self.hash_id, source_lang=self.lang,
             target_id=sentag.tag.id, target_hash_id=sentag.tag.hash_id
@@ -418,7 +524,7 @@ class Sentence(models.Model):
         loctag = LocalizedTag.objects.get(text=text)
         sentag = SentenceTag.objects.get(sentence=self, tag_id=loctag.tag_id)
         sentag.delete()
-        Log.objects.create(
+        Log.objects.log(
             sentence=self, type='trd', done_by=user,
             source_hash_id=self.hash_id, source_lang=self.lang,
             target_id=sentag.tag_id, target_hash_id=sentag.tag.hash_id
@@ -451,6 +557,8 @@ class Link(models.Model):
         db_index=True, editable=False, blank=False, null=False
         )
 
+    objects = BulkLoadManager()
+
     class Meta:
         index_together = [
             ['side1', 'side2'],
@@ -469,6 +577,20 @@ class Link(models.Model):
             )
 
 
+class GraphQueue(models.Model):
+    """
+    Sentences whose links changed while PYTOEBA_DEFERRED_LINKS is on. Only
+    the direct links are written at that point, the process_graph_queue
+    command later recomputes the levels of each of their clusters once,
+    however many times it was queued.
+    """
+    sentence = models.ForeignKey(Sentence)
+    queued_on = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __unicode__(self):
+        return '%s queued on %s' % (self.sentence_id, self.queued_on)
+
+
 class Log(models.Model):
     """
     This model links a sentence to some kind of operation, as defined
@@ -516,9 +638,15 @@ class Log(models.Model):
         db_index=True, max_length=4, blank=True, null=True, choices=LANGS
         )
 
+    objects = LogManager()
+
     class Meta:
         index_together = [
             ['source_lang', 'target_lang'],
+            # keyset pagination in pytoeba.logexport
+            ['done_on', 'id'],
+            # sentence history
+            ['sentence', 'done_on'],
         ]
 
     def __unicode__(self):
@@ -527,6 +655,62 @@ class Log(models.Model):
             )
 
 
+class LogArchive(models.Model):
+    """
+    Index over the segment files the archive_logs command moves old logs
+    to, one row per sentence and segment with the span of that
+    sentence's logs in there. See pytoeba.logarchive.
+    """
+    sentence_id = models.IntegerField()
+    segment = models.CharField(max_length=100)
+    first_done_on = models.DateTimeField()
+    last_done_on = models.DateTimeField()
+
+    class Meta:
+        index_together = [
+            ['sentence_id', 'last_done_on'],
+        ]
+
+    def __unicode__(self):
+        return '%s in %s' % (self.sentence_id, self.segment)
+
+
+class Feed(models.Model):
+    """
+    Head of an activity feed, 'user:<id>' or 'lang:<code>', position is
+    the number of logs ever appended to it. The 'log' row holds the id of
+    the last log fanned out instead. See pytoeba.feeds.
+    """
+    key = models.CharField(max_length=20, unique=True)
+    position = models.BigIntegerField(default=0)
+
+    def __unicode__(self):
+        return '%s at %s' % (self.key, self.position)
+
+
+class FeedEntry(models.Model):
+    """
+    A slot of a feed's ring buffer, slot is the position of the entry
+    modulo PYTOEBA_FEED_SIZE so old entries get overwritten in place.
+    """
+    feed = models.CharField(max_length=20)
+    slot = models.IntegerField()
+    position = models.BigIntegerField()
+    log_id = models.IntegerField()
+    done_on = models.DateTimeField()
+
+    class Meta:
+        unique_together = (
+            ('feed', 'slot'),
+        )
+        index_together = [
+            ['feed', 'position'],
+        ]
+
+    def __unicode__(self):
+        return '%s #%s: %s' % (self.feed, self.position, self.log_id)
+
+
 class Correction(models.Model):
     """
     This holds a proposed correction to some sentence. It can be applied by the
@@ -579,7 +763,7 @@ class Correction(models.Model):
         self.text = text
         self.save(update_fields=['text'])
         sent = self.sentence
-        Log.objects.create(
+        Log.objects.log(
             sentence=sent, type='ced', done_by=user, change_set=text,
             source_hash_id=sent.hash_id, source_lang=sent.lang,
             target_id=self.id, target_hash_id=self.hash_id
@@ -602,7 +786,7 @@ class Correction(models.Model):
         user = get_user()
         self._base_delete()
         sent = self.sentence
-        Log.objects.create(
+        Log.objects.log(
             sentence=sent, type='crd', done_by=user,
             source_hash_id=sent.hash_id, source_lang=sent.lang,
             target_id=self.id, target_hash_id=self.hash_id
@@ -620,7 +804,7 @@ class Correction(models.Model):
         user = get_user()
         self._base_delete()
         sent = self.sentence
-        Log.objects.create(
+        Log.objects.log(
             sentence=sent, type='crj', done_by=user,
             source_hash_id=sent.hash_id, source_lang=sent.lang,
             target_id=self.id, target_hash_id=self.hash_id
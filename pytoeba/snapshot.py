@@ -0,0 +1,264 @@
+"""
+Read-only snapshot of the direct links as CSR arrays, for answering
+translation lookups in process instead of hitting the Link table.
+
+A snapshot is a directory holding ids.npy (sorted sentence ids, a
+sentence's position in it is its row), indptr.npy and indices.npy (the
+rows of the level 1 adjacency) and meta.json. The files are memory
+mapped, so every worker process on a machine shares the same pages
+through the page cache. Snapshots are written next to each other and
+published by atomically repointing the `current` symlink, readers pick up
+the new one on their next reload_if_changed().
+"""
+
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.loading import get_model
+from itertools import chain
+import numpy as np
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+CURRENT = 'current'
+# sentence ids are packed two to an int64 for set operations on edges
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def _edge_keys(side1, side2):
+    return (side1.astype(np.int64) << ID_BITS) | side2.astype(np.int64)
+
+
+def _csr_from_keys(keys):
+    keys = np.unique(keys)
+    if not len(keys):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(1, dtype=np.int64), empty
+
+    side1 = keys >> ID_BITS
+    side2 = keys & ID_MASK
+    ids, inverse = np.unique(
+        np.concatenate((side1, side2)), return_inverse=True
+        )
+    rows = inverse[:len(keys)]
+    indices = inverse[len(keys):]
+    # keys are sorted so the rows already come out grouped and in order
+    indptr = np.concatenate(
+        ([0], np.cumsum(np.bincount(rows, minlength=len(ids))))
+        )
+    return ids, indptr.astype(np.int64), indices.astype(np.int64)
+
+
+def _write_snapshot(path, ids, indptr, indices, last_log_id):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    # the timestamp keeps versions apart when no log was written between
+    # two exports, a published version is never overwritten in place
+    version = 'snapshot-%d-%d' % (last_log_id, int(time.time() * 1000000))
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=path)
+    np.save(os.path.join(tmp_dir, 'ids.npy'), ids)
+    np.save(os.path.join(tmp_dir, 'indptr.npy'), indptr)
+    np.save(os.path.join(tmp_dir, 'indices.npy'), indices)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as meta:
+        json.dump({'last_log_id': last_log_id, 'edges': len(indices)}, meta)
+
+    target = os.path.join(path, version)
+    os.rename(tmp_dir, target)
+
+    # rename() over an existing symlink is atomic, readers either see the
+    # old snapshot or the new one, never a missing one
+    tmp_link = os.path.join(path, '.tmp-' + CURRENT)
+    if os.path.lexists(tmp_link):
+        os.unlink(tmp_link)
+    os.symlink(version, tmp_link)
+    os.rename(tmp_link, os.path.join(path, CURRENT))
+
+    _prune(path, keep=(version,))
+    return target
+
+
+def _prune(path, keep=(), count=2):
+    """
+    Drops all but the newest few snapshots. Readers still mapping a
+    removed one keep working, the pages are only freed once they let go.
+    """
+    versions = sorted(
+        (name for name in os.listdir(path) if name.startswith('snapshot-')),
+        key=lambda name: [int(part) for part in name.split('-')[1:]],
+        reverse=True
+        )
+    for name in versions[count:]:
+        if name not in keep:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def _last_log_id(using):
+    Log = get_model('pytoeba', 'Log')
+    return Log.objects.using(using).aggregate(Max('id'))['id__max'] or 0
+
+
+def export_snapshot(path, using='default'):
+    """
+    Writes a snapshot of every direct link. The last Log id is read first
+    so links changed while exporting get replayed by the next update.
+    """
+    Link = get_model('pytoeba', 'Link')
+    last_log_id = _last_log_id(using)
+
+    rows = Link.objects.using(using).filter(level=1)\
+                       .values_list('side1_id', 'side2_id')
+    count = rows.count()
+    sides = np.fromiter(
+        chain.from_iterable(rows.iterator()), dtype=np.int64, count=2 * count
+        ).reshape(-1, 2)
+
+    ids, indptr, indices = _csr_from_keys(_edge_keys(sides[:, 0], sides[:, 1]))
+    return _write_snapshot(path, ids, indptr, indices, last_log_id)
+
+
+def update_snapshot(path, using='default'):
+    """
+    Brings the current snapshot up to date by replaying the lad/lrd Log
+    rows written since it was taken, without reading the Link table.
+    Falls back to a full export when there is no snapshot yet.
+    """
+    Log = get_model('pytoeba', 'Log')
+    if not os.path.exists(os.path.join(path, CURRENT)):
+        return export_snapshot(path, using)
+
+    graph = TranslationGraph(path)
+    logs = Log.objects.using(using)\
+                      .filter(id__gt=graph.last_log_id, type__in=['lad', 'lrd'])\
+                      .order_by('id')\
+                      .values_list('id', 'type', 'sentence_id', 'target_id')
+
+    # only the last operation on an edge matters
+    last_log_id = graph.last_log_id
+    ops = {}
+    for log_id, log_type, side1, side2 in logs.iterator():
+        ops[(side1, side2)] = log_type
+        last_log_id = log_id
+    if not ops:
+        return graph.path
+
+    touched = _edge_keys(
+        np.array([edge[0] for edge in ops], dtype=np.int64),
+        np.array([edge[1] for edge in ops], dtype=np.int64)
+        )
+    added = np.array(
+        [op == 'lad' for op in ops.itervalues()], dtype=bool
+        )
+
+    keys = _edge_keys(graph.ids[graph.rows()], graph.ids[graph.indices])
+    keys = keys[~np.in1d(keys, touched)]
+    keys = np.concatenate((keys, touched[added]))
+
+    ids, indptr, indices = _csr_from_keys(keys)
+    return _write_snapshot(path, ids, indptr, indices, last_log_id)
+
+
+class TranslationGraph(object):
+    """
+    Memory mapped reader over a snapshot. Nothing is read into the
+    process beyond the pages a lookup touches.
+    """
+
+    def __init__(self, path):
+        self.root = path
+        self.load()
+
+    def load(self):
+        self.version = os.readlink(os.path.join(self.root, CURRENT))
+        self.path = os.path.join(self.root, self.version)
+        self.ids = np.load(os.path.join(self.path, 'ids.npy'), mmap_mode='r')
+        self.indptr = np.load(
+            os.path.join(self.path, 'indptr.npy'), mmap_mode='r'
+            )
+        self.indices = np.load(
+            os.path.join(self.path, 'indices.npy'), mmap_mode='r'
+            )
+        with open(os.path.join(self.path, 'meta.json')) as meta:
+            self.last_log_id = json.load(meta)['last_log_id']
+
+    def reload_if_changed(self):
+        """
+        Cheap enough to call on every request, it is a single readlink.
+        """
+        if os.readlink(os.path.join(self.root, CURRENT)) != self.version:
+            self.load()
+            return True
+        return False
+
+    def rows(self):
+        return np.repeat(
+            np.arange(len(self.ids), dtype=np.int64), np.diff(self.indptr)
+            )
+
+    def _row(self, sentence_id):
+        row = np.searchsorted(self.ids, sentence_id)
+        if row < len(self.ids) and self.ids[row] == sentence_id:
+            return int(row)
+        return None
+
+    def neighbours(self, sentence_id):
+        row = self._row(sentence_id)
+        if row is None:
+            return []
+        return self.ids[self.indices[self.indptr[row]:self.indptr[row + 1]]]\
+                   .tolist()
+
+    def translations(self, sentence_id, max_level=None):
+        """
+        Breadth first search from the given sentence id, returns a dict of
+        every sentence id reached, up to max_level, to its level.
+        """
+        row = self._row(sentence_id)
+        if row is None:
+            return {}
+
+        indptr, indices = self.indptr, self.indices
+        seen = set([row])
+        levels = {}
+        frontier = [row]
+        level = 0
+        while frontier and (max_level is None or level < max_level):
+            level += 1
+            next_frontier = []
+            for node in frontier:
+                for next_node in indices[indptr[node]:indptr[node + 1]]:
+                    next_node = int(next_node)
+                    if next_node not in seen:
+                        seen.add(next_node)
+                        next_frontier.append(next_node)
+            if next_frontier:
+                found = self.ids[next_frontier].tolist()
+                levels.update((node, level) for node in found)
+            frontier = next_frontier
+
+        return levels
+
+
+_graphs = {}
+
+
+def get_translation_graph(path=None):
+    """
+    Per process TranslationGraph over PYTOEBA_GRAPH_SNAPSHOT, reloaded
+    whenever a newer snapshot has been published. Returns None when no
+    snapshot is configured or written yet.
+    """
+    path = path or getattr(settings, 'PYTOEBA_GRAPH_SNAPSHOT', None)
+    if not path or not os.path.exists(os.path.join(path, CURRENT)):
+        return None
+
+    graph = _graphs.get(path)
+    if graph is None:
+        graph = _graphs[path] = TranslationGraph(path)
+    else:
+        graph.reload_if_changed()
+    return graph
@@ -12,6 +12,13 @@ def pytest_configure():
     sys.path.append(settings_path)
 
 
+@pytest.fixture(autouse=True)
+def hash_id_cache():
+    # cached refs would outlive the rolled back test transactions
+    from pytoeba.utils import get_hash_id_cache
+    get_hash_id_cache().clear()
+
+
 @pytest.fixture(scope='session')
 def user(db):
     from pytoeba.models import PytoebaUser
@@ -0,0 +1,80 @@
+from pytoeba.models import Sentence, Link, Log
+from pytoeba.bulkload import (
+    RowStream, csv_rows, binary_rows, load_fields, prepared_rows,
+    BINARY_HEADER, BINARY_TRAILER, PG_EPOCH
+    )
+from django.db import connection
+from django.utils import timezone
+from datetime import datetime
+import struct
+import pytest
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestBulkLoad():
+
+    def test_bulk_load_instances_and_tuples(db, user):
+        loaded = Sentence.objects.bulk_load(
+            Sentence(lang='eng', text='loaded %s' % i, added_by=user)
+            for i in xrange(5)
+            )
+        assert loaded == 5
+        sents = list(Sentence.objects.filter(text__startswith='loaded'))
+        assert len(sents) == 5
+        assert all(sent.hash_id and sent.owner_id == user.id for sent in sents)
+        assert sents[0].length == len(sents[0].text)
+
+        a, b = sents[:2]
+        loaded = Link.objects.bulk_load(
+            ((a.id, b.id, 1), (b.id, a.id, 1)),
+            fields=['side1_id', 'side2_id', 'level'], batch_size=1
+            )
+        assert loaded == 2
+        assert set(Link.objects.values_list('side1_id', 'side2_id')) == \
+            set([(a.id, b.id), (b.id, a.id)])
+
+        Log.objects.bulk_load(
+            Log(sentence=sent, type='sad', done_by=user) for sent in sents
+            )
+        assert Log.objects.filter(type='sad').count() == 5
+        assert not Log.objects.filter(done_on=None).exists()
+
+
+def test_csv_rows():
+    rows = [(1, None, u'caf\xe9 "bar"', True, datetime(2014, 1, 2, 3, 4, 5))]
+    assert ''.join(csv_rows(rows)) == \
+        '1,,"caf\xc3\xa9 ""bar""",t,2014-01-02T03:04:05\n'
+
+
+def test_binary_rows():
+    fields = load_fields(Link, ['side1_id', 'level'])
+    data = ''.join(binary_rows([(3, None)], fields))
+    assert data.startswith(BINARY_HEADER)
+    assert data.endswith(BINARY_TRAILER)
+    row = data[len(BINARY_HEADER):-len(BINARY_TRAILER)]
+    assert row == struct.pack('>hii', 2, 4, 3) + struct.pack('>i', -1)
+
+
+def test_binary_rows_prepared_datetime():
+    fields = load_fields(Log, ['sentence', 'done_on'])
+    log = Log(sentence_id=3, type='sad', done_by_id=1)
+    rows = list(prepared_rows([log], fields, connection))
+    # done_on is auto_now_add, take whatever the row got
+    done_on = log.done_on
+    data = ''.join(binary_rows(rows, fields))
+    row = data[len(BINARY_HEADER):-len(BINARY_TRAILER)]
+    if timezone.is_aware(done_on):
+        done_on = timezone.make_naive(done_on, timezone.utc)
+    delta = done_on - PG_EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+    assert row == struct.pack('>hii', 2, 4, 3) + struct.pack('>iq', 8, micros)
+
+
+def test_row_stream():
+    stream = RowStream(['ab', 'cde', '', 'f'])
+    assert stream.read(2) == 'ab'
+    assert stream.read(2) == 'cd'
+    assert stream.read() == 'ef'
+    assert stream.read(5) == ''
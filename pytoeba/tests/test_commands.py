@@ -0,0 +1,179 @@
+from pytoeba.models import Link, Sentence
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from pytest import raises
+import pytest
+import json
+import csv
+
+
+def make_tatoeba_sents(user, sent_ids):
+    sents = {}
+    for sent_id in sent_ids:
+        sent = Sentence(
+            lang='eng', text='tatoeba %s' % sent_id, added_by=user,
+            sent_id=sent_id
+            )
+        sent.save()
+        sents[sent_id] = sent
+    return sents
+
+
+def write_links(tmpdir, pairs):
+    path = tmpdir.join('links.csv')
+    path.write(''.join('%s\t%s\n' % pair for pair in pairs))
+    return str(path)
+
+
+def stored_levels():
+    return dict(
+        ((link.side1_id, link.side2_id), link.level)
+        for link in Link.objects.all()
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestImportLinks():
+
+    def test_import_links(db, user, tmpdir):
+        sents = make_tatoeba_sents(user, [10, 11, 12, 13, 20, 21])
+        path = write_links(tmpdir, [
+            (10, 11), (11, 10), (11, 12), (12, 13), (20, 21), (21, 99),
+            ('bogus', 10)
+            ])
+        call_command('import_links', path, processes=2)
+
+        levels = stored_levels()
+        ids = dict((sent_id, sent.id) for sent_id, sent in sents.items())
+        assert len(levels) == 14
+        assert levels[(ids[10], ids[13])] == levels[(ids[13], ids[10])] == 3
+        assert levels[(ids[20], ids[21])] == 1
+
+        clusters = dict(Sentence.objects.values_list('sent_id', 'cluster_id'))
+        assert clusters[10] == clusters[13] == min(ids[n] for n in (10, 11, 12, 13))
+        assert clusters[20] == clusters[21] == ids[20]
+
+    def test_import_links_max_level(db, user, tmpdir):
+        sents = make_tatoeba_sents(user, [1, 2, 3, 4])
+        path = write_links(tmpdir, [(1, 2), (2, 3), (3, 4)])
+        call_command('import_links', path, processes=1, max_level=2)
+
+        levels = stored_levels()
+        assert len(levels) == 10
+        assert max(levels.values()) == 2
+        assert (sents[1].id, sents[4].id) not in levels
+        assert Sentence.objects.filter(cluster_id=sents[1].id).count() == 4
+
+    def test_import_links_refuses_to_overwrite(db, user, tmpdir):
+        make_tatoeba_sents(user, [1, 2, 3])
+        path = write_links(tmpdir, [(1, 2)])
+        call_command('import_links', path, processes=1)
+        with raises(CommandError):
+            call_command('import_links', path, processes=1)
+
+        path = write_links(tmpdir, [(2, 3)])
+        call_command('import_links', path, processes=1, replace=True)
+        assert len(stored_levels()) == 2
+        assert Sentence.objects.filter(cluster_id=None).count() == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestProcessGraphQueue():
+
+    def test_process_graph_queue(db, user):
+        from pytoeba.models import GraphQueue
+        from pytoeba.utils import work_as
+        from django.test.utils import override_settings
+        sents = make_tatoeba_sents(user, [1, 2, 3])
+        with override_settings(PYTOEBA_DEFERRED_LINKS=True):
+            with work_as(user):
+                sents[1].link(sents[2])
+                sents[2].link(sents[3])
+        assert (sents[1].id, sents[3].id) not in stored_levels()
+
+        call_command('process_graph_queue', processes=1)
+        assert stored_levels()[(sents[1].id, sents[3].id)] == 2
+        assert not GraphQueue.objects.exists()
+
+
+class TestBenchmarkGraphBackends():
+
+    def test_benchmark_report(self, tmpdir):
+        path = str(tmpdir.join('report.json'))
+        call_command(
+            'benchmark_graph_backends', backends='incremental,missing.Backend',
+            shapes='power_law,star,chain,clique', sizes='12,2000', edits=3,
+            max_pairs=1000, output=path
+            )
+        results = json.load(open(path))
+        assert len(results) == 16
+        ran = [r for r in results if r['backend'] == 'incremental' and r['nodes'] == 12]
+        assert len(ran) == 4
+        assert all(r['status'] == 'ok' for r in ran)
+        assert all(r['pairs'] == 132 for r in ran)
+        assert all(r['peak_rss_kb'] >= r['start_rss_kb'] for r in ran)
+        assert all(
+            r['status'].startswith('unavailable')
+            for r in results if r['backend'] == 'missing.Backend' and r['nodes'] == 12
+            )
+        assert all(
+            r['status'].startswith('skipped') for r in results if r['nodes'] == 2000
+            )
+
+    def test_benchmark_csv(self, tmpdir):
+        path = str(tmpdir.join('report.csv'))
+        call_command(
+            'benchmark_graph_backends', backends='incremental',
+            shapes='chain', sizes='5', format='csv', output=path
+            )
+        rows = list(csv.DictReader(open(path)))
+        assert len(rows) == 1
+        assert rows[0]['status'] == 'ok'
+        assert rows[0]['pairs'] == '20'
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestRehashSentences():
+
+    def test_rehash_sentences(db, user):
+        from pytoeba.utils import SIM_BLOCK_FIELDS
+        sents = make_tatoeba_sents(user, [1, 2, 3])
+        expected = dict(
+            (row[0], row[1:]) for row in
+            Sentence.objects.values_list('id', 'sim_hash', *SIM_BLOCK_FIELDS)
+            )
+        Sentence.objects.filter(id=sents[2].id).update(
+            sim_hash=0, sim_block_0=None
+            )
+
+        call_command('rehash_sentences', workers=2, chunk_size=2)
+        assert expected == dict(
+            (row[0], row[1:]) for row in
+            Sentence.objects.values_list('id', 'sim_hash', *SIM_BLOCK_FIELDS)
+            )
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestArchiveLogs():
+
+    def test_archive_logs(db, user, tmpdir):
+        from pytoeba.models import Log
+        from pytoeba.utils import work_as
+        path = str(tmpdir.join('logs'))
+        with work_as(user):
+            Sentence.objects.add('archived', 'eng')
+            Sentence.objects.add('kept', 'eng')
+        Log.objects.filter(change_set='archived').update(
+            done_on=Log.objects.get(change_set='archived').done_on.replace(
+                year=2013
+                )
+            )
+        call_command('archive_logs', before='2014-01-01', path=path)
+        assert list(Log.objects.values_list('change_set', flat=True)) == \
+            ['kept']
+        with raises(CommandError):
+            call_command('archive_logs', path=path)
@@ -0,0 +1,74 @@
+from pytoeba.models import Feed, FeedEntry, Log, Sentence
+from pytoeba.utils import work_as, now
+from pytoeba.feeds import update_feeds, rebuild_feeds, user_feed, lang_feed
+from django.core.management import call_command
+from django.test.utils import override_settings
+from datetime import timedelta
+import pytest
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestFeeds():
+
+    def test_feeds(db, user):
+        with work_as(user):
+            sents = [
+                Sentence.objects.add('feed %s' % i, lang)
+                for i, lang in enumerate(['epo', 'eng', 'epo'])
+                ]
+            sents[0].lock()
+        with override_settings(PYTOEBA_FEED_SIZE=3):
+            assert update_feeds(batch_size=2, lag=0) == 4
+            assert update_feeds(lag=0) == 0
+
+        logs = list(Log.objects.order_by('-id'))
+        assert user_feed(user) == logs[:3]
+        assert user_feed(user, page=2, per_page=2) == logs[2:3]
+        assert lang_feed('epo') == [logs[0], logs[1], logs[3]]
+        assert lang_feed('eng') == [logs[2]]
+        assert lang_feed('fra') == []
+        assert FeedEntry.objects.filter(feed='user:%s' % user.id).count() == 3
+        assert Feed.objects.get(key='user:%s' % user.id).position == 4
+        assert Feed.objects.get(key='log').position == logs[0].id
+
+        with work_as(user):
+            sents[1].unlock()
+        with override_settings(PYTOEBA_FEED_SIZE=3):
+            assert update_feeds(lag=0) == 1
+        assert lang_feed('eng')[0].type == 'sul'
+        assert user_feed(user)[0].type == 'sul'
+        assert FeedEntry.objects.filter(feed='user:%s' % user.id).count() == 3
+
+    def test_rebuild_feeds(db, user):
+        with work_as(user):
+            Sentence.objects.add('feed one', 'epo')
+            Sentence.objects.add('feed two', 'epo')
+        update_feeds(lag=0)
+        with override_settings(PYTOEBA_FEED_SIZE=1):
+            assert rebuild_feeds(lag=0) == 2
+        assert [log.change_set for log in lang_feed('epo')] == ['feed two']
+
+        call_command('update_feeds', rebuild=True, lag=0)
+        assert [log.change_set for log in lang_feed('epo')] == \
+            ['feed two', 'feed one']
+
+    def test_feeds_wait_for_late_logs(db, user):
+        with work_as(user):
+            for i in xrange(3):
+                Sentence.objects.add('feed %s' % i, 'epo')
+        first, second, third = Log.objects.order_by('id')
+        Log.objects.exclude(id=second.id).update(
+            done_on=now() - timedelta(minutes=5)
+            )
+
+        # stops behind the recent log, whatever comes after it
+        assert update_feeds(lag=60) == 1
+        assert Feed.objects.get(key='log').position == first.id
+        assert lang_feed('epo') == [first]
+
+        Log.objects.filter(id=second.id).update(
+            done_on=now() - timedelta(minutes=2)
+            )
+        assert update_feeds(lag=60) == 2
+        assert lang_feed('epo') == [third, second, first]
@@ -0,0 +1,193 @@
+from pytoeba.models import Link
+from pytoeba.graph_backends.incremental_backend import IncrementalBackend
+from collections import deque
+import random
+import pytest
+
+
+def closure(edges, max_level=None):
+    adjacency = {}
+    for node1, node2 in edges:
+        adjacency.setdefault(node1, set()).add(node2)
+
+    levels = {}
+    for source in adjacency:
+        seen = {source: 0}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for next_node in adjacency.get(node, ()):
+                if next_node not in seen:
+                    seen[next_node] = seen[node] + 1
+                    queue.append(next_node)
+        for target, level in seen.items():
+            if target != source and (max_level is None or level <= max_level):
+                levels[(source, target)] = level
+    return levels
+
+
+def stored_links(edges, max_level=None):
+    links = []
+    levels = sorted(closure(edges, max_level).items())
+    for i, ((node1, node2), level) in enumerate(levels):
+        links.append(Link(id=i + 1, side1_id=node1, side2_id=node2, level=level))
+    return links
+
+
+def apply_diff(links, recomputed):
+    levels = dict(((l.side1_id, l.side2_id), l.level) for l in links)
+    for link in recomputed['deleted']:
+        del levels[(link.side1_id, link.side2_id)]
+    for link in recomputed['updated']:
+        assert (link.side1_id, link.side2_id) in levels
+        levels[(link.side1_id, link.side2_id)] = link.level
+    for link in recomputed['created']:
+        assert (link.side1_id, link.side2_id) not in levels
+        levels[(link.side1_id, link.side2_id)] = link.level
+    return levels
+
+
+def check_random_edits(backend, max_level=None):
+    rand = random.Random(42)
+    for _ in xrange(20):
+        nodes = range(1, 16)
+        edges = bidirectional(
+            rand.sample([(a, b) for a in nodes for b in nodes if a < b], 20)
+            )
+        links = stored_links(edges, max_level)
+        graph = backend(links, max_level=max_level)
+
+        for _ in xrange(10):
+            node1, node2 = rand.sample(nodes, 2)
+            if (node1, node2) in edges and rand.random() < 0.5:
+                graph.remove_edge(node1, node2)
+                edges.discard((node1, node2))
+            else:
+                graph.add_edge(node1, node2)
+                edges.add((node1, node2))
+
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        assert apply_diff(links, recomputed) == closure(edges, max_level)
+
+
+def bidirectional(pairs):
+    edges = set()
+    for node1, node2 in pairs:
+        edges.add((node1, node2))
+        edges.add((node2, node1))
+    return edges
+
+
+class TestIncrementalBackend():
+
+    def test_add_edge_joins_components(self):
+        edges = bidirectional([(1, 2), (3, 4)])
+        links = stored_links(edges)
+        graph = IncrementalBackend(links)
+        graph.add_edge(2, 3)
+        graph.add_edge(3, 2)
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        assert not recomputed['updated']
+        assert not recomputed['deleted']
+        assert len(recomputed['created']) == 8
+        assert apply_diff(links, recomputed) == \
+            closure(edges | bidirectional([(2, 3)]))
+
+    def test_add_edge_only_touches_shortened_pairs(self):
+        edges = bidirectional([(1, 2), (2, 3), (3, 4), (4, 5)])
+        links = stored_links(edges)
+        graph = IncrementalBackend(links)
+        graph.add_edge(1, 5)
+        graph.add_edge(5, 1)
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        assert not recomputed['created']
+        assert not recomputed['deleted']
+        updated = set((l.side1_id, l.side2_id) for l in recomputed['updated'])
+        assert updated == set([(1, 5), (5, 1), (1, 4), (4, 1), (2, 5), (5, 2)])
+        assert apply_diff(links, recomputed) == \
+            closure(edges | bidirectional([(1, 5)]))
+
+    def test_remove_edge_splits_component(self):
+        edges = bidirectional([(1, 2), (2, 3)])
+        links = stored_links(edges)
+        graph = IncrementalBackend(links)
+        graph.remove_edge(2, 3)
+        graph.remove_edge(3, 2)
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        assert not recomputed['created']
+        assert not recomputed['updated']
+        assert all(link.id for link in recomputed['deleted'])
+        assert apply_diff(links, recomputed) == closure(bidirectional([(1, 2)]))
+
+    def test_random_edits_match_full_recompute(self):
+        check_random_edits(IncrementalBackend)
+
+    def test_random_edits_with_max_level(self):
+        check_random_edits(IncrementalBackend, max_level=2)
+
+    def test_rows_past_max_level_are_deleted(self):
+        edges = bidirectional([(1, 2), (2, 3), (3, 4)])
+        links = stored_links(edges)
+        graph = IncrementalBackend(links, max_level=2)
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        deleted = set((l.side1_id, l.side2_id) for l in recomputed['deleted'])
+        assert deleted == set([(1, 4), (4, 1)])
+        assert apply_diff(links, recomputed) == closure(edges, 2)
+
+
+class TestCSGraphBackend():
+
+    def test_stored_levels_are_not_changes(self):
+        pytest.importorskip('scipy')
+        from pytoeba.graph_backends.csgraph_backend import CSGraphBackend
+        graph = CSGraphBackend(stored_links(bidirectional([(1, 2), (2, 3)])))
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        assert recomputed == {'created': [], 'updated': [], 'deleted': []}
+
+    def test_new_node(self):
+        pytest.importorskip('scipy')
+        from pytoeba.graph_backends.csgraph_backend import CSGraphBackend
+        links = stored_links(bidirectional([(1, 2)]))
+        graph = CSGraphBackend(links)
+        graph.add_edge(2, 9)
+        graph.add_edge(9, 2)
+        recomputed = graph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        assert apply_diff(links, recomputed) == \
+            closure(bidirectional([(1, 2), (2, 9)]))
+
+    def test_random_edits_match_full_recompute(self):
+        pytest.importorskip('scipy')
+        from pytoeba.graph_backends.csgraph_backend import CSGraphBackend
+        check_random_edits(CSGraphBackend)
+
+    def test_random_edits_with_max_level(self):
+        pytest.importorskip('scipy')
+        from pytoeba.graph_backends.csgraph_backend import CSGraphBackend
+        check_random_edits(CSGraphBackend, max_level=2)
+
+
+class TestNetworkxBackend():
+
+    def test_random_edits_match_full_recompute(self):
+        pytest.importorskip('networkx')
+        from pytoeba.graph_backends.networkx_backend import NetworkxBackend
+        check_random_edits(NetworkxBackend)
+
+    def test_random_edits_with_max_level(self):
+        pytest.importorskip('networkx')
+        from pytoeba.graph_backends.networkx_backend import NetworkxBackend
+        check_random_edits(NetworkxBackend, max_level=2)
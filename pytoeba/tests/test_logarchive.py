@@ -0,0 +1,69 @@
+from pytoeba.models import Log, LogArchive, Sentence
+from pytoeba.utils import work_as, now
+from pytoeba.logarchive import archive_logs, archived_logs
+from datetime import timedelta
+import pytest
+import os
+
+
+def make_logs(user):
+    sents = []
+    with work_as(user):
+        for i in xrange(3):
+            sent = Sentence.objects.add('archived %s' % i, 'eng')
+            sent.edit('archived %s, edited' % i)
+            sents.append(sent)
+    return sents
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestLogArchive():
+
+    def test_archive_logs(db, user, tmpdir):
+        path = str(tmpdir.join('logs'))
+        a, b, c = make_logs(user)
+        old = now() - timedelta(days=60)
+        Log.objects.exclude(sentence=c).update(done_on=old)
+        live = list(Log.objects.filter(sentence=c).order_by('id'))
+        archived_ids = list(
+            Log.objects.exclude(sentence=c).order_by('id')
+                       .values_list('id', flat=True)
+            )
+
+        cutoff = now() - timedelta(days=30)
+        assert archive_logs(cutoff, path=path, segment_size=3) == 4
+        assert list(Log.objects.order_by('id')) == live
+        assert len(os.listdir(path)) == 2
+        assert LogArchive.objects.filter(sentence_id=a.id).count() == 1
+        assert LogArchive.objects.filter(sentence_id=b.id).count() == 2
+
+        logs = archived_logs(path=path)
+        assert [log.id for log in logs] == archived_ids
+        assert logs[0].sentence_id == a.id
+        assert logs[0].type == 'sad'
+        assert logs[1].change_set == 'archived 0, edited'
+        assert abs(logs[0].done_on - old) < timedelta(seconds=1)
+
+        assert [log.sentence_id for log in archived_logs([b.id], path=path)] \
+            == [b.id, b.id]
+        assert archived_logs([a.id], since=cutoff, path=path) == []
+        assert archived_logs([c.id], path=path) == []
+        assert archive_logs(cutoff, path=path) == 0
+
+    def test_archive_keeps_logs_it_did_not_read(db, user, tmpdir, monkeypatch):
+        from pytoeba import logarchive
+        make_logs(user)
+        Log.objects.update(done_on=now() - timedelta(days=60))
+        ids = list(Log.objects.order_by('id').values_list('id', flat=True))
+        late = ids[2]
+        read = logarchive._log_rows
+
+        # as if the log in the middle committed after the rows were read
+        def log_rows(*args):
+            return (row for row in read(*args) if row[0] != late)
+
+        monkeypatch.setattr(logarchive, '_log_rows', log_rows)
+        path = str(tmpdir.join('logs'))
+        assert archive_logs(now(), path=path) == len(ids) - 1
+        assert list(Log.objects.values_list('id', flat=True)) == [late]
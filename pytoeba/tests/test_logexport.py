@@ -0,0 +1,86 @@
+from pytoeba.models import Log, Sentence
+from pytoeba.utils import work_as
+from pytoeba.logexport import log_rows, export_logs
+from pytoeba.views import export_log_view
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.client import RequestFactory
+from cStringIO import StringIO
+import pytest
+import gzip
+import json
+
+
+def make_logs(user, count):
+    with work_as(user):
+        for i in xrange(count):
+            Sentence.objects.add('exported %s' % i, 'eng')
+    # shared timestamps have to be told apart by id
+    done_on = Log.objects.order_by('id')[0].done_on
+    Log.objects.update(done_on=done_on)
+    return list(Log.objects.order_by('id').values_list('id', flat=True))
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestLogExport():
+
+    def test_log_rows(db, user):
+        ids = make_logs(user, 5)
+        assert [row[0] for row in log_rows(chunk_size=2)] == ids
+
+        rows = list(log_rows(limit=3, chunk_size=2))
+        assert [row[0] for row in rows] == ids[:3]
+        after = rows[-1][4]
+        assert [row[0] for row in log_rows(after, rows[-1][0])] == ids[3:]
+        assert list(log_rows(after)) == []
+
+        with pytest.raises(ValueError):
+            log_rows(after_id=ids[0])
+        with pytest.raises(ValueError):
+            log_rows(limit=-1)
+        assert list(log_rows(limit=0)) == []
+
+    def test_formats(db, user):
+        ids = make_logs(user, 2)
+        chunks, content_type = export_logs('ndjson')
+        lines = ''.join(chunks).splitlines()
+        assert content_type == 'application/x-ndjson'
+        assert [json.loads(line)['id'] for line in lines] == ids
+        assert json.loads(lines[0])['change_set'] == 'exported 0'
+
+        chunks, _ = export_logs('csv', compress=True)
+        data = gzip.GzipFile(fileobj=StringIO(''.join(chunks))).read()
+        lines = data.splitlines()
+        assert lines[0].startswith('id,sentence_id,type')
+        assert len(lines) == 3
+
+        with pytest.raises(ValueError):
+            export_logs('xml')
+
+    def test_view(db, user):
+        ids = make_logs(user, 3)
+        done_on = Log.objects.get(id=ids[0]).done_on.isoformat()
+        request = RequestFactory().get(
+            '/logs/export/', {'after': done_on, 'after_id': ids[0]}
+            )
+        response = export_log_view(request)
+        lines = ''.join(response.streaming_content).splitlines()
+        assert [json.loads(line)['id'] for line in lines] == ids[1:]
+
+        for params in [
+                {'after': 'yesterday'}, {'after_id': ids[0]}, {'limit': -1}
+                ]:
+            request = RequestFactory().get('/logs/export/', params)
+            assert export_log_view(request).status_code == 400
+
+    def test_command(db, user, tmpdir):
+        ids = make_logs(user, 3)
+        path = str(tmpdir.join('logs.ndjson.gz'))
+        call_command('export_logs', gzip=True, limit=2, output=path)
+        lines = gzip.open(path).read().splitlines()
+        assert [json.loads(line)['id'] for line in lines] == ids[:2]
+
+        for options in [{'after_id': ids[0]}, {'limit': -1}]:
+            with pytest.raises(CommandError):
+                call_command('export_logs', output=path, **options)
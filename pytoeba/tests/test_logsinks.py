@@ -0,0 +1,126 @@
+from pytoeba.models import Log, Sentence
+from pytoeba.utils import work_as
+from pytoeba import logsinks
+from pytoeba.logsinks import (
+    BufferedLogSink, ThreadedLogSink, buffered_logs, BufferedLogMiddleware
+    )
+from django.db import connection
+from django.http import HttpResponse, HttpResponseServerError
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from pytest import raises
+import pytest
+
+
+@pytest.fixture
+def buffered(monkeypatch):
+    sink = BufferedLogSink()
+    monkeypatch.setattr(logsinks, '_log_sink', sink)
+    return sink
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestBufferedLogSink():
+
+    def test_logs_written_at_the_end(db, user, buffered):
+        sents = [
+            Sentence.objects.create(lang='eng', text='buffered %s' % i,
+                                    added_by=user)
+            for i in xrange(3)
+            ]
+        with work_as(user):
+            with CaptureQueriesContext(connection) as queries:
+                with buffered_logs():
+                    for sent in sents:
+                        sent.lock()
+                    assert not Log.objects.filter(type='sld').exists()
+        inserts = [
+            query for query in queries
+            if 'INSERT INTO "pytoeba_log"' in query['sql']
+            ]
+        assert len(inserts) == 1
+        assert sorted(Log.objects.filter(type='sld')
+                         .values_list('sentence_id', flat=True)) == \
+            sorted(sent.id for sent in sents)
+
+    def test_logs_dropped_on_error(db, user, buffered):
+        sent = Sentence.objects.create(lang='eng', text='dropped',
+                                       added_by=user)
+        with work_as(user):
+            with raises(ValueError):
+                with buffered_logs():
+                    sent.lock()
+                    raise ValueError
+            assert not Log.objects.filter(type='sld').exists()
+            sent.unlock()
+        assert Log.objects.filter(type='sul').count() == 1
+
+
+    def test_middleware(db, user, buffered):
+        sents = [
+            Sentence.objects.create(lang='eng', text='view %s' % i,
+                                    added_by=user)
+            for i in xrange(3)
+            ]
+
+        def view(request, response=HttpResponse):
+            for sent in sents:
+                sent.lock()
+            assert not Log.objects.filter(type='sld').exists()
+            return response()
+
+        def failing_view(request):
+            sents[0].unlock()
+            raise ValueError
+
+        middleware = BufferedLogMiddleware()
+        request = RequestFactory().post('/')
+        with work_as(user):
+            response = middleware.process_view(
+                request, view, (), {'response': HttpResponseServerError}
+                )
+            assert response.status_code == 500
+            assert not Log.objects.filter(type='sld').exists()
+
+            with raises(ValueError):
+                middleware.process_view(request, failing_view, (), {})
+            assert not Log.objects.filter(type='sul').exists()
+
+            with CaptureQueriesContext(connection) as queries:
+                response = middleware.process_view(request, view, (), {})
+        assert response.status_code == 200
+        inserts = [
+            query for query in queries
+            if 'INSERT INTO "pytoeba_log"' in query['sql']
+            ]
+        assert len(inserts) == 1
+        assert Log.objects.filter(type='sld').count() == 3
+
+
+def test_threaded_log_sink(monkeypatch):
+    written = []
+    monkeypatch.setattr(
+        logsinks, 'bulk_create', lambda logs, using: written.append(logs)
+        )
+    sink = ThreadedLogSink()
+    sink.batch_size = 2
+    sink.write([Log(type='sld') for _ in xrange(5)])
+    sink.flush()
+    assert sum(len(logs) for logs in written) == 5
+    assert max(len(logs) for logs in written) <= 2
+
+
+def test_threaded_log_sink_retries_failed_batch(monkeypatch):
+    written = []
+
+    def bulk_create(logs, using):
+        if any(log.type == 'bad' for log in logs):
+            raise ValueError
+        written.extend(logs)
+
+    monkeypatch.setattr(logsinks, 'bulk_create', bulk_create)
+    sink = ThreadedLogSink()
+    sink.write([Log(type='sld'), Log(type='bad'), Log(type='sul')])
+    sink.flush()
+    assert sorted(log.type for log in written) == ['sld', 'sul']
@@ -1,6 +1,6 @@
-from pytoeba.models import Log, Sentence
+from pytoeba.models import Link, Log, Sentence
 from pytoeba.utils import work_as
-from pytoeba.exceptions import NotEditableError
+from pytoeba.exceptions import NotEditableError, DuplicateSentenceError
 from django.db import IntegrityError
 from django.core.exceptions import ObjectDoesNotExist
 from pytest import raises
@@ -194,6 +194,48 @@ class TestSentenceQuerySetMethods():
         assert sents[0] == sent
         assert sents[1] == sent2
 
+    def test_sentence_qs_lock_in_chunks(db, user):
+        sents = make_sents(user, 5)
+        done = []
+        with work_as(user):
+            count = Sentence.objects.filter(is_editable=True)\
+                                    .lock(chunk_size=2, progress=done.append)
+        assert count == 5
+        assert done == [2, 4, 5]
+        assert not Sentence.objects.filter(is_editable=True).exists()
+        logs = Log.objects.filter(type='sld')
+        assert sorted(log.sentence_id for log in logs) == \
+            sorted(sent.id for sent in sents)
+        assert logs[0].source_hash_id == \
+            Sentence.objects.get(id=logs[0].sentence_id).hash_id
+
+    def test_sentence_qs_change_language_pushed_down(db, user):
+        sents = make_sents(user, 3)
+        done = []
+        with work_as(user):
+            count = Sentence.objects.filter(id__in=[s.id for s in sents[:2]])\
+                .change_language('fra', pushdown=True, progress=done.append)
+        assert count == 2
+        assert done == [2]
+        assert list(Sentence.objects.filter(lang='fra')) == sents[:2]
+        logs = Log.objects.filter(type='slc').order_by('sentence')
+        assert [log.sentence_id for log in logs] == [s.id for s in sents[:2]]
+        assert [log.source_hash_id for log in logs] == \
+            [s.hash_id for s in sents[:2]]
+        assert all(
+            log.source_lang == 'eng' and log.target_lang == 'fra' and
+            log.done_by == user and log.done_on for log in logs
+            )
+
+    def test_sentence_qs_lock_pushed_down_setting(db, user):
+        from django.test.utils import override_settings
+        make_sents(user, 2)
+        with override_settings(PYTOEBA_PUSHDOWN_UPDATES=True):
+            with work_as(user):
+                assert Sentence.objects.unlocked().lock() == 2
+        assert Sentence.objects.locked().count() == 2
+        assert Log.objects.filter(type='sld').count() == 2
+
     def test_sentence_qs_unlock(db, sent, user, sent2):
         sent.save()
         sent2.save()
@@ -248,3 +290,232 @@ class TestSentenceQuerySetMethods():
         assert len(sents) == 2
         assert sents[0] == sent
         assert sents[1] == sent2
+
+
+def make_sents(user, count):
+    sents = []
+    for i in xrange(count):
+        sent = Sentence(lang='eng', text='pair %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+    return sents
+
+
+def stored_levels():
+    return dict(
+        ((link.side1_id, link.side2_id), link.level)
+        for link in Link.objects.all()
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestSentenceManagerMethods():
+
+    def test_bulk_link_pairs(db, user):
+        a, b, c, d, e = make_sents(user, 5)
+        with work_as(user):
+            Sentence.objects.bulk_link_pairs([
+                (a.hash_id, b.hash_id), (b.hash_id, c.hash_id),
+                (d.hash_id, e.hash_id), (b.hash_id, a.hash_id),
+                (c.hash_id, c.hash_id)
+                ])
+        levels = stored_levels()
+        assert len(levels) == 8
+        assert levels[(a.id, c.id)] == levels[(c.id, a.id)] == 2
+        assert levels[(a.id, b.id)] == levels[(d.id, e.id)] == 1
+        assert Log.objects.filter(type='lad').count() == 6
+        clusters = [Sentence.objects.get(id=s.id).cluster_id for s in (a, b, c, d, e)]
+        assert clusters[0] == clusters[1] == clusters[2] != clusters[3] == clusters[4]
+
+    def test_bulk_unlink_pairs(db, user):
+        a, b, c, d, e = make_sents(user, 5)
+        with work_as(user):
+            Sentence.objects.bulk_link_pairs([
+                (a.hash_id, b.hash_id), (b.hash_id, c.hash_id),
+                (d.hash_id, e.hash_id)
+                ])
+            Sentence.objects.bulk_unlink_pairs([
+                (b.hash_id, c.hash_id), (e.hash_id, d.hash_id)
+                ])
+        assert stored_levels() == {(a.id, b.id): 1, (b.id, a.id): 1}
+        assert Log.objects.filter(type='lrd').count() == 4
+        assert Sentence.objects.exclude(cluster_id=None).count() == 2
+
+    def test_bulk_link_pairs_unknown_hash(db, user):
+        a, = make_sents(user, 1)
+        with raises(ObjectDoesNotExist):
+            Sentence.objects.bulk_link_pairs([(a.hash_id, 'missing')])
+
+    def test_resolve(db, user):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        a, b = make_sents(user, 2)
+        with CaptureQueriesContext(connection) as queries:
+            refs = Sentence.objects.resolve([a.hash_id, b.hash_id, 'missing'])
+            assert len(queries) == 1
+            Sentence.objects.resolve([a.hash_id, b.hash_id])
+            assert len(queries) == 1
+            assert list(Sentence.objects.bulk_show([a.hash_id])) == [a]
+            assert len(queries) == 2
+        assert refs == {
+            a.hash_id: (a.id, 'eng', False), b.hash_id: (b.id, 'eng', False)
+            }
+
+        with work_as(user):
+            a.change_language('fra')
+            Sentence.objects.filter(id=b.id).delete()
+        refs = Sentence.objects.resolve([a.hash_id, b.hash_id])
+        assert refs[a.hash_id].lang == 'fra'
+        assert refs[b.hash_id].is_deleted
+
+    def test_link_by_hash_id(db, user):
+        a, b, c = make_sents(user, 3)
+        Sentence.objects.resolve([a.hash_id, b.hash_id, c.hash_id])
+        with work_as(user):
+            Sentence.objects.link(a.hash_id, b.hash_id)
+            Sentence.objects.bulk_link(a.hash_id, [c.hash_id])
+        levels = stored_levels()
+        assert levels[(b.id, c.id)] == 2
+        log = Log.objects.get(type='lad', sentence=a, target_id=b.id)
+        assert log.source_hash_id == a.hash_id
+        assert log.target_hash_id == b.hash_id
+        assert log.target_lang == 'eng'
+
+    def test_history(db, user, tmpdir):
+        from django.test.utils import override_settings
+        from pytoeba.logarchive import archive_logs
+        from datetime import timedelta
+        with work_as(user):
+            sent = Sentence.objects.add('the history one', 'eng')
+            sent.lock()
+            sent.unlock()
+            sent.edit('the history two')
+            sent.edit('a history two')
+        start = Log.objects.get(type='sad').done_on
+        for days, log in enumerate(Log.objects.order_by('id')):
+            Log.objects.filter(id=log.id).update(
+                done_on=start + timedelta(days=days)
+                )
+
+        history = sent.history()
+        assert [rev.text for rev in history] == [
+            'the history one', 'the history two', 'a history two'
+            ]
+        assert [rev.number for rev in history] == [1, 2, 3]
+        assert history[1].type == 'sed'
+        assert history[1].done_by_id == user.id
+        assert Sentence.objects.history(sent.hash_id) == history
+        assert sent.history(until=start + timedelta(days=2)) == history[:1]
+
+        assert sent.text_at(start - timedelta(days=1)) is None
+        assert sent.text_at(start + timedelta(days=2)) == 'the history one'
+        assert Sentence.objects.text_at(
+            sent.hash_id, start + timedelta(days=10)
+            ) == 'a history two'
+        assert sent.diff(1) == [
+            ('replace', 'the', 'a'), ('equal', 'history', 'history'),
+            ('replace', 'one', 'two')
+            ]
+        assert sent.diff(1, 2)[-1] == ('replace', 'one', 'two')
+        for old, new in [(0, None), (4, None), (1, 0), (1, 4), (-1, 2)]:
+            with pytest.raises(ValueError):
+                sent.diff(old, new)
+
+        path = str(tmpdir.join('logs'))
+        with override_settings(PYTOEBA_LOG_ARCHIVE=path):
+            archive_logs(start + timedelta(days=3, hours=12))
+            assert Log.objects.filter(type__in=['sad', 'sed']).count() == 1
+            assert sent.history() == history
+            assert sent.text_at(start + timedelta(days=3)) == \
+                'the history two'
+
+    def test_bulk_add(db, user):
+        with work_as(user):
+            sents = Sentence.objects.bulk_add([
+                {'text': 'bulk one', 'lang': 'eng'},
+                {'text': 'bulk two', 'lang': 'eng'},
+                {'text': 'bulk one', 'lang': 'fra'},
+                ])
+        assert [sent.id for sent in sents] == [
+            Sentence.objects.get(hash_id=sent.hash_id).id for sent in sents
+            ]
+        stored = Sentence.objects.get(id=sents[1].id)
+        assert stored.owner == user
+        assert stored.length == len('bulk two')
+        assert stored.sim_hash == sents[1].sim_hash
+        logs = Log.objects.filter(type='sad')
+        assert sorted(log.sentence_id for log in logs) == \
+            sorted(sent.id for sent in sents)
+
+    def test_bulk_add_duplicates(db, user):
+        with work_as(user):
+            Sentence.objects.bulk_add([{'text': 'bulk one', 'lang': 'eng'}])
+        with raises(DuplicateSentenceError) as error:
+            Sentence.objects.bulk_add([
+                {'text': 'bulk one', 'lang': 'eng'},
+                {'text': 'bulk two', 'lang': 'eng'},
+                {'text': 'bulk two', 'lang': 'eng'},
+                ])
+        assert sorted(error.value.duplicates) == \
+            [('bulk one', 'eng'), ('bulk two', 'eng')]
+        assert Sentence.objects.count() == 1
+
+    def test_near_duplicates(db, user):
+        from pytoeba.utils import sim_hash, hamming_distance
+        with work_as(user):
+            sents = Sentence.objects.bulk_add([
+                {'text': 'The quick brown fox jumps over the lazy dog.',
+                 'lang': 'eng'},
+                {'text': 'The quick brown fox jumps over the lazy dog!',
+                 'lang': 'eng'},
+                {'text': 'Something else entirely, about cats.',
+                 'lang': 'eng'},
+                ])
+        close = hamming_distance(
+            sim_hash(sents[0].text), sim_hash(sents[1].text)
+            )
+        assert close <= 3
+
+        found = Sentence.objects.near_duplicates(sents[0])
+        assert found == [sents[1]]
+        assert found[0].distance == close
+        assert Sentence.objects.near_duplicates(sents[0].text)[0] == sents[0]
+        assert Sentence.objects.near_duplicates(sents[0], lang='fra') == []
+        with raises(ValueError):
+            Sentence.objects.near_duplicates(sents[0], max_distance=4)
+
+    def test_add_rejects_near_duplicates(db, user):
+        from django.test.utils import override_settings
+        from pytoeba.exceptions import NearDuplicateError
+        text = 'The quick brown fox jumps over the lazy dog.'
+        with work_as(user):
+            sent = Sentence.objects.add(text, 'eng')
+        with override_settings(PYTOEBA_NEAR_DUPLICATE_DISTANCE=3):
+            with raises(NearDuplicateError) as error:
+                Sentence.objects.add(text[:-1] + '!', 'eng')
+            assert error.value.duplicates == {text[:-1] + '!': [sent]}
+            with work_as(user):
+                Sentence.objects.add(text[:-1] + '!', 'fra')
+
+    def test_bulk_add_rejects_near_duplicates_in_batch(db, user):
+        from django.test.utils import override_settings
+        from pytoeba.exceptions import NearDuplicateError
+        text = 'The quick brown fox jumps over the lazy dog.'
+        with override_settings(PYTOEBA_NEAR_DUPLICATE_DISTANCE=3):
+            with work_as(user):
+                with raises(NearDuplicateError) as error:
+                    Sentence.objects.bulk_add([
+                        {'text': text, 'lang': 'eng'},
+                        {'text': 'Something else entirely, about cats.',
+                         'lang': 'eng'},
+                        {'text': text[:-1] + '!', 'lang': 'eng'},
+                        ])
+                assert error.value.duplicates == {text[:-1] + '!': [text]}
+                assert Sentence.objects.count() == 0
+
+                sents = Sentence.objects.bulk_add([
+                    {'text': text, 'lang': 'eng'},
+                    {'text': text[:-1] + '!', 'lang': 'fra'},
+                    ])
+        assert len(sents) == 2
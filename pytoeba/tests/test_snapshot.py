@@ -0,0 +1,69 @@
+from pytoeba.models import Sentence
+from pytoeba.utils import work_as
+from django.test.utils import override_settings
+import pytest
+
+np = pytest.importorskip('numpy')
+
+
+def make_sents(user, count):
+    sents = []
+    for i in xrange(count):
+        sent = Sentence(lang='eng', text='snapshot %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+    return sents
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+class TestTranslationGraph():
+
+    def test_export_and_update(db, user, tmpdir):
+        from pytoeba.snapshot import (
+            TranslationGraph, export_snapshot, update_snapshot
+            )
+        path = str(tmpdir.join('graph'))
+        a, b, c, d, e = make_sents(user, 5)
+        with work_as(user):
+            a.link(b)
+            b.link(c)
+        export_snapshot(path)
+
+        graph = TranslationGraph(path)
+        assert graph.translations(a.id) == {b.id: 1, c.id: 2}
+        assert graph.translations(a.id, max_level=1) == {b.id: 1}
+        assert sorted(graph.neighbours(b.id)) == sorted([a.id, c.id])
+        assert graph.translations(e.id) == {}
+        assert not graph.reload_if_changed()
+
+        with work_as(user):
+            c.link(d)
+            a.unlink(b)
+            a.link(e)
+        update_snapshot(path)
+
+        assert graph.reload_if_changed()
+        assert graph.translations(a.id) == {e.id: 1}
+        assert graph.translations(b.id) == {c.id: 1, d.id: 2}
+
+        # nothing new to replay
+        version = graph.version
+        update_snapshot(path)
+        assert not graph.reload_if_changed()
+        assert graph.version == version
+
+    def test_translation_levels_from_snapshot(db, user, tmpdir):
+        from pytoeba.snapshot import export_snapshot
+        path = str(tmpdir.join('graph'))
+        a, b, c = make_sents(user, 3)
+        with work_as(user):
+            a.link(b)
+            b.link(c)
+        from_links = a.get_translation_levels()
+        assert from_links == {b.id: 1, c.id: 2}
+
+        export_snapshot(path)
+        with override_settings(PYTOEBA_GRAPH_SNAPSHOT=path):
+            assert a.get_translation_levels() == from_links
+            assert a.get_translation_levels(max_level=1) == {b.id: 1}
@@ -1,5 +1,5 @@
 from pytoeba.models import PytoebaUser
-from pytoeba.models import Log
+from pytoeba.models import Log, Sentence
 from pytoeba.utils import work_as, get_user
 from pytoeba.exceptions import UnknownUserError
 from pytest import raises
@@ -76,3 +76,291 @@ def test_work_as_thread_safe(db, user):
         t.join()
 
     assert current_user == user1
+
+
+def cluster_of(sent):
+    return Sentence.objects.get(id=sent.id).cluster_id
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_clusters_follow_links(db, user):
+    from pytoeba.utils import work_as, rebuild_clusters
+    sents = []
+    for i in xrange(5):
+        sent = Sentence(lang='eng', text='cluster %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+    a, b, c, d, e = sents
+
+    with work_as(user):
+        a.link(b)
+        c.link(d)
+        assert cluster_of(a) == cluster_of(b) != cluster_of(c) == cluster_of(d)
+        assert cluster_of(e) is None
+
+        b.link(c)
+        assert len(set(cluster_of(s) for s in (a, b, c, d))) == 1
+        assert set(Sentence.objects.get(id=a.id).get_cluster()) == \
+            set([a, b, c, d])
+
+        b.unlink(c)
+        assert cluster_of(a) == cluster_of(b) != cluster_of(c) == cluster_of(d)
+
+        a.unlink(b)
+        assert cluster_of(a) is None
+        assert cluster_of(b) is None
+
+    before = [cluster_of(s) for s in sents]
+    rebuild_clusters()
+    assert [cluster_of(s) is None for s in sents] == \
+        [cluster is None for cluster in before]
+    assert cluster_of(c) == cluster_of(d)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_redraw_subgraph_max_link_level(db, user):
+    from pytoeba.utils import work_as
+    from pytoeba.models import Link
+    from django.test.utils import override_settings
+    sents = []
+    for i in xrange(4):
+        sent = Sentence(lang='eng', text='depth %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+    a, b, c, d = sents
+
+    with override_settings(PYTOEBA_MAX_LINK_LEVEL=2):
+        with work_as(user):
+            a.link(b)
+            b.link(c)
+            c.link(d)
+        assert Link.objects.count() == 10
+        assert not Link.objects.filter(level__gt=2).exists()
+        assert len(set(cluster_of(s) for s in sents)) == 1
+
+        with work_as(user):
+            a.link(d)
+        assert Link.objects.count() == 12
+        assert Link.objects.get(side1=a, side2=c).level == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_deferred_links_match_sync(db, user):
+    from pytoeba.utils import work_as, drain_graph_queue
+    from pytoeba.models import Link, GraphQueue
+    from django.test.utils import override_settings
+    sents = []
+    for i in xrange(4):
+        sent = Sentence(lang='eng', text='deferred %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+    a, b, c, d = sents
+
+    def levels():
+        return dict(
+            ((link.side1_id, link.side2_id), link.level)
+            for link in Link.objects.all()
+            )
+
+    with work_as(user):
+        a.link(b)
+        b.link(c)
+        c.link(d)
+    expected = levels()
+    with work_as(user):
+        b.unlink(c)
+        a.unlink(b)
+        c.unlink(d)
+    assert not Link.objects.exists()
+
+    with override_settings(PYTOEBA_DEFERRED_LINKS=True):
+        with work_as(user):
+            a.link(b)
+            b.link(c)
+            c.link(d)
+        assert not Link.objects.filter(level__gt=1).exists()
+        assert len(set(cluster_of(s) for s in sents)) == 1
+        assert GraphQueue.objects.exists()
+
+        assert drain_graph_queue()[1] == 1
+        assert not GraphQueue.objects.exists()
+        assert levels() == expected
+
+        with work_as(user):
+            b.unlink(c)
+        drain_graph_queue()
+        assert cluster_of(a) == cluster_of(b) != cluster_of(c) == cluster_of(d)
+        assert set(levels()) == set([(a.id, b.id), (b.id, a.id),
+                                     (c.id, d.id), (d.id, c.id)])
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_bulk_helpers_run_in_batches(db, user):
+    from pytoeba.utils import bulk_create, bulk_update, bulk_delete
+    from pytoeba.models import Link
+    sents = []
+    for i in xrange(3):
+        sent = Sentence(lang='eng', text='batched %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+
+    links = [
+        Link(side1_id=s1.id, side2_id=s2.id, level=1)
+        for s1 in sents for s2 in sents if s1 != s2
+        ]
+    bulk_create(links, batch_size=4)
+    assert Link.objects.count() == 6
+
+    for link in links:
+        link.level = 2
+    statements = bulk_update(
+        links, update_fields=['level'], case_fields=['side1_id', 'side2_id'],
+        batch_size=4, as_sql=True
+        )
+    assert len(statements) == 2
+    assert statements[0][0] != statements[1][0]
+    bulk_update(
+        iter(links), update_fields=['level'],
+        case_fields=['side1_id', 'side2_id'], batch_size=4
+        )
+    assert set(Link.objects.values_list('level', flat=True)) == set([2])
+
+    stored = list(Link.objects.all())
+    assert len(bulk_delete(stored, batch_size=5, as_sql=True)) == 2
+    bulk_delete(stored[:5], batch_size=2)
+    assert list(Link.objects.all()) == stored[5:]
+
+
+def test_get_batch_size(db):
+    from pytoeba.utils import get_batch_size, DEFAULT_BULK_BATCH_SIZE
+    from django.db import connection
+    from django.test.utils import override_settings
+    largest = connection.ops.bulk_batch_size([None] * 10, xrange(10 ** 6))
+    assert get_batch_size(connection, 10) == \
+        min(largest, DEFAULT_BULK_BATCH_SIZE)
+    assert get_batch_size(connection, 10, 20) == 20
+    assert get_batch_size(connection, 10, largest + 1) == largest
+    with override_settings(PYTOEBA_BULK_BATCH_SIZE=30):
+        assert get_batch_size(connection, 10) == 30
+
+
+def upsert_tags(user, hash_ids, **kwargs):
+    from pytoeba.utils import bulk_upsert
+    from pytoeba.models import Tag
+    tags = [Tag(hash_id=hash_id, added_by=user) for hash_id in hash_ids]
+    return tags, bulk_upsert(tags, case_field='hash_id', **kwargs)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_bulk_upsert_native(db, user):
+    from pytoeba.utils import _upsert_features
+    from pytoeba.models import Tag
+    from django.db import connection
+    native, return_ids = _upsert_features(connection)
+    if not native:
+        pytest.skip('no native upsert on this database')
+
+    tags, (inserted, updated) = upsert_tags(user, ['a', 'b'], batch_size=1)
+    assert Tag.objects.count() == 2
+    first = dict(Tag.objects.values_list('hash_id', 'id'))
+    tags, (inserted, updated) = upsert_tags(user, ['b', 'c', 'c'])
+    assert Tag.objects.count() == 3
+    assert dict(Tag.objects.values_list('hash_id', 'id'))['b'] == first['b']
+    if return_ids:
+        assert tags[0].id == first['b']
+        assert tags[2].id == Tag.objects.get(hash_id='c').id
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_bulk_upsert_fallback(db, user, monkeypatch):
+    from pytoeba.models import Tag
+    import pytoeba.utils
+    upsert_tags(user, ['a', 'b'])
+    first = dict(Tag.objects.values_list('hash_id', 'id'))
+    monkeypatch.setattr(
+        pytoeba.utils, '_upsert_features', lambda connection: (False, False)
+        )
+    tags, (inserted, updated) = upsert_tags(user, ['b', 'c'])
+    assert [tag.hash_id for tag in updated] == ['b']
+    assert [tag.hash_id for tag in inserted] == ['c']
+    assert updated[0].id == first['b']
+    assert Tag.objects.count() == 3
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixture('user')
+def test_bulk_update_values_strategy(db, user):
+    from pytoeba.utils import bulk_create, bulk_update
+    from pytoeba.models import Link
+    sents = []
+    for i in xrange(3):
+        sent = Sentence(lang='eng', text='joined %s' % i, added_by=user)
+        sent.save()
+        sents.append(sent)
+    pairs = [(s1.id, s2.id) for s1 in sents for s2 in sents if s1 != s2]
+    bulk_create([Link(side1_id=s1, side2_id=s2, level=1) for s1, s2 in pairs])
+
+    changes = [
+        Link(side1_id=s1, side2_id=s2, level=i + 2)
+        for i, (s1, s2) in enumerate(pairs[:4])
+        ]
+    # a repeated pair takes the last value
+    changes.append(Link(side1_id=pairs[0][0], side2_id=pairs[0][1], level=9))
+    bulk_update(
+        changes, update_fields=['level'], case_fields=['side1_id', 'side2_id'],
+        batch_size=2, strategy='values'
+        )
+
+    levels = dict(
+        ((l.side1_id, l.side2_id), l.level) for l in Link.objects.all()
+        )
+    assert levels == {
+        pairs[0]: 9, pairs[1]: 3, pairs[2]: 4, pairs[3]: 5,
+        pairs[4]: 1, pairs[5]: 1
+    }
+
+
+def test_sim_hash_many():
+    from pytoeba.utils import sim_hash, sim_hash_many
+    texts = [
+        u'The quick brown fox', u'', u'ab', u'caf\xe9 na\xefve \u4e2d\u6587',
+        'plain text!', u'x' * 300
+        ]
+    expected = [sim_hash(text) for text in texts]
+    assert sim_hash_many(texts, chunk_size=4) == expected
+    assert sim_hash_many(texts, workers=2, chunk_size=2) == expected
+
+
+def test_truncate_sim_hash():
+    from pytoeba.utils import truncate_sim_hash
+    assert truncate_sim_hash(2 ** 63 - 1) == 2 ** 63 - 1
+    assert truncate_sim_hash(2 ** 63) == 2 ** 63 // 10
+    assert truncate_sim_hash(2 ** 64 - 1) == (2 ** 64 - 1) // 10
+    assert truncate_sim_hash(12345) == 12345
+
+
+def test_hash_id_cache():
+    from pytoeba.utils import HashIdCache, SentenceRef
+    cache = HashIdCache(size=2)
+    cache.set_many({'a': SentenceRef(1, 'eng', False)})
+    cache.set_many({'b': SentenceRef(2, 'eng', False)})
+    assert cache.get_many(['a']) == {'a': (1, 'eng', False)}
+    cache.set_many({'c': SentenceRef(3, 'fra', True)})
+    assert sorted(cache.get_many(['a', 'b', 'c'])) == ['a', 'c']
+    cache.delete_many(['a'])
+    assert cache.get_many(['a', 'c']) == {'c': (3, 'fra', True)}
+
+    shared = HashIdCache(
+        size=0, alias='django.core.cache.backends.locmem.LocMemCache'
+        )
+    shared.set_many({'a': SentenceRef(1, 'eng', False)})
+    assert not shared.local
+    assert shared.get_many(['a', 'b']) == {'a': (1, 'eng', False)}
+    shared.clear()
+    assert shared.get_many(['a']) == {}
@@ -6,6 +6,7 @@ from .api import (
     TagSearchResource, CommentSearchResource, WallSearchResource,
     MessageSearchResource, UserSearchResource
 )
+from .views import export_log_view
 
 
 api = PyapiApi(api_name='api')
@@ -25,5 +26,6 @@ api.register(UserSearchResource())
 
 
 urlpatterns = patterns('',
+    url(r'^logs/export/$', export_log_view, name='log_export'),
     url(r'^', include(api.urls)),
 )
@@ -6,19 +6,26 @@ like hashing or getting a media path, etc...
 
 from django.conf import settings
 from django.utils import timezone
-from django.db import connections
+from django.db import connections, transaction
+from django.db.models import Count
 from django.db.models.fields import AutoField
 from django.db.models.loading import get_model
 
 from contextlib import contextmanager
-from threading import local
+from threading import local, Lock
 from .exceptions import UnknownUserError
 from docutils.core import publish_parts
 from importlib import import_module
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
+from itertools import chain, islice
+from array import array
+from difflib import SequenceMatcher
 from nltk import stem
 
+from hashlib import md5
+
 import os
+import re
 import uuid
 import simhash
 
@@ -46,8 +53,115 @@ def sim_hash(text):
     return simhash.Simhash(text).value
 
 
+# the largest value a BigIntegerField holds
+MAX_SIM_HASH = 2 ** 63 - 1
+
+
+def truncate_sim_hash(value):
+    # fingerprints too big for a signed 64 bit column lose their last
+    # decimal digit, as the first 19 digits of them used to be kept
+    if value > MAX_SIM_HASH:
+        return value // 10
+    return value
+
+
 def truncated_sim_hash(text):
-    return int('%.19s' % (sim_hash(text)))
+    return truncate_sim_hash(sim_hash(text))
+
+
+# same features simhash.Simhash builds from a text: lowercased runs of
+# word characters, joined and cut into overlapping 4 character windows
+SIM_HASH_TOKENS = re.compile(ur'[\w\u4e00-\u9fff]+')
+SIM_HASH_WIDTH = 4
+
+
+def sim_hash_features(text):
+    content = u''.join(SIM_HASH_TOKENS.findall(unicode(text).lower()))
+    return [
+        content[i:i + SIM_HASH_WIDTH]
+        for i in xrange(max(len(content) - SIM_HASH_WIDTH + 1, 1))
+        ]
+
+
+def _sim_hash_chunk(texts):
+    """
+    simhash.Simhash(text).value for every text, with the bit counting done
+    on all the features of the chunk at once.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return [sim_hash(text) for text in texts]
+
+    digests = []
+    offsets = []
+    for text in texts:
+        offsets.append(len(digests))
+        # Simhash only uses the low 64 bits of the md5 of every feature
+        digests.extend(
+            md5(feature.encode('utf-8')).digest()[8:]
+            for feature in sim_hash_features(text)
+            )
+
+    bits = np.unpackbits(
+        np.frombuffer(b''.join(digests), dtype=np.uint8).reshape(-1, 8),
+        axis=1
+        )
+    ones = np.add.reduceat(bits.astype(np.int32), offsets, axis=0)
+    counts = np.diff(offsets + [len(digests)]).reshape(-1, 1)
+    # a bit is set when at least as many features have it set as not
+    fingerprint = np.packbits((2 * ones >= counts).astype(np.uint8), axis=1)
+    return [int(value) for value in fingerprint.view('>u8').ravel()]
+
+
+def sim_hash_many(texts, workers=1, pool=None, chunk_size=1000):
+    """
+    sim_hash() of every text, in order. The texts are hashed in chunks,
+    on a pool of workers processes when workers is more than one or a
+    multiprocessing pool is given.
+    """
+    texts = list(texts)
+    tasks = list(chunks(texts, chunk_size))
+    if pool is None and workers > 1:
+        from multiprocessing import Pool
+        own_pool = Pool(workers)
+        try:
+            results = own_pool.map(_sim_hash_chunk, tasks)
+        finally:
+            own_pool.close()
+            own_pool.join()
+    elif pool is not None:
+        results = pool.map(_sim_hash_chunk, tasks)
+    else:
+        results = map(_sim_hash_chunk, tasks)
+    return list(chain.from_iterable(results))
+
+
+# the 64 bit simhash is also stored split into blocks, two hashes within
+# SIM_HASH_BLOCKS - 1 bits of each other necessarily share a whole block so
+# near duplicates can be found through equality lookups on the blocks
+SIM_HASH_BLOCKS = 4
+SIM_HASH_BLOCK_BITS = 64 // SIM_HASH_BLOCKS
+SIM_HASH_BLOCK_MASK = (1 << SIM_HASH_BLOCK_BITS) - 1
+SIM_BLOCK_FIELDS = ['sim_block_%d' % i for i in xrange(SIM_HASH_BLOCKS)]
+
+
+def sim_hash_blocks(value):
+    return [
+        (value >> (i * SIM_HASH_BLOCK_BITS)) & SIM_HASH_BLOCK_MASK
+        for i in xrange(SIM_HASH_BLOCKS)
+        ]
+
+
+def join_sim_hash_blocks(blocks):
+    value = 0
+    for i, block in enumerate(blocks):
+        value |= block << (i * SIM_HASH_BLOCK_BITS)
+    return value
+
+
+def hamming_distance(value1, value2):
+    return bin(value1 ^ value2).count('1')
 
 
 thread_local_storage = local()
@@ -78,7 +192,10 @@ def sentence_presave(sent):
         sent.owner = sent.added_by
     if sent.text:
         sent.length = len(sent.text)
-        sent.sim_hash = truncated_sim_hash(sent.text)
+        value = sim_hash(sent.text)
+        sent.sim_hash = truncate_sim_hash(value)
+        for field, block in zip(SIM_BLOCK_FIELDS, sim_hash_blocks(value)):
+            setattr(sent, field, block)
 
     return sent
 
@@ -173,296 +290,1229 @@ def import_path(path):
     return cls
 
 
+class NestedDict(defaultdict):
+    """
+    defaultdict of any depth, missing keys at every level come back as
+    empty (and so falsy) NestedDicts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(NestedDict, self).__init__(NestedDict, *args, **kwargs)
+
+
+# backends import from here, so everything they need has to be defined
+# above this line
 graph_backend = import_path(settings.GRAPH_BACKEND)
 
-def redraw_subgraph(links=[], unlinks=[]):
+LinkTuple = namedtuple('LinkTuple', 'side1_id side2_id level id')
+
+
+class UnionFind(object):
+    """
+    Disjoint sets over hashable items, with path halving and union by
+    size so long chains of unions stay close to constant time per call.
+    """
+
+    def __init__(self):
+        self.parents = {}
+        self.sizes = {}
+
+    def find(self, item):
+        parents = self.parents
+        if item not in parents:
+            parents[item] = item
+            self.sizes[item] = 1
+            return item
+
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    def union(self, item1, item2):
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            return root1
+
+        if self.sizes[root1] < self.sizes[root2]:
+            root1, root2 = root2, root1
+        self.parents[root2] = root1
+        self.sizes[root1] += self.sizes[root2]
+        return root1
+
+    def groups(self):
+        groups = defaultdict(list)
+        for item in self.parents:
+            groups[self.find(item)].append(item)
+        return groups.values()
+
+
+def chunks(items, size):
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+# keeps IN lists under the sqlite variable limit
+QUERY_CHUNK_SIZE = 500
+
+
+def values_in(queryset, field, values, *fields):
+    """
+    values_list() over the rows whose field is in values, split into as
+    many queries as it takes to keep each IN list short.
+    """
+    for chunk in chunks(values, QUERY_CHUNK_SIZE):
+        lookup = {field + '__in': chunk}
+        for row in queryset.filter(**lookup).values_list(*fields):
+            yield row
+
+
+SentenceRef = namedtuple('SentenceRef', 'id lang is_deleted')
+
+Revision = namedtuple('Revision', 'number log_id type text done_by_id done_on')
+
+
+def text_diff(old, new):
+    """
+    Word level diff of two texts as (op, old words, new words) tuples, op
+    being one of 'equal', 'replace', 'delete' or 'insert'.
+    """
+    old_words = old.split()
+    new_words = new.split()
+    matcher = SequenceMatcher(None, old_words, new_words, autojunk=False)
+    return [
+        (op, u' '.join(old_words[i1:i2]), u' '.join(new_words[j1:j2]))
+        for op, i1, i2, j1, j2 in matcher.get_opcodes()
+        ]
+
+
+class HashIdCache(object):
+    """
+    Maps sentence hash_ids to SentenceRefs. Lookups go through a per
+    process LRU of size entries first, then through the django cache
+    named by alias if there is one. Only the lang and is_deleted of a
+    ref ever change, whoever changes them calls delete_many().
+    """
+
+    def __init__(self, size=10000, alias=None, timeout=None):
+        self.size = size
+        self.alias = alias
+        self.timeout = timeout
+        self.local = OrderedDict()
+        self.lock = Lock()
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self.alias is not None and self._backend is None:
+            from django.core.cache import get_cache
+            self._backend = get_cache(self.alias)
+        return self._backend
+
+    def _keys(self, hashes):
+        # the generation is bumped by clear(), which drops every shared
+        # entry without flushing anything else stored in the same cache
+        generation = self.backend.get('pytoeba:hash_id:gen') or 0
+        return dict(
+            ('pytoeba:hash_id:%d:%s' % (generation, hash_id), hash_id)
+            for hash_id in hashes
+            )
+
+    def get_many(self, hashes):
+        found = {}
+        with self.lock:
+            for hash_id in hashes:
+                ref = self.local.pop(hash_id, None)
+                if ref is not None:
+                    self.local[hash_id] = ref
+                    found[hash_id] = ref
+
+        missing = [hash_id for hash_id in hashes if hash_id not in found]
+        if missing and self.backend is not None:
+            keys = self._keys(missing)
+            shared = dict(
+                (keys[key], SentenceRef(*ref))
+                for key, ref in self.backend.get_many(keys.keys()).iteritems()
+                )
+            self._set_local(shared)
+            found.update(shared)
+        return found
+
+    def set_many(self, refs):
+        self._set_local(refs)
+        if refs and self.backend is not None:
+            keys = self._keys(refs)
+            self.backend.set_many(
+                dict((key, tuple(refs[hash_id]))
+                     for key, hash_id in keys.iteritems()),
+                self.timeout
+                )
+
+    def _set_local(self, refs):
+        if not self.size:
+            return
+        with self.lock:
+            for hash_id, ref in refs.iteritems():
+                self.local.pop(hash_id, None)
+                self.local[hash_id] = ref
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def delete_many(self, hashes):
+        hashes = list(hashes)
+        with self.lock:
+            for hash_id in hashes:
+                self.local.pop(hash_id, None)
+        if hashes and self.backend is not None:
+            self.backend.delete_many(self._keys(hashes).keys())
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+        if self.backend is not None:
+            backend = self.backend
+            backend.add('pytoeba:hash_id:gen', 0, None)
+            backend.incr('pytoeba:hash_id:gen')
+
+
+_hash_id_cache = None
+
+
+def get_hash_id_cache():
+    """
+    The per process HashIdCache, sized by PYTOEBA_HASH_ID_CACHE_SIZE and
+    shared through the django cache named by PYTOEBA_HASH_ID_CACHE.
+    """
+    global _hash_id_cache
+    if _hash_id_cache is None:
+        _hash_id_cache = HashIdCache(
+            getattr(settings, 'PYTOEBA_HASH_ID_CACHE_SIZE', 10000),
+            getattr(settings, 'PYTOEBA_HASH_ID_CACHE', None),
+            getattr(settings, 'PYTOEBA_HASH_ID_CACHE_TIMEOUT', None)
+            )
+    return _hash_id_cache
+
+
+def get_cluster_labels(nodes, using='default'):
+    """
+    Maps every given sentence id to the id of its cluster, or to itself
+    for sentences that are not in one. Also returns the set of actual
+    cluster ids met.
+    """
     Sentence = get_model('pytoeba', 'Sentence')
+    labels = {}
+    clustered = set()
+    rows = values_in(
+        Sentence.objects.using(using), 'id', nodes, 'id', 'cluster_id'
+        )
+    for node, cluster_id in rows:
+        if cluster_id is None:
+            labels[node] = node
+        else:
+            labels[node] = cluster_id
+            clustered.add(cluster_id)
+    return labels, clustered
+
+
+def get_cluster_links(cluster_ids, using='default'):
+    """
+    Fetches every Link row inside the given translation clusters as
+    LinkTuples, grouped by cluster id. Both sides of a link always share
+    a cluster so filtering on side1 is enough.
+    """
     Link = get_model('pytoeba', 'Link')
+    rows = values_in(
+        Link.objects.using(using), 'side1__cluster_id', cluster_ids,
+        'side1__cluster_id', 'side1_id', 'side2_id', 'level', 'id'
+        )
+    cluster_links = defaultdict(list)
+    for row in rows:
+        cluster_links[row[0]].append(LinkTuple(*row[1:]))
+    return cluster_links
 
-    link_qs = Link.objects.none()
-    for link in links:
-        link_qs = link_qs | \
-             Link.objects.filter(side1_id=link[0]) | \
-             Link.objects.filter(
-                side1__in=Sentence.objects.filter(
-                    side1_set__in=Link.objects.filter(side1_id=link[0])
-                    ),
-                level=1
-                ) | \
-             Link.objects.filter(side2_id=link[0]) | \
-             Link.objects.filter(
-                side2__in=Sentence.objects.filter(
-                    side2_set__in=Link.objects.filter(side2_id=link[0])
-                    ),
-                level=1
-                ) | \
-             Link.objects.filter(side1_id=link[1]) | \
-             Link.objects.filter(
-                side1__in=Sentence.objects.filter(
-                    side1_set__in=Link.objects.filter(side1_id=link[1])
-                    ),
-                level=1
-                ) | \
-             Link.objects.filter(side2_id=link[1]) | \
-             Link.objects.filter(
-                side2__in=Sentence.objects.filter(
-                    side2_set__in=Link.objects.filter(side2_id=link[1])
-                    ),
-                level=1
-                )
 
-    unlink_qs = Link.objects.none()
-    for unlink in unlinks:
-        unlink_qs = unlink_qs | \
-            Link.objects.filter(side1_id=unlink[0], side2_id=unlink[1], level=1)
+def set_cluster(sentences, ids, cluster_id):
+    for chunk in chunks(ids, QUERY_CHUNK_SIZE):
+        sentences.filter(id__in=chunk).update(cluster_id=cluster_id)
 
-    subgraph_links = list(link_qs | unlink_qs)
-    subgraph = graph_backend(subgraph_links)
 
-    for link in links:
-        subgraph.add_edge(link[0], link[1])
+def merge_clusters(links, using='default'):
+    """
+    Folds the clusters on both ends of the given links together. The
+    biggest cluster keeps its id so only the members of the smaller ones
+    are rewritten. Sentences without a cluster count as clusters of one
+    named after themselves.
+    """
+    Sentence = get_model('pytoeba', 'Sentence')
+    sentences = Sentence.objects.using(using)
+    nodes = set(node for link in links for node in link)
+    labels, clustered = get_cluster_labels(nodes, using)
+
+    merged = UnionFind()
+    for node1, node2 in links:
+        merged.union(labels[node1], labels[node2])
+    groups = [group for group in merged.groups() if len(group) > 1]
+    if not groups:
+        return
+
+    sizes = dict(
+        values_in(
+            sentences.values('cluster_id').annotate(size=Count('id')),
+            'cluster_id', clustered, 'cluster_id', 'size'
+            )
+        )
+
+    for group in groups:
+        cluster_id = max(group, key=lambda label: sizes.get(label, 1))
+        absorbed = [l for l in group if l in clustered and l != cluster_id]
+        singles = [l for l in group if l not in clustered]
+        for chunk in chunks(absorbed, QUERY_CHUNK_SIZE):
+            sentences.filter(cluster_id__in=chunk)\
+                     .update(cluster_id=cluster_id)
+        set_cluster(sentences, singles, cluster_id)
+
+
+def split_clusters(unlinks, using='default'):
+    """
+    Rechecks only the clusters the given unlinks were in, against the
+    direct links left inside them. The part holding the sentence a
+    cluster is named after keeps the id, other parts are named after
+    their lowest sentence id and lone sentences drop out of clustering.
+    """
+    Sentence = get_model('pytoeba', 'Sentence')
+    Link = get_model('pytoeba', 'Link')
+    sentences = Sentence.objects.using(using)
+    nodes = set(node for unlink in unlinks for node in unlink)
+    cluster_ids = get_cluster_labels(nodes, using)[1]
+
+    for cluster_id in cluster_ids:
+        parts = UnionFind()
+        for node in sentences.filter(cluster_id=cluster_id)\
+                             .values_list('id', flat=True):
+            parts.find(node)
+        for node1, node2 in Link.objects.using(using)\
+                                .filter(side1__cluster_id=cluster_id, level=1)\
+                                .values_list('side1_id', 'side2_id'):
+            parts.union(node1, node2)
+
+        relabel_parts(sentences, cluster_id, parts.groups())
 
+
+def relabel_parts(sentences, cluster_id, groups):
+    if len(groups) == 1:
+        return
+
+    for group in groups:
+        if len(group) == 1:
+            set_cluster(sentences, group, None)
+        elif cluster_id not in group:
+            set_cluster(sentences, group, min(group))
+
+
+def closure_levels(nodes, edges, max_level=None):
+    """
+    Breadth first searches every given node over the undirected edges and
+    returns the level of every pair it reaches, up to max_level, as a flat
+    array of side1, side2, level triples. Flat arrays pickle far faster
+    than lists of tuples, which matters when this runs in a process pool.
+    """
+    adjacency = defaultdict(list)
+    for node1, node2 in edges:
+        adjacency[node1].append(node2)
+        adjacency[node2].append(node1)
+
+    rows = array('l')
+    for source in nodes:
+        seen = set([source])
+        frontier = [source]
+        level = 0
+        while frontier and (max_level is None or level < max_level):
+            level += 1
+            next_frontier = []
+            for node in frontier:
+                for next_node in adjacency[node]:
+                    if next_node not in seen:
+                        seen.add(next_node)
+                        next_frontier.append(next_node)
+                        rows.extend((source, next_node, level))
+            frontier = next_frontier
+
+    return rows
+
+
+def rebuild_clusters(using='default'):
+    """
+    Recomputes every cluster from scratch out of the direct links. Each
+    cluster is named after its lowest sentence id.
+    """
+    Sentence = get_model('pytoeba', 'Sentence')
+    Link = get_model('pytoeba', 'Link')
+    sentences = Sentence.objects.using(using)
+
+    clusters = UnionFind()
+    direct_links = Link.objects.using(using).filter(level=1)\
+                               .values_list('side1_id', 'side2_id')
+    for node1, node2 in direct_links.iterator():
+        clusters.union(node1, node2)
+
+    sentences.filter(cluster_id__isnull=False).update(cluster_id=None)
+    groups = clusters.groups()
+    for group in groups:
+        set_cluster(sentences, group, min(group))
+
+    return len(groups)
+
+
+def recompute_subgraphs(links=[], unlinks=[], using='default'):
+    """
+    Works out the Link rows the given (side1_id, side2_id) links and
+    unlinks create, update and delete. Edits are grouped by the cluster
+    they end up in and every group is computed on its own in-memory
+    graph, loaded with the Link rows of its clusters only. Returns the
+    created, updated and deleted links.
+    """
+    nodes = set()
+    for edge in chain(links, unlinks):
+        nodes.update(edge)
+    labels, clustered = get_cluster_labels(nodes, using)
+
+    groups = UnionFind()
+    for node1, node2 in links:
+        groups.union(labels[node1], labels[node2])
+
+    group_links = defaultdict(list)
+    for cluster_id, cluster_links in get_cluster_links(clustered, using)\
+                                        .iteritems():
+        group_links[groups.find(cluster_id)].extend(cluster_links)
+
+    group_edits = defaultdict(lambda: ([], []))
+    for link in links:
+        group_edits[groups.find(labels[link[0]])][0].append(link)
     for unlink in unlinks:
-        subgraph.remove_edge(link[0], link[1])
+        group_edits[groups.find(labels[unlink[0]])][1].append(unlink)
 
-    relinked_subgraph_links = subgraph.get_recomputed_links(
-        created=True, updated=True, deleted=True
-        )
+    created, updated, deleted = [], [], []
+    for group, (group_adds, group_removes) in group_edits.iteritems():
+        subgraph = graph_backend(group_links[group])
 
-    created = relinked_subgraph_links['created']
-    updated = relinked_subgraph_links['updated']
-    deleted = relinked_subgraph_links['deleted']
+        for link in group_adds:
+            subgraph.add_edge(link[0], link[1])
 
+        for unlink in group_removes:
+            subgraph.remove_edge(unlink[0], unlink[1])
+
+        recomputed = subgraph.get_recomputed_links(
+            created=True, updated=True, deleted=True
+            )
+        created.extend(recomputed['created'])
+        updated.extend(recomputed['updated'])
+        deleted.extend(recomputed['deleted'])
+
+    return created, updated, deleted
+
+
+def write_link_changes(created=[], updated=[], deleted=[], using='default'):
     if created:
-        created = bulk_create(created)
+        bulk_create(created, using=using)
 
     if updated:
-        bulk_update(updated, update_fields=['level'], case_fields=['side1_id', 'side2_id'])
+        bulk_update(
+            updated, update_fields=['level'],
+            case_fields=['side1_id', 'side2_id'], using=using,
+            strategy='values'
+            )
 
     if deleted:
-        bulk_delete(deleted)
+        bulk_delete(deleted, using=using)
 
 
-def fix_pythonism(value):
-    if not value:
-        if value is None:
-            value = 'NULL'
-        if isinstance(value, unicode):
-            value = '\'\''
-    if isinstance(value, bool):
-        value = unicode(value).upper()
+def redraw_subgraph(links=[], unlinks=[]):
+    """
+    Applies the given (side1_id, side2_id) links and unlinks to the graph.
+    Only the Link rows of the clusters the edited sentences are in get
+    loaded, they are the only ones whose levels can change. Clusters are
+    merged and split after the Link rows are written.
+    """
+    created, updated, deleted = recompute_subgraphs(links, unlinks)
+    write_link_changes(created, updated, deleted)
 
-    return value
+    if links:
+        merge_clusters(links)
 
+    if unlinks:
+        split_clusters(unlinks)
 
-def bulk_create(objs, using='default'):
-    ref_obj = objs[0]
-    meta = ref_obj._meta
+
+def defer_subgraph(links=[], unlinks=[], using='default'):
+    """
+    Deferred counterpart of redraw_subgraph, see PYTOEBA_DEFERRED_LINKS.
+    Only the direct Link rows are written and clusters merged right away.
+    The sentences involved are queued for process_graph_queue, which
+    recomputes the other levels and splits clusters later.
+    """
+    Link = get_model('pytoeba', 'Link')
+    GraphQueue = get_model('pytoeba', 'GraphQueue')
+    rows = Link.objects.using(using)
+    unlinks = set(unlinks)
+    # same as redrawing, an unlink wins over a link of the same pair
+    links = set(links) - unlinks
+    edges = links | unlinks
+
+    stored = {}
+    for link_id, side1, side2, level in values_in(
+            rows, 'side1_id', set(edge[0] for edge in edges),
+            'id', 'side1_id', 'side2_id', 'level'
+            ):
+        if (side1, side2) in edges:
+            stored[(side1, side2)] = (link_id, level)
+
+    promoted = [
+        stored[edge][0] for edge in links
+        if edge in stored and stored[edge][1] != 1
+        ]
+    for chunk in chunks(promoted, QUERY_CHUNK_SIZE):
+        rows.filter(id__in=chunk).update(level=1)
+
+    created = [
+        Link(side1_id=edge[0], side2_id=edge[1], level=1)
+        for edge in links if edge not in stored
+        ]
+    if created:
+        bulk_create(created, using=using)
+
+    removed = [
+        stored[edge][0] for edge in unlinks
+        if edge in stored and stored[edge][1] == 1
+        ]
+    for chunk in chunks(removed, QUERY_CHUNK_SIZE):
+        rows.filter(id__in=chunk).delete()
+
+    if links:
+        merge_clusters(links, using)
+
+    nodes = set(node for edge in edges for node in edge)
+    if nodes:
+        bulk_create(
+            [GraphQueue(sentence_id=node) for node in nodes], using=using
+            )
+
+
+def reconcile_cluster(cluster_id, using='default'):
+    """
+    Recomputes the levels of one cluster from its direct links alone and
+    writes whatever differs from the stored rows. Parts of the cluster
+    that were unlinked from the rest get cluster ids of their own.
+    Returns the number of created, updated and deleted rows.
+    """
+    Sentence = get_model('pytoeba', 'Sentence')
+    Link = get_model('pytoeba', 'Link')
+    sentences = Sentence.objects.using(using)
+    max_level = getattr(settings, 'PYTOEBA_MAX_LINK_LEVEL', None)
+
+    with transaction.atomic(using=using):
+        members = list(
+            sentences.filter(cluster_id=cluster_id)
+                     .values_list('id', flat=True)
+            )
+        stored = get_cluster_links([cluster_id], using)[cluster_id]
+        edges = set(
+            (min(link.side1_id, link.side2_id),
+             max(link.side1_id, link.side2_id))
+            for link in stored if link.level == 1
+            )
+
+        rows = closure_levels(members, edges, max_level)
+        levels = {}
+        for i in xrange(0, len(rows), 3):
+            levels[(rows[i], rows[i + 1])] = rows[i + 2]
+
+        updated, deleted = [], []
+        for link in stored:
+            level = levels.pop((link.side1_id, link.side2_id), None)
+            if level is None:
+                deleted.append(
+                    Link(side1_id=link.side1_id, side2_id=link.side2_id,
+                         level=link.level, id=link.id)
+                    )
+            elif level != link.level:
+                updated.append(
+                    Link(side1_id=link.side1_id, side2_id=link.side2_id,
+                         level=level, id=link.id)
+                    )
+        created = [
+            Link(side1_id=side1, side2_id=side2, level=new_level)
+            for (side1, side2), new_level in levels.iteritems()
+            ]
+        write_link_changes(created, updated, deleted, using)
+
+        parts = UnionFind()
+        for node in members:
+            parts.find(node)
+        for node1, node2 in edges:
+            parts.union(node1, node2)
+        relabel_parts(sentences, cluster_id, parts.groups())
+
+    return len(created), len(updated), len(deleted)
+
+
+def _reconcile_cluster(args):
+    return reconcile_cluster(*args)
+
+
+def drain_graph_queue(batch_size=1000, pool=None, using='default'):
+    """
+    Takes up to batch_size queued sentences and reconciles each of their
+    clusters once, on the given multiprocessing pool if any. The entries
+    are only dropped once every cluster went through, so a failed batch
+    is simply picked up again. Returns the number of entries and of
+    clusters handled.
+    """
+    GraphQueue = get_model('pytoeba', 'GraphQueue')
+    queue = GraphQueue.objects.using(using)
+    entries = list(
+        queue.order_by('id').values_list('id', 'sentence_id')[:batch_size]
+        )
+    if not entries:
+        return 0, 0
+
+    cluster_ids = sorted(
+        get_cluster_labels(set(entry[1] for entry in entries), using)[1]
+        )
+    tasks = [(cluster_id, using) for cluster_id in cluster_ids]
+    if pool is not None:
+        pool.map(_reconcile_cluster, tasks)
+    else:
+        map(_reconcile_cluster, tasks)
+
+    for chunk in chunks([entry[0] for entry in entries], QUERY_CHUNK_SIZE):
+        queue.filter(id__in=chunk).delete()
+
+    return len(entries), len(cluster_ids)
+
+
+# objects per bulk statement on databases that set no limit of their own,
+# parse time and memory still grow with the statement
+DEFAULT_BULK_BATCH_SIZE = 1000
+
+
+def get_batch_size(connection, params_per_obj, batch_size=None):
+    """
+    Number of objects a bulk statement takes at once. An explicit or
+    PYTOEBA_BULK_BATCH_SIZE batch size is honoured as long as the backend's
+    bulk_batch_size() allows that many objects of params_per_obj values.
+    """
+    if not batch_size:
+        batch_size = getattr(settings, 'PYTOEBA_BULK_BATCH_SIZE', None) or \
+            DEFAULT_BULK_BATCH_SIZE
+    # only the number of fields and objects matter to the backends
+    fields = [None] * max(1, params_per_obj)
+    limit = connection.ops.bulk_batch_size(fields, xrange(batch_size))
+    return max(1, min(batch_size, limit))
+
+
+def _peek(objs):
+    objs = iter(objs)
+    for obj in objs:
+        return obj, chain([obj], objs)
+    return None, objs
+
+
+def bulk_create(objs, using='default', batch_size=None):
+    """
+    Inserts objs in batches without going through save() or signals.
+    Objects with their pk set keep it, the others get one from the
+    database. Returns the objects.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+
+    connection = connections[using]
+    meta = objs[0]._meta
     model = meta.model
     fields = meta.fields
+    with_pk = [obj for obj in objs if obj.pk is not None]
+    without_pk = [obj for obj in objs if obj.pk is None]
+    generated = [f for f in fields if not isinstance(f, AutoField)]
+
+    with transaction.atomic(using=using):
+        groups = [(with_pk, fields), (without_pk, generated)]
+        for group, group_fields in groups:
+            size = get_batch_size(connection, len(group_fields), batch_size)
+            for chunk in chunks(group, size):
+                model._base_manager._insert(
+                    chunk, fields=group_fields, using=using
+                    )
 
-    return model._base_manager._insert(objs, fields=fields, using=using)
+    return objs
 
 
-def bulk_delete(objs, case_field='id', using='default', as_sql=False):
-    connection = connections[using]
-    # using objects not from the same table will break everything
-    ref_obj = objs[0]
+def _run_statements(statements, using, as_sql):
+    if as_sql:
+        return list(statements)
+
+    with transaction.atomic(using=using):
+        cursor = connections[using].cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+
+
+# statements only depend on the table, the columns and the number of rows
+# so every full batch reuses the same string
+_statement_cache = {}
+
+
+def _delete_sql(table, column, count):
+    key = ('delete', table, column, count)
+    if key not in _statement_cache:
+        _statement_cache[key] = 'DELETE FROM %s WHERE %s IN (%s)' % (
+            table, column, ', '.join(['%s'] * count)
+            )
+    return _statement_cache[key]
+
+
+def _delete_statements(objs, case_field, connection, batch_size):
+    ref_obj, objs = _peek(objs)
+    if ref_obj is None:
+        return
+
     meta = ref_obj._meta
     case_field = [f for f in meta.fields if f.attname == case_field][0]
+    qn = connection.ops.quote_name
+    table, column = qn(meta.db_table), qn(case_field.column)
+
+    for chunk in chunks(objs, get_batch_size(connection, 1, batch_size)):
+        params = [
+            case_field.get_db_prep_save(
+                getattr(obj, case_field.attname), connection
+                )
+            for obj in chunk
+            ]
+        yield _delete_sql(table, column, len(params)), params
 
-    cf_vals = []
-    for obj in objs:
-        val = getattr(obj, case_field.attname)
-        val = case_field.get_db_prep_save(val, connection)
-        val = fix_pythonism(val)
-        cf_vals.append(val)
 
-    sql = []
-    params = []
+def bulk_delete(objs, case_field='id', using='default', as_sql=False,
+                batch_size=None):
+    """
+    Deletes the rows matching the case_field of objs in batches, all in
+    one transaction. With as_sql the (sql, params) of every statement are
+    returned instead.
+    """
+    statements = _delete_statements(
+        objs, case_field, connections[using], batch_size
+        )
+    return _run_statements(statements, using, as_sql)
 
-    sql.append('DELETE FROM %s ' % meta.db_table)
-    sql.append('WHERE %s IN (%%s)' % case_field)
 
-    params.append(', '.join(cf_vals))
+def _update_sql(table, columns, case_columns, count, vendor, casts):
+    key = ('update', table, columns, case_columns, count, vendor, casts)
+    if key in _statement_cache:
+        return _statement_cache[key]
 
-    sql = ''.join(sql)
-    if as_sql:
-        return sql, params
+    indent = '    '
+    if len(case_columns) == 1:
+        when = '%sWHEN %%s THEN %s' % (indent * 3, '%s')
+    else:
+        cond = ' AND '.join('%s = %%s' % cf for cf in case_columns)
+        when = '%sWHEN (%s) THEN %%s' % (indent * 3, cond)
+
+    sets = []
+    for column, cast in zip(columns, casts):
+        then = when if not cast else when[:-2] + 'CAST(%%s AS %s)' % cast
+        if len(case_columns) == 1:
+            case = 'CASE %s' % case_columns[0]
+        else:
+            case = 'CASE'
+        sets.append('%s%s = %s\n%s\n%sEND' % (
+            indent * 2, column, case, '\n'.join([then] * count), indent * 2
+            ))
+
+    if len(case_columns) == 1:
+        where = '%s IN (%s)' % (case_columns[0], ', '.join(['%s'] * count))
+    elif vendor != 'sqlite':
+        row = '(%s)' % ', '.join(['%s'] * len(case_columns))
+        where = '(%s) IN (%s)' % (
+            ', '.join(case_columns), ', '.join([row] * count)
+            )
+    else:
+        row = '(%s)' % ' AND '.join('%s = %%s' % cf for cf in case_columns)
+        where = ' OR '.join([row] * count)
 
-    connection.cursor().execute(sql, params)
+    sql = 'UPDATE %s\n%sSET\n%s\nWHERE %s' % (
+        table, indent, ',\n'.join(sets), where
+        )
+    _statement_cache[key] = sql
+    return sql
 
 
-def bulk_update(objs, case_field='id', using='default', update_fields=[],
-                case_fields=[], as_sql=False):
-    connection = connections[using]
-    # using objects not from the same table will break everything
-    ref_obj = objs[0]
-    meta = ref_obj._meta
-    fields = meta.fields
+def _update_fields(meta, case_field, update_fields, case_fields):
+    case_fields = case_fields or [case_field]
+    case_fields = [
+        f for f in meta.fields
+        if f.attname in case_fields or f.name in case_fields
+        ]
     update_fields = update_fields or meta.get_all_field_names()
-    # get actual field object for case_field by name
-    case_field = [f for f in fields if f.attname == case_field][0]
-    if case_fields:
-        case_fields = [f for f in fields if f.attname in case_fields]
-    # filter out auto fields and fields not specified in update_fields
+    # auto fields and the fields rows are matched on never change
     fields = [
-        f
-        for f in fields
-        if not isinstance(f, AutoField) and f.attname in update_fields
+        f for f in meta.fields
+        if not isinstance(f, AutoField) and f not in case_fields and
+        (f.attname in update_fields or f.name in update_fields)
         ]
+    return case_fields, fields
 
-    # initialize cases
-    cases = {}
-    for field in fields:
-        cases[field.column] = defaultdict(dict)
 
-    # populate a case per field with case_field/field value pairs
-    # the defaultdict ensures unique values per case per case_field
+def _update_rows(objs, case_fields, fields, connection):
+    # the last object wins when several share the same case values
+    rows = OrderedDict()
     for obj in objs:
-        # get raw values appropriate for the db backend
-        if not case_fields:
-            cf_value = case_field.get_db_prep_save(
-                getattr(obj, case_field.attname), connection
+        key = tuple(
+            f.get_db_prep_save(getattr(obj, f.attname), connection)
+            for f in case_fields
+            )
+        rows.pop(key, None)
+        rows[key] = [
+            f.get_db_prep_save(getattr(obj, f.attname), connection)
+            for f in fields
+            ]
+    return rows
+
+
+def _update_statements(objs, case_field, update_fields, case_fields,
+                       connection, batch_size):
+    ref_obj, objs = _peek(objs)
+    if ref_obj is None:
+        return
+
+    meta = ref_obj._meta
+    case_fields, fields = _update_fields(
+        meta, case_field, update_fields, case_fields
+        )
+    if not fields:
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = tuple(qn(f.column) for f in fields)
+    case_columns = tuple(qn(f.column) for f in case_fields)
+    # postgres won't assign the text it types CASE results as to anything
+    # else without a cast
+    if connection.vendor == 'postgresql':
+        casts = tuple(f.db_type(connection) for f in fields)
+    else:
+        casts = (None,) * len(fields)
+
+    params_per_obj = len(fields) * (len(case_fields) + 1) + len(case_fields)
+    size = get_batch_size(connection, params_per_obj, batch_size)
+    for chunk in chunks(objs, size):
+        rows = _update_rows(chunk, case_fields, fields, connection)
+
+        params = []
+        for i in xrange(len(fields)):
+            for key, values in rows.iteritems():
+                params.extend(key)
+                params.append(values[i])
+        for key in rows:
+            params.extend(key)
+
+        sql = _update_sql(
+            table, columns, case_columns, len(rows), connection.vendor, casts
+            )
+        yield sql, params
+
+
+def _values_update_sql(table, columns, case_columns, casts, count):
+    key = ('update_values', table, columns, case_columns, casts, count)
+    if key in _statement_cache:
+        return _statement_cache[key]
+
+    names = ['v%d' % i for i in xrange(len(case_columns) + len(columns))]
+    key_names = names[:len(case_columns)]
+    value_names = names[len(case_columns):]
+    row = '(%s)' % ', '.join(['%s'] * len(names))
+    sets = ', '.join(
+        '%s = CAST(v.%s AS %s)' % (column, name, cast)
+        for column, name, cast in zip(columns, value_names, casts[1])
+        )
+    where = ' AND '.join(
+        '%s.%s = CAST(v.%s AS %s)' % (table, column, name, cast)
+        for column, name, cast in zip(case_columns, key_names, casts[0])
+        )
+    sql = 'UPDATE %s SET %s\nFROM (VALUES %s) AS v (%s)\nWHERE %s' % (
+        table, sets, ', '.join([row] * count), ', '.join(names), where
+        )
+    _statement_cache[key] = sql
+    return sql
+
+
+def _values_update_statements(objs, case_fields, fields, meta, connection,
+                              batch_size):
+    """
+    postgres: UPDATE ... FROM (VALUES ...) per batch, joined on the case
+    columns.
+    """
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = tuple(qn(f.column) for f in fields)
+    case_columns = tuple(qn(f.column) for f in case_fields)
+    casts = (
+        tuple(f.db_type(connection) for f in case_fields),
+        tuple(f.db_type(connection) for f in fields)
+        )
+
+    size = get_batch_size(
+        connection, len(case_fields) + len(fields), batch_size
+        )
+    for chunk in chunks(objs, size):
+        rows = _update_rows(chunk, case_fields, fields, connection)
+        params = []
+        for key, values in rows.iteritems():
+            params.extend(key)
+            params.extend(values)
+        yield _values_update_sql(
+            table, columns, case_columns, casts, len(rows)
+            ), params
+
+
+# temp tables only live as long as the connection and are never seen by
+# others, so one name will do
+BULK_UPDATE_TABLE = 'pytoeba_bulk_update'
+
+
+def _temp_table_update_statements(objs, case_fields, fields, meta,
+                                  connection, batch_size):
+    """
+    sqlite and mysql: the new values are loaded into a temporary table
+    keyed on the case columns and the update looks them up through its
+    primary key index.
+    """
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    temp = qn(BULK_UPDATE_TABLE)
+    columns = [qn(f.column) for f in fields]
+    case_columns = [qn(f.column) for f in case_fields]
+    mysql = connection.vendor == 'mysql'
+
+    if mysql:
+        yield 'DROP TEMPORARY TABLE IF EXISTS %s' % temp, []
+    else:
+        yield 'DROP TABLE IF EXISTS temp.%s' % temp, []
+    yield 'CREATE TEMPORARY TABLE %s (%s, PRIMARY KEY (%s))' % (
+        temp,
+        ', '.join(
+            '%s %s' % (qn(f.column), f.db_type(connection))
+            for f in case_fields + fields
+            ),
+        ', '.join(case_columns)
+        ), []
+
+    # later rows replace earlier ones with the same case values
+    insert = '%s INTO %s (%s) VALUES ' % (
+        'REPLACE' if mysql else 'INSERT OR REPLACE', temp,
+        ', '.join(case_columns + columns)
+        )
+    row = '(%s)' % ', '.join(['%s'] * (len(case_columns) + len(columns)))
+    size = get_batch_size(
+        connection, len(case_fields) + len(fields), batch_size
+        )
+    for chunk in chunks(objs, size):
+        rows = _update_rows(chunk, case_fields, fields, connection)
+        params = []
+        for key, values in rows.iteritems():
+            params.extend(key)
+            params.extend(values)
+        yield insert + ', '.join([row] * len(rows)), params
+
+    join = ' AND '.join(
+        '%s.%s = v.%s' % (table, column, column) for column in case_columns
+        )
+    if mysql:
+        yield 'UPDATE %s JOIN %s AS v ON %s SET %s' % (
+            table, temp, join,
+            ', '.join(
+                '%s.%s = v.%s' % (table, column, column) for column in columns
                 )
-            for field in fields:
-                f_value = field.get_db_prep_save(
-                    getattr(obj, field.attname), connection
-                    )
-                f_value = fix_pythonism(f_value)
-                cases[field.column].update({cf_value: f_value})
-        else:
-            cf_values = []
-            for field in case_fields:
-                cf_value = field.get_db_prep_save(
-                    getattr(obj, field.attname), connection
-                    )
-                cf_value = fix_pythonism(cf_value)
-                cf_values.append(cf_value)
-            cf_values = tuple(cf_values)
-            for field in fields:
-                f_value = field.get_db_prep_save(
-                    getattr(obj, field.attname), connection
+            ), []
+        yield 'DROP TEMPORARY TABLE %s' % temp, []
+    else:
+        exists = 'EXISTS (SELECT 1 FROM %s AS v WHERE %s)' % (temp, join)
+        yield 'UPDATE %s SET %s WHERE %s' % (
+            table,
+            ', '.join(
+                '%s = (SELECT v.%s FROM %s AS v WHERE %s)' % (
+                    column, column, temp, join
                     )
-                f_value = fix_pythonism(f_value)
-                cases[field.column].update({cf_values: f_value})
+                for column in columns
+                ),
+            exists
+            ), []
+        yield 'DROP TABLE temp.%s' % temp, []
 
-    # build sql query
-    indent = '    '
-    newline = '\n'
-    sql = []
-    params = []
-
-    sql.append('UPDATE %s' % meta.db_table)
-    sql.append(newline)
-    sql.append(indent)
-    sql.append('SET')
-    sql.append(newline)
-
-    cf_vals = set()
-    for case, values in cases.iteritems():
-
-        sql.append(indent * 2)
-        if not case_fields:
-            sql.append('%s = CASE %s' % (case, case_field.attname))
-        else:
-            sql.append('%s = CASE' % case)
-        sql.append(newline)
-
-        for cf_value, field_value in values.items():
-
-            cf_vals.add(cf_value)
-            if not case_fields:
-                sql.append(indent * 3)
-                sql.append('WHEN %s THEN %s')
-                sql.append(newline)
-                params.append(cf_value)
-                params.append(field_value)
-            else:
-                cond = []
-                for cf in case_fields:
-                    cond.append('%s = %%s' % cf.attname)
-                cond = ' AND '.join(cond)
-                sql.append(indent * 3)
-                sql.append('WHEN (%s) THEN %%s' % cond)
-                sql.append(newline)
-                for cf_v in cf_value:
-                    params.append(cf_v)
-                params.append(field_value)
-
-        sql.append(indent * 2)
-        sql.append('END,')
-        sql.append(newline)
-
-    sql.pop()
-    sql.pop()
-    sql.append('END')
-    sql.append(newline)
-
-    if not case_fields:
-        sql.append('WHERE %s IN (%%s)' % case_field.attname)
-        params.append(', '.join(str(v) for v in cf_vals))
+
+def _join_update_statements(objs, case_field, update_fields, case_fields,
+                            connection, batch_size):
+    ref_obj, objs = _peek(objs)
+    if ref_obj is None:
+        return []
+
+    meta = ref_obj._meta
+    case_fields, fields = _update_fields(
+        meta, case_field, update_fields, case_fields
+        )
+    if not fields:
+        return []
+
+    if connection.vendor == 'postgresql':
+        statements = _values_update_statements
+    elif connection.vendor in ('sqlite', 'mysql'):
+        statements = _temp_table_update_statements
     else:
-        if connection.vendor != 'sqlite': # change this connection.vendor
-            cfs = ', '.join([cf.attname for cf in case_fields])
-            sql.append('WHERE (%s) IN (%%s)' % cfs)
-            cf_param = []
-            for cf_v in cf_vals:
-                cf_param.append('(' + ', '.join(str(v) for v in cf_v) + ')')
-            params.append(', '.join(cf_param))
-        else:
-            comps = []
-            for cf in case_fields:
-                comps.append('%s = %%s' % cf.attname)
-            comps = ' AND '.join(comps)
+        return _update_statements(
+            objs, case_field, update_fields, case_fields, connection,
+            batch_size
+            )
+    return statements(objs, case_fields, fields, meta, connection, batch_size)
 
-            cond = []
-            for cf_v in cf_vals:
-                cond.append('(%s)' % comps)
-                for v in cf_v:
-                    params.append(str(v))
-            cond = ' OR '.join(cond)
 
-            sql.append('WHERE %s' % cond)
+def bulk_update(objs, case_field='id', using='default', update_fields=[],
+                case_fields=[], as_sql=False, batch_size=None,
+                strategy='case'):
+    """
+    Updates the update_fields of the rows matching objs on case_field, or
+    on every field in case_fields. All batches run in one transaction.
+    With as_sql the (sql, params) of every statement are returned instead.
+
+    The 'case' strategy issues one UPDATE ... CASE per batch, the cost of
+    which grows with the batch for every row it touches. The 'values'
+    strategy joins the table against the new values instead, through
+    UPDATE ... FROM (VALUES ...) on postgres or a temporary table on
+    sqlite and mysql, and is the one to use for large updates or for
+    matching on several case_fields.
+    """
+    connection = connections[using]
+    if strategy == 'values':
+        statements = _join_update_statements(
+            objs, case_field, update_fields, case_fields, connection,
+            batch_size
+            )
+    else:
+        statements = _update_statements(
+            objs, case_field, update_fields, case_fields, connection,
+            batch_size
+            )
+    return _run_statements(statements, using, as_sql)
 
-    sql = ''.join(sql)
-    if as_sql:
-        return sql, params
 
-    connection.cursor().execute(sql, params)
+def _is_unique(meta, fields):
+    names = set(f.name for f in fields)
+    if len(fields) == 1 and (fields[0].unique or fields[0].primary_key):
+        return True
+    return any(set(together) == names for together in meta.unique_together)
+
+
+def _upsert_features(connection):
+    """
+    (native upsert, ids returned) for the given connection.
+    """
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        connection.ensure_connection()
+        native = connection.pg_version >= 90500
+        return native, native
+    if vendor == 'sqlite':
+        from sqlite3 import sqlite_version_info
+        return sqlite_version_info >= (3, 24), sqlite_version_info >= (3, 35)
+    if vendor == 'mysql':
+        return True, False
+    return False, False
+
+
+def _upsert_sql(connection, table, columns, key_columns, updates, count,
+                returning):
+    vendor = connection.vendor
+    cache_key = (
+        'upsert', vendor, table, columns, key_columns, updates, count,
+        returning
+        )
+    if cache_key in _statement_cache:
+        return _statement_cache[cache_key]
+
+    row = '(%s)' % ', '.join(['%s'] * len(columns))
+    sql = 'INSERT INTO %s (%s)\nVALUES %s\n' % (
+        table, ', '.join(columns), ', '.join([row] * count)
+        )
+    if vendor == 'mysql':
+        sql += 'ON DUPLICATE KEY UPDATE %s' % ', '.join(
+            '%s = VALUES(%s)' % (column, column)
+            for column in updates or key_columns
+            )
+    elif updates:
+        sql += 'ON CONFLICT (%s) DO UPDATE SET %s' % (
+            ', '.join(key_columns),
+            ', '.join(
+                '%s = excluded.%s' % (column, column) for column in updates
+                )
+            )
+    else:
+        sql += 'ON CONFLICT (%s) DO NOTHING' % ', '.join(key_columns)
+
+    if returning:
+        sql += '\nRETURNING %s' % ', '.join(returning)
+    _statement_cache[cache_key] = sql
+    return sql
 
 
-def bulk_upsert(objs, case_field='id', using='default', _return=True):
+def _native_upsert(objs, key_fields, using, batch_size, return_ids):
+    connection = connections[using]
+    meta = objs[0]._meta
+    fields = [f for f in meta.fields if not isinstance(f, AutoField)]
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    columns = tuple(qn(f.column) for f in fields)
+    key_columns = tuple(qn(f.column) for f in key_fields)
+    # rows keep the time they were first added on
+    updates = tuple(
+        qn(f.column) for f in fields
+        if f not in key_fields and not getattr(f, 'auto_now_add', False)
+        )
+    pk_column = qn(meta.pk.column)
+
+    returning = ()
+    if return_ids:
+        returning = (pk_column,) + key_columns
+        if connection.vendor == 'postgresql':
+            # xmax is only set on rows that existed before the statement
+            returning += ('(xmax = 0)',)
+
+    inserted, updated = [], []
+    size = get_batch_size(connection, len(columns), batch_size)
+    with transaction.atomic(using=using):
+        cursor = connection.cursor()
+        for chunk in chunks(objs, size):
+            # a statement can't touch the same row twice, last one wins
+            rows = OrderedDict()
+            for obj in chunk:
+                values = [
+                    f.get_db_prep_save(f.pre_save(obj, True), connection)
+                    for f in fields
+                    ]
+                key = tuple(getattr(obj, f.attname) for f in key_fields)
+                rows.pop(key, None)
+                rows[key] = (obj, values)
+
+            sql = _upsert_sql(
+                connection, table, columns, key_columns, updates, len(rows),
+                returning
+                )
+            cursor.execute(
+                sql, list(chain.from_iterable(row[1] for row in rows.values()))
+                )
+            if not returning:
+                inserted.extend(row[0] for row in rows.values())
+                continue
+
+            for result in cursor.fetchall():
+                obj = rows[tuple(result[1:1 + len(key_fields)])][0]
+                obj.pk = result[0]
+                if len(result) > 1 + len(key_fields) and not result[-1]:
+                    updated.append(obj)
+                else:
+                    inserted.append(obj)
+
+    if connection.vendor != 'postgresql':
+        # there is no telling inserted rows from updated ones
+        return inserted, None
+    return inserted, updated
+
+
+def bulk_upsert(objs, case_field='id', using='default', _return=True,
+                batch_size=None):
+    """
+    Inserts objs, updating the rows that already exist instead. Rows are
+    matched on case_field, the name of a field or a list of them.
+
+    When case_field is unique and the database supports it, everything
+    is done by INSERT ... ON CONFLICT DO UPDATE on postgres 9.5+ and
+    sqlite 3.24+, or ON DUPLICATE KEY UPDATE on mysql, which matches on
+    any unique key of the table. The pks of the objects are set from the
+    database where it returns them (postgres, sqlite 3.35+). Returns
+    (inserted, updated), where the database can't tell the two apart
+    every object is in inserted and updated is None.
+
+    Otherwise the existing rows are looked up first and the objects are
+    split into a bulk_update and a bulk_create.
+    """
+    objs = list(objs)
+    if not objs:
+        return [], []
     # get some basic info about the objects, they all have to be for the same
     # table or well, things can go horribly wrong.
     ref_obj = objs[0]
     meta = ref_obj._meta
     model = meta.model
-    fields = meta.fields
+    connection = connections[using]
 
     # handle common case first, case_field is id
     # missing ids will always be inserts
     if case_field == 'id':
-        all_objs = set(objs)
-        for_insert = set(obj for obj in objs if not obj.id)
-        for_update = all_objs - for_insert
-        bulk_update(for_update, case_field, using)
-        # bypass the fucking stupid forced batch_size in django's bulk_create
-        for_insert = bulk_create(for_insert, using=using)
-        return list(for_insert), list(for_update)
+        for_insert = [obj for obj in objs if not obj.id]
+        for_update = [obj for obj in objs if obj.id]
+        with transaction.atomic(using=using):
+            bulk_update(for_update, case_field, using, batch_size=batch_size)
+            bulk_create(for_insert, using=using, batch_size=batch_size)
+        return for_insert, for_update
+
+    case_fields = [case_field] if isinstance(case_field, basestring) \
+        else list(case_field)
+    key_fields = [
+        f for name in case_fields for f in meta.fields
+        if name in (f.name, f.attname)
+        ]
+    native, return_ids = _upsert_features(connection)
+    if native and _is_unique(meta, key_fields):
+        result = _native_upsert(
+            objs, key_fields, using, batch_size, return_ids and _return
+            )
+        if _return:
+            return result
+        return
 
     # handle the more generic case
     # we don't know if some of these fields in case_field (that should be
     # unique btw, or you're fucked hardcore) are actually already there
     # so we do a select to find out
-    cf_vals = [getattr(obj, case_field) for obj in objs]
-    filter_kwargs = {case_field+'__in': cf_vals}
-    all_objs = set(objs)
-    for_update = set(model.objects.filter(**filter_kwargs))
-    for_insert = all_objs - for_update
-    bulk_update(for_update, case_field, using)
-    # bypass the fucking stupid forced batch_size in django's bulk_create
-    for_insert = model._base_manager._insert(for_insert, fields=fields, using=using)
+    def key(obj):
+        return tuple(getattr(obj, f.attname) for f in key_fields)
+
+    attnames = [f.attname for f in key_fields]
+    existing = {}
+    for row in values_in(
+            model._base_manager.using(using), attnames[0],
+            set(key(obj)[0] for obj in objs), 'pk', *attnames
+            ):
+        existing[tuple(row[1:])] = row[0]
+
+    for_insert, for_update = [], []
+    for obj in objs:
+        if key(obj) in existing:
+            obj.pk = existing[key(obj)]
+            for_update.append(obj)
+        else:
+            for_insert.append(obj)
+
+    # same as the native path, rows keep the time they were first added on
+    update_fields = [
+        f.attname for f in meta.fields
+        if not getattr(f, 'auto_now_add', False)
+        ]
+    with transaction.atomic(using=using):
+        bulk_update(
+            for_update, 'id', using, update_fields=update_fields,
+            batch_size=batch_size
+            )
+        bulk_create(for_insert, using=using, batch_size=batch_size)
 
     if _return:
-        return list(for_insert), list(for_update)
+        return for_insert, for_update
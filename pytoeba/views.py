@@ -0,0 +1,34 @@
+from django.http import StreamingHttpResponse, HttpResponseBadRequest
+from django.utils.dateparse import parse_datetime
+
+from .logexport import export_logs
+
+
+def export_log_view(request):
+    """
+    Streams the logs after the after (an ISO datetime) and after_id
+    cursor, as ?format=ndjson or csv, gzipped with ?gzip=1, at most
+    ?limit of them.
+    """
+    after = request.GET.get('after')
+    if after is not None:
+        after = parse_datetime(after)
+        if after is None:
+            return HttpResponseBadRequest('after must be an ISO datetime.')
+    try:
+        after_id = request.GET.get('after_id')
+        after_id = int(after_id) if after_id is not None else None
+        limit = request.GET.get('limit')
+        limit = int(limit) if limit is not None else None
+        chunks, content_type = export_logs(
+            request.GET.get('format', 'ndjson'),
+            compress=request.GET.get('gzip') in ('1', 'true'),
+            after=after, after_id=after_id, limit=limit
+            )
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    if request.GET.get('gzip') in ('1', 'true'):
+        response['Content-Encoding'] = 'gzip'
+    return response